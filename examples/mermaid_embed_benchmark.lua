@@ -0,0 +1,117 @@
+-- Benchmark of embedding rendered Mermaid SVGs into HTML.
+--
+--   pandoc lua examples/mermaid_embed_benchmark.lua [KB ...]
+--
+-- Compares, for synthetic diagrams of the given sizes (default 100, 500 and
+-- 2000 KB), the previous filter code with filters/mermaid_svg.lua:
+--
+--   data-uri  percent-encoding one byte at a time for a data: URI
+--   previous  multi-pass root tag tuning, then a scale pass over the whole SVG
+--   root-tag  mermaid_svg.tune(): one edit of the root <svg> tag
+--
+-- and prints the time per diagram and the embedded size.
+
+local dir = (arg and arg[0] or ''):match('^(.*)/[^/]*$') or '.'
+local svg = dofile(dir .. '/../src/md2/filters/mermaid_svg.lua')
+
+-- Shaped like mermaid-cli flowchart output: every node has its own style
+local function diagram(kb)
+  local parts = {
+    '<svg aria-roledescription="flowchart-v2" role="graphics-document document" viewBox="-8 -8 1200 900"',
+    ' style="max-width: 1200px; background-color: transparent;" class="flowchart"',
+    ' xmlns="http://www.w3.org/2000/svg" width="100%" id="my-svg">',
+    '<style>#my-svg{font-family:"trebuchet ms",verdana,arial,sans-serif;font-size:16px;fill:#333;}</style><g>',
+  }
+  local i, size = 0, 0
+  while size < kb * 1024 do
+    i = i + 1
+    local node = string.format(
+      '<g class="node default" id="flowchart-N%d" transform="translate(%d, %d)" style="opacity:1;">'
+        .. '<rect class="basic label-container" style="fill:#ECECFF;stroke:#9370DB;stroke-width:1px;"'
+        .. ' x="-60" y="-20" width="120" height="40"></rect><g class="label" style="" transform="translate(-40, -12)">'
+        .. '<foreignObject width="80" height="24"><div style="display: table-cell; white-space: nowrap;">'
+        .. '<span class="nodeLabel">Node %d &amp; co</span></div></foreignObject></g></g>',
+      i, (i * 37) % 1200, (i * 53) % 900, i)
+    parts[#parts + 1] = node
+    size = size + #node
+  end
+  parts[#parts + 1] = '</g></svg>'
+  return table.concat(parts)
+end
+
+-- Previous implementation (before mermaid_svg.lua), kept for comparison
+local function url_encode(data)
+  local result = {}
+  for i = 1, #data do
+    local c = data:sub(i, i)
+    local byte = string.byte(c)
+    if (byte >= 65 and byte <= 90) or (byte >= 97 and byte <= 122) or (byte >= 48 and byte <= 57)
+       or c == '-' or c == '_' or c == '.' or c == '~' then
+      result[#result + 1] = c
+    else
+      result[#result + 1] = string.format('%%%02X', byte)
+    end
+  end
+  return table.concat(result)
+end
+
+local function previous_tune(data, scale_num)
+  local open_tag = data:match('<svg[^>]*>')
+  local style_attr = open_tag:match('style%s*=%s*"([^"]*)"') or ''
+  local new_style = style_attr:gsub('%s*width%s*:%s*[^;]*;?', ''):gsub('%s*height%s*:%s*[^;]*;?', '')
+  if #new_style > 0 and new_style:sub(-1) ~= ';' then
+    new_style = new_style .. ';'
+  end
+  new_style = new_style .. 'width:100%;height:auto;max-width:100%;'
+  local new_open = open_tag
+    :gsub('%s+width%s*=%s*"[^"]*"', ''):gsub("%s+width%s*=%s*'[^']*'", '')
+    :gsub('%s+height%s*=%s*"[^"]*"', ''):gsub("%s+height%s*=%s*'[^']*'", '')
+  new_open = new_open:gsub('>$', ' preserveAspectRatio="xMidYMid meet">')
+  new_open = new_open:gsub('class%s*=%s*"([^"]*)"', function(c) return 'class="' .. c .. ' mermaid-svg"' end)
+  new_open = new_open:gsub('style%s*=%s*"[^"]*"', function() return 'style="' .. new_style .. '"' end)
+  local s, e = string.find(data, open_tag, 1, true)
+  local tuned = data:sub(1, s - 1) .. new_open .. data:sub(e + 1)
+  if scale_num then
+    local current_style = tuned:match('<svg[^>]-style%s*=%s*"([^"]*)"')
+    local w = current_style:match('width%s*:%s*(%d+)%%')
+    local newp = math.max(10, math.min(100, math.floor(tonumber(w) * scale_num + 0.5)))
+    local scaled = current_style:gsub('width%s*:%s*%d+%%', 'width:' .. newp .. '%%')
+    -- Rewrote every style attribute of the document, not just the root's
+    tuned = tuned:gsub('style%s*=%s*"[^"]*"', function() return 'style="' .. scaled .. '"' end)
+    tuned = tuned:gsub("style%s*=%s*'[^']*'", function() return "style='" .. scaled .. "'" end)
+  end
+  return tuned
+end
+
+local strategies = {
+  { 'data-uri', function(data) return '<img src="data:image/svg+xml,' .. url_encode(previous_tune(data)) .. '" />' end },
+  { 'previous', function(data) return previous_tune(data, 0.8) end },
+  { 'root-tag', function(data) return svg.tune(data, { scale = 0.8 }) end },
+}
+
+local function measure(fn, data)
+  local runs, out = 0, nil
+  local start = os.clock()
+  repeat
+    out = fn(data)
+    runs = runs + 1
+  until os.clock() - start > 0.5 and runs >= 3
+  return (os.clock() - start) / runs, #out
+end
+
+local sizes = {}
+for _, a in ipairs(arg or {}) do
+  sizes[#sizes + 1] = tonumber(a)
+end
+if #sizes == 0 then
+  sizes = { 100, 500, 2000 }
+end
+
+print(string.format('%-8s %-9s %12s %12s', 'SVG KB', 'strategy', 'ms/diagram', 'output KB'))
+for _, kb in ipairs(sizes) do
+  local data = diagram(kb)
+  for _, strategy in ipairs(strategies) do
+    local seconds, bytes = measure(strategy[2], data)
+    print(string.format('%-8d %-9s %12.2f %12.1f', #data // 1024, strategy[1], seconds * 1000, bytes / 1024))
+  end
+end
@@ -0,0 +1,530 @@
+"""
+asyncio counterparts of :mod:`md2.conversion`.
+
+The coroutines plan their container invocations with the same code as the
+blocking functions and run them with ``asyncio.create_subprocess_exec``, so
+they can be awaited from an event loop without executor threads.
+
+- ``jobs`` (an int or ``"auto"``) bounds concurrency per call; pass a shared
+  ``semaphore`` to bound it across calls instead.
+- Cancelling a conversion kills the container of every job still running.
+- ``as_completed`` yields a :class:`Result` per document as soon as it
+  finishes; close it (``contextlib.aclosing``) to stop early.
+- Like the blocking functions, inputs whose output is up to date are
+  skipped (``force=True`` converts them anyway); their results have
+  ``skipped`` set and come first.
+
+Jobs run in one-shot containers (``MD2_WORKER`` is not used here) or, with
+``backend="native"``, directly on the host.
+"""
+import asyncio
+import contextlib
+import os
+import signal
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Union
+
+from . import native
+from . import runtime as rt
+from .conversion import (
+    ConversionError,
+    _Job,
+    _build_state,
+    _check_mermaid_mode,
+    _docx_flags,
+    _error_message,
+    _html_flags,
+    _pdf_env,
+    _plan_html2pdf,
+    _plan_md2docx,
+    _plan_md2html,
+    prepare_runtime,
+    resolve_jobs,
+)
+from .analysis import DocumentAnalysis
+from .manifest import BuildOutputs, BuildState
+
+PathLike = Union[str, Path]
+
+
+@dataclass
+class Result:
+    """Outcome of converting one document."""
+
+    source: Path
+    output: Path
+    error: Optional[str] = None
+    log: str = ""
+    # Up to date, not converted again
+    skipped: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+async def _remove_container(runtime: str, name: str) -> None:
+    proc = await asyncio.create_subprocess_exec(
+        runtime,
+        "rm",
+        "-f",
+        name,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    await proc.wait()
+
+
+async def _start_native(job: _Job) -> "asyncio.subprocess.Process":
+    tools = await asyncio.to_thread(native.discover)
+    if job.chromium:
+        await asyncio.to_thread(native.check_pdf_tools, tools)
+    argv, env, cwd = native.command(job.mounts, job.env, job.inner, tools)
+    # Own process group, so cancelling also kills pandoc/Chromium children
+    return await asyncio.create_subprocess_exec(
+        *argv,
+        env=env,
+        cwd=cwd,
+        start_new_session=True,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+    )
+
+
+async def _run_job(runtime: str, job: _Job, semaphore: asyncio.Semaphore) -> Result:
+    try:
+        async with semaphore:
+            name = f"md2-{uuid.uuid4().hex[:12]}"
+            if runtime == native.NATIVE:
+                proc = await _start_native(job)
+            else:
+                cmd = rt.container_command(
+                    runtime,
+                    job.mounts,
+                    job.env,
+                    job.inner,
+                    security=job.security,
+                    name=name,
+                )
+                proc = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.STDOUT,
+                )
+            try:
+                out, _ = await proc.communicate()
+            except asyncio.CancelledError:
+                if runtime == native.NATIVE:
+                    if proc.returncode is None:
+                        with contextlib.suppress(ProcessLookupError):
+                            os.killpg(proc.pid, signal.SIGKILL)
+                    raise
+                # Killing the client does not stop the container, remove it by name.
+                if proc.returncode is None:
+                    proc.kill()
+                await asyncio.shield(_remove_container(runtime, name))
+                raise
+    finally:
+        job.remove_temp_files()
+
+    log = out.decode("utf-8", errors="replace")
+    error = None
+    if proc.returncode != 0:
+        error = _error_message(log, proc.returncode)
+        if runtime != native.NATIVE:
+            await asyncio.to_thread(rt.check_image_after_failure, runtime, proc.returncode)
+    return Result(job.source, job.output, error, log)
+
+
+async def _stream(
+    tasks: List["asyncio.Task[Result]"], jobs: List[_Job]
+) -> AsyncIterator[Result]:
+    """Yield task results as they finish; pending tasks are cancelled on exit.
+
+    The temporary files of ``jobs`` are removed on exit too: a task cancelled
+    before it started never reaches the cleanup in ``_run_job``.
+    """
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        pending = [t for t in tasks if not t.done()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for job in jobs:
+            job.remove_temp_files()
+
+
+async def _prepare(runtime: Optional[str], ensure: bool, backend: Optional[str]) -> str:
+    return await asyncio.to_thread(prepare_runtime, runtime, ensure, backend)
+
+
+def _semaphore(
+    jobs: Union[int, str, None], semaphore: Optional[asyncio.Semaphore]
+) -> asyncio.Semaphore:
+    return semaphore or asyncio.Semaphore(resolve_jobs(jobs))
+
+
+async def _stream_jobs(
+    runtime: str, planned: List[_Job], semaphore: asyncio.Semaphore
+) -> AsyncIterator[Result]:
+    tasks = [asyncio.create_task(_run_job(runtime, job, semaphore)) for job in planned]
+    async for result in _stream(tasks, planned):
+        yield result
+
+
+async def _select(
+    build: BuildState,
+    input_paths: List[PathLike],
+    suffix: str,
+    files: List[PathLike],
+    analyses: Optional[Dict[Path, DocumentAnalysis]] = None,
+) -> List[Path]:
+    return await asyncio.to_thread(build.select, input_paths, suffix, files, analyses)
+
+
+def _skipped(build: BuildState) -> List[Result]:
+    return [Result(build.sources[output], output, skipped=True) for output in build.skipped]
+
+
+async def _recorded(build: BuildState, stream: AsyncIterator[Result]) -> AsyncIterator[Result]:
+    """Pass ``stream`` on, recording the manifests of the outputs written."""
+    async for result in stream:
+        if result.ok:
+            build.record(result.output)
+        yield result
+
+
+async def _stream_md2html(
+    input_paths: List[PathLike],
+    css: Optional[str] = None,
+    dialect: str = "pandoc",
+    markdown_flags: Optional[List[str]] = None,
+    html_title: Optional[str] = None,
+    title: Optional[str] = None,
+    html_css: Optional[str] = None,
+    runtime: Optional[str] = None,
+    ensure: bool = True,
+    self_contained: bool = True,
+    add_toc_placeholders: bool = False,
+    letter: bool = False,
+    jobs: Union[int, str, None] = "auto",
+    semaphore: Optional[asyncio.Semaphore] = None,
+    backend: Optional[str] = None,
+    prerender_math: bool = False,
+    assets_dir: Optional[PathLike] = None,
+    mermaid: str = "server",
+    mount_images: bool = False,
+    offline: bool = False,
+    force: bool = False,
+) -> AsyncIterator[Result]:
+    markdown_flags = _html_flags(markdown_flags, letter)
+    _check_mermaid_mode(mermaid)
+    semaphore = _semaphore(jobs, semaphore)
+    build = _build_state(
+        "html",
+        backend,
+        force,
+        css=css,
+        dialect=dialect,
+        markdown_flags=markdown_flags,
+        html_title=html_title,
+        title=title,
+        html_css=html_css,
+        self_contained=self_contained,
+        add_toc_placeholders=add_toc_placeholders,
+        letter=letter,
+        prerender_math=prerender_math,
+        assets_dir=assets_dir,
+        mermaid=mermaid,
+        mount_images=mount_images,
+        offline=offline,
+    )
+    stale = await _select(build, input_paths, ".html", [css] if css else [])
+    for result in _skipped(build):
+        yield result
+    if not stale:
+        return
+    runtime = await _prepare(runtime, ensure, backend)
+    planned = await asyncio.to_thread(
+        _plan_md2html,
+        runtime,
+        stale,
+        markdown_flags,
+        css=css,
+        dialect=dialect,
+        html_title=html_title,
+        title=title,
+        html_css=html_css,
+        self_contained=self_contained,
+        add_toc_placeholders=add_toc_placeholders,
+        letter=letter,
+        prerender_math=prerender_math,
+        assets_dir=assets_dir,
+        mermaid=mermaid,
+        mount_images=mount_images,
+        offline=offline,
+        analyses=build.analyses,
+    )
+    async for result in _recorded(build, _stream_jobs(runtime, planned, semaphore)):
+        yield result
+
+
+async def _stream_html2pdf(
+    input_paths: List[PathLike],
+    runtime: Optional[str] = None,
+    ensure: bool = True,
+    page_numbers: bool = True,
+    jobs: Union[int, str, None] = "auto",
+    semaphore: Optional[asyncio.Semaphore] = None,
+    backend: Optional[str] = None,
+    toc_json: bool = False,
+    optimize_pdf: Optional[str] = None,
+) -> AsyncIterator[Result]:
+    semaphore = _semaphore(jobs, semaphore)
+    runtime = await _prepare(runtime, ensure, backend)
+    planned = _plan_html2pdf(input_paths, page_numbers, toc_json, optimize_pdf)
+    async for result in _stream_jobs(runtime, planned, semaphore):
+        yield result
+
+
+async def _stream_md2pdf(
+    input_paths: List[PathLike],
+    css: Optional[str] = None,
+    dialect: str = "pandoc",
+    markdown_flags: Optional[List[str]] = None,
+    html_title: Optional[str] = None,
+    title: Optional[str] = None,
+    html_css: Optional[str] = None,
+    runtime: Optional[str] = None,
+    ensure: bool = True,
+    self_contained: bool = True,
+    page_numbers: bool = True,
+    letter: bool = False,
+    jobs: Union[int, str, None] = "auto",
+    semaphore: Optional[asyncio.Semaphore] = None,
+    backend: Optional[str] = None,
+    prerender_math: bool = False,
+    toc_json: bool = False,
+    optimize_pdf: Optional[str] = None,
+    mount_images: bool = False,
+    offline: bool = False,
+    force: bool = False,
+) -> AsyncIterator[Result]:
+    markdown_flags = _html_flags(markdown_flags, letter)
+    _pdf_env(optimize_pdf=optimize_pdf)  # reject unknown levels before starting
+    semaphore = _semaphore(jobs, semaphore)
+    build = _build_state(
+        "pdf",
+        backend,
+        force,
+        css=css,
+        dialect=dialect,
+        markdown_flags=markdown_flags,
+        html_title=html_title,
+        title=title,
+        html_css=html_css,
+        self_contained=self_contained,
+        page_numbers=page_numbers,
+        letter=letter,
+        prerender_math=prerender_math,
+        toc_json=toc_json,
+        optimize_pdf=optimize_pdf,
+        mount_images=mount_images,
+        offline=offline,
+    )
+    stale = await _select(build, input_paths, ".pdf", [css] if css else [])
+    for result in _skipped(build):
+        yield result
+    if not stale:
+        return
+    # Like md2pdf, which goes through md2html: up-to-date HTML is reused and
+    # the HTML written gets its manifest
+    html_build = _build_state(
+        "html",
+        backend,
+        force,
+        css=css,
+        dialect=dialect,
+        markdown_flags=markdown_flags,
+        html_title=html_title,
+        title=title,
+        html_css=html_css,
+        self_contained=self_contained,
+        add_toc_placeholders=False,
+        letter=letter,
+        prerender_math=prerender_math,
+        assets_dir=None,
+        mermaid="server",
+        mount_images=mount_images,
+        offline=offline,
+    )
+    html_stale = await _select(
+        html_build, stale, ".html", [css] if css else [], build.analyses
+    )
+    runtime = await _prepare(runtime, ensure, backend)
+    planned = await asyncio.to_thread(
+        _plan_md2html,
+        runtime,
+        html_stale,
+        markdown_flags,
+        css=css,
+        dialect=dialect,
+        html_title=html_title,
+        title=title,
+        html_css=html_css,
+        self_contained=self_contained,
+        add_toc_placeholders=False,
+        letter=letter,
+        prerender_math=prerender_math,
+        mount_images=mount_images,
+        offline=offline,
+        analyses=html_build.analyses,
+    )
+    html_jobs = {job.source: job for job in planned}
+
+    async def convert(source: Path) -> Result:
+        # Each document goes on to PDF as soon as its own HTML is ready.
+        log = ""
+        html_job = html_jobs.get(source)
+        if html_job is not None:
+            html = await _run_job(runtime, html_job, semaphore)
+            if not html.ok:
+                return html
+            html_build.record(html.output)
+            log = html.log
+        html_output = source.with_suffix(".html")
+        pdf_job = _plan_html2pdf([html_output], page_numbers, toc_json, optimize_pdf)[0]
+        pdf = await _run_job(runtime, pdf_job, semaphore)
+        return Result(source, pdf.output, pdf.error, log + pdf.log)
+
+    tasks = [asyncio.create_task(convert(source)) for source in stale]
+    async for result in _recorded(build, _stream(tasks, planned)):
+        yield result
+
+
+async def _stream_md2docx(
+    input_paths: List[PathLike],
+    dialect: str = "pandoc",
+    markdown_flags: Optional[List[str]] = None,
+    title: Optional[str] = None,
+    reference_doc: Optional[PathLike] = None,
+    runtime: Optional[str] = None,
+    ensure: bool = True,
+    jobs: Union[int, str, None] = "auto",
+    semaphore: Optional[asyncio.Semaphore] = None,
+    backend: Optional[str] = None,
+    mount_images: bool = False,
+    offline: bool = False,
+    force: bool = False,
+) -> AsyncIterator[Result]:
+    markdown_flags = _docx_flags(markdown_flags)
+    semaphore = _semaphore(jobs, semaphore)
+    build = _build_state(
+        "docx",
+        backend,
+        force,
+        dialect=dialect,
+        markdown_flags=markdown_flags,
+        title=title,
+        reference_doc=reference_doc,
+        mount_images=mount_images,
+        offline=offline,
+    )
+    stale = await _select(build, input_paths, ".docx", [reference_doc] if reference_doc else [])
+    for result in _skipped(build):
+        yield result
+    if not stale:
+        return
+    runtime = await _prepare(runtime, ensure, backend)
+    planned = await asyncio.to_thread(
+        _plan_md2docx,
+        stale,
+        markdown_flags,
+        dialect,
+        title,
+        reference_doc,
+        runtime=runtime,
+        mount_images=mount_images,
+        offline=offline,
+        analyses=build.analyses,
+    )
+    async for result in _recorded(build, _stream_jobs(runtime, planned, semaphore)):
+        yield result
+
+
+async def _collect(
+    input_paths: List[PathLike], stream: AsyncIterator[Result]
+) -> List[Path]:
+    """Drain ``stream``; outputs keep input order, failures raise ConversionError."""
+    position = {Path(p).resolve(): i for i, p in enumerate(input_paths)}
+    results = [r async for r in stream]
+    results.sort(key=lambda r: position.get(r.source, len(position)))
+    failures: Dict[Path, str] = {r.source: r.error for r in results if r.error}
+    outputs = [r.output for r in results if r.ok]
+    if failures:
+        raise ConversionError(failures, outputs)
+    rebuilt = [r.output for r in results if r.ok and not r.skipped]
+    return BuildOutputs(outputs, rebuilt, [r.output for r in results if r.skipped])
+
+
+async def md2html(input_paths: List[PathLike], **options) -> List[Path]:
+    """Async :func:`md2.conversion.md2html`; takes its options except ``batch``."""
+    return await _collect(input_paths, _stream_md2html(input_paths, **options))
+
+
+async def html2pdf(input_paths: List[PathLike], **options) -> List[Path]:
+    """Async :func:`md2.conversion.html2pdf`; takes its options except ``batch``."""
+    return await _collect(input_paths, _stream_html2pdf(input_paths, **options))
+
+
+async def md2pdf(input_paths: List[PathLike], **options) -> List[Path]:
+    """Async :func:`md2.conversion.md2pdf`; takes its options except ``batch``.
+
+    Every document continues to PDF as soon as its HTML is ready.
+    """
+    return await _collect(input_paths, _stream_md2pdf(input_paths, **options))
+
+
+async def md2docx(input_paths: List[PathLike], **options) -> List[Path]:
+    """Async :func:`md2.conversion.md2docx`; takes its options except ``batch``."""
+    return await _collect(input_paths, _stream_md2docx(input_paths, **options))
+
+
+_STREAMS: Dict[str, Callable[..., AsyncIterator[Result]]] = {
+    "md2html": _stream_md2html,
+    "html2pdf": _stream_html2pdf,
+    "md2pdf": _stream_md2pdf,
+    "md2docx": _stream_md2docx,
+}
+
+
+def as_completed(
+    conversion: Union[str, Callable[..., Awaitable[List[Path]]]],
+    input_paths: List[PathLike],
+    **options,
+) -> AsyncIterator[Result]:
+    """Run ``conversion`` and yield a :class:`Result` as each document finishes.
+
+    ``conversion`` is one of the coroutines of this module or its name::
+
+        async for result in as_completed(md2pdf, paths, jobs=4):
+            print(result.source, result.error or result.output)
+
+    Failures are yielded, not raised. Closing the iterator cancels the
+    remaining documents and removes their containers and temporary files.
+    ``break`` alone leaves it open until it is garbage collected, so wrap it
+    in ``contextlib.aclosing`` to stop early::
+
+        async with contextlib.aclosing(as_completed(md2html, paths)) as results:
+            async for result in results:
+                if result.error:
+                    break
+    """
+    name = conversion if isinstance(conversion, str) else conversion.__name__
+    if name not in _STREAMS:
+        raise ValueError(f"Unknown conversion: {name!r}")
+    return _STREAMS[name](input_paths, **options)
@@ -0,0 +1,125 @@
+"""
+Single-pass analysis of a Markdown input on the host.
+
+Planning a conversion needs the document title, the number of H1 headings,
+the local images to make visible to the container and whether remote images
+have to be validated. ``analyze_markdown`` reads each input once and derives
+all of it from one scan: fenced code blocks are located first and skipped, so
+``# comment`` lines in a shell snippet are not counted as headings and image
+syntax in code is not copied or fetched.
+"""
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+
+FENCE_RE = re.compile(r"^[ \t]*(`{3,}|~{3,})(.*)$", re.MULTILINE)
+# A code span cannot continue past a blank line (the end of its paragraph)
+CODE_SPAN_RE = re.compile(r"(`+)(?:[^\n]|\n(?!\s*\n))*?(?<!`)\1(?!`)")
+ATX_H1_RE = re.compile(r"^# (.*)$", re.MULTILINE)
+SETEXT_H1_RE = re.compile(r"^(.+)\n=+[ \t]*$", re.MULTILINE)
+# ![alt](path) and ![alt](path "title"); <img src="path" ...>
+MD_IMAGE_RE = re.compile(r'!\[[^\]]*\]\(([^)\s"]+)')
+HTML_IMAGE_RE = re.compile(r'<img[^>]+src=["\']([^"\']+)["\']', re.IGNORECASE)
+
+REMOTE_PREFIXES = ("http://", "https://")
+
+
+@dataclass
+class DocumentAnalysis:
+    """What conversions need to know about one Markdown file."""
+
+    path: Path
+    text: str = field(default="", repr=False)
+    h1_titles: list[str] = field(default_factory=list)
+    # Existing image files referenced with a relative or absolute path
+    local_images: set[Path] = field(default_factory=set)
+    remote_images: list[str] = field(default_factory=list)
+
+    @property
+    def h1_count(self) -> int:
+        return len(self.h1_titles)
+
+    def title(self, title_override: str | None = None) -> str:
+        """The override, else the only H1 heading, else the file name stem."""
+        if title_override:
+            return title_override
+        if self.h1_count == 1 and self.h1_titles[0]:
+            return self.h1_titles[0]
+        return self.path.stem
+
+    def external_images(self) -> set[Path]:
+        """Local images outside the document's directory (not visible under /work)."""
+        base = str(self.path.parent)
+        return {img for img in self.local_images if not str(img).startswith(base)}
+
+
+def fenced_blocks(text: str) -> list[tuple[int, int, str]]:
+    """``(start, end, info)`` of each fenced code block; an unclosed one runs to the end."""
+    blocks: list[tuple[int, int, str]] = []
+    opening = None
+    for m in FENCE_RE.finditer(text):
+        marker, info = m.group(1), m.group(2)
+        if opening is None:
+            # Backtick fences cannot have backticks in their info string
+            if marker[0] == "`" and "`" in info:
+                continue
+            opening = (m.start(), marker, info.strip())
+        elif marker[0] == opening[1][0] and len(marker) >= len(opening[1]) and not info.strip():
+            blocks.append((opening[0], m.end(), opening[2]))
+            opening = None
+    if opening is not None:
+        blocks.append((opening[0], len(text), opening[2]))
+    return blocks
+
+
+def _prose(text: str) -> str:
+    """Text outside fenced code blocks."""
+    parts: list[str] = []
+    start = 0
+    for block_start, block_end, _ in fenced_blocks(text):
+        parts.append(text[start:block_start])
+        start = block_end
+    parts.append(text[start:])
+    # Blank lines keep text around a removed block from joining into headings
+    return "\n\n".join(parts)
+
+
+def analyze_text(path: str | Path, text: str) -> DocumentAnalysis:
+    """Analyze ``text``, the content of ``path`` (used to resolve images)."""
+    path = Path(path).resolve()
+    prose = CODE_SPAN_RE.sub("", _prose(text))
+
+    headings = [(m.start(), m.group(1).strip()) for m in ATX_H1_RE.finditer(prose)]
+    headings += [(m.start(), m.group(1).strip()) for m in SETEXT_H1_RE.finditer(prose)]
+    headings.sort()
+
+    local: set[Path] = set()
+    remote: list[str] = []
+    refs = MD_IMAGE_RE.findall(prose) + HTML_IMAGE_RE.findall(prose)
+    for ref in refs:
+        if ref.startswith(REMOTE_PREFIXES):
+            if ref not in remote:
+                remote.append(ref)
+            continue
+        if ref.startswith("data:"):
+            continue
+        img = Path(ref)
+        resolved = img if img.is_absolute() else path.parent / img
+        try:
+            if resolved.exists():
+                local.add(resolved.resolve())
+        except OSError:
+            continue
+
+    return DocumentAnalysis(
+        path=path,
+        text=text,
+        h1_titles=[title for _, title in headings],
+        local_images=local,
+        remote_images=remote,
+    )
+
+
+def analyze_markdown(path: str | Path) -> DocumentAnalysis:
+    """Read ``path`` once and analyze it; raises OSError or UnicodeDecodeError."""
+    return analyze_text(path, Path(path).read_bytes().decode("utf-8"))
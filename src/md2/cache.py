@@ -0,0 +1,174 @@
+"""
+Persistent render caches shared by all conversions.
+
+Renderers inside the container (``filters/mermaid.lua``) keep their output
+in a host directory mounted at ``/cache/<name>``, stored as
+``<key[:2]>/<key><ext>``, and append one ``hit <file>`` or ``miss <file>``
+line per lookup to ``journal.log`` there. The host folds the journal into
+persistent hit/miss counters, marks hit entries as recently used and evicts
+the least recently used entries once the cache grows beyond its size limit
+(``MD2_CACHE_MAX_MB``, default 256 MB per cache).
+
+Caches are synced whenever a conversion using them is planned and whenever
+their stats are read.
+"""
+import json
+import os
+import shutil
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import List, Optional
+
+from . import runtime as rt
+
+DEFAULT_MAX_MB = 256
+JOURNAL = "journal.log"
+STATS = "stats.json"
+# Renders interrupted before their rename are removed after this long
+STALE_TMP_SECONDS = 3600
+
+
+def _max_bytes() -> int:
+    try:
+        mb = float(os.environ.get("MD2_CACHE_MAX_MB", DEFAULT_MAX_MB))
+    except ValueError:
+        mb = DEFAULT_MAX_MB
+    return max(0, int(mb * 1024 * 1024))
+
+
+@dataclass
+class CacheStats:
+    """Lifetime lookup counters and current size of a cache."""
+
+    hits: int = 0
+    misses: int = 0
+    entries: int = 0
+    size: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class RenderCache:
+    """A content-addressed, size-bounded cache directory under ``cache_dir()``."""
+
+    def __init__(self, name: str, max_bytes: Optional[int] = None):
+        self.name = name
+        self.path = rt.cache_dir(name)
+        self.max_bytes = _max_bytes() if max_bytes is None else max_bytes
+
+    @property
+    def container_path(self) -> str:
+        return f"/cache/{self.name}"
+
+    def mount(self) -> rt.Mount:
+        return (self.path, self.container_path, False)
+
+    def _entries(self) -> List[Path]:
+        entries = []
+        for sub in self.path.iterdir():
+            if sub.is_dir() and len(sub.name) == 2:
+                entries.extend(p for p in sub.iterdir() if p.is_file())
+        return entries
+
+    def _load(self) -> CacheStats:
+        try:
+            data = json.loads((self.path / STATS).read_text(encoding="utf-8"))
+            return CacheStats(
+                hits=int(data.get("hits", 0)),
+                misses=int(data.get("misses", 0)),
+                evictions=int(data.get("evictions", 0)),
+            )
+        except (OSError, ValueError, AttributeError):
+            return CacheStats()
+
+    def _save(self, stats: CacheStats) -> None:
+        data = {k: v for k, v in asdict(stats).items() if k in ("hits", "misses", "evictions")}
+        tmp = self.path / f"{STATS}.{uuid.uuid4().hex}"
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp, self.path / STATS)
+
+    def _fold_journal(self, stats: CacheStats) -> None:
+        # Renderers keep appending to a fresh journal while this one is read
+        taken = self.path / f"{JOURNAL}.{os.getpid()}.{uuid.uuid4().hex}"
+        try:
+            os.replace(self.path / JOURNAL, taken)
+        except FileNotFoundError:
+            return
+        try:
+            lines = taken.read_text(encoding="utf-8", errors="replace").splitlines()
+        finally:
+            taken.unlink()
+        now = time.time()
+        for line in lines:
+            kind, _, name = line.partition(" ")
+            if kind == "hit":
+                stats.hits += 1
+                # Entries are evicted by mtime: a hit makes one recently used
+                entry = self.path / name[:2] / name
+                try:
+                    os.utime(entry, (now, now))
+                except OSError:
+                    pass
+            elif kind == "miss":
+                stats.misses += 1
+
+    def prune(self, stats: Optional[CacheStats] = None) -> int:
+        """Evict least recently used entries beyond ``max_bytes``; returns the count."""
+        now = time.time()
+        entries = []
+        for path in self._entries():
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            if ".tmp" in path.name:
+                if now - st.st_mtime > STALE_TMP_SECONDS:
+                    path.unlink(missing_ok=True)
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        if stats is not None:
+            stats.evictions += removed
+        return removed
+
+    def sync(self) -> CacheStats:
+        """Fold the journal into the counters and evict; returns the current stats."""
+        stats = self._load()
+        self._fold_journal(stats)
+        self.prune(stats)
+        self._save(stats)
+        for path in self._entries():
+            if ".tmp" in path.name:
+                continue
+            try:
+                stats.size += path.stat().st_size
+            except OSError:
+                continue
+            stats.entries += 1
+        return stats
+
+    def stats(self) -> CacheStats:
+        return self.sync()
+
+    def clear(self) -> None:
+        """Remove every entry and reset the counters."""
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+
+def mermaid_cache() -> RenderCache:
+    """Rendered Mermaid diagrams (``filters/mermaid.lua``)."""
+    return RenderCache("mermaid")
@@ -1,8 +1,17 @@
+import os
 import sys
 from pathlib import Path
-from typing import List, Optional
-from .conversion import md2html, md2pdf, html2pdf, md2docx
+from typing import List, Optional, Union
+from .conversion import (
+    PDF_OPTIMIZE_LEVELS,
+    ConversionError,
+    md2html,
+    md2pdf,
+    html2pdf,
+    md2docx,
+)
 from . import runtime as rt
+from .manifest import BuildOutputs
 
 
 LETTER_INCOMPATIBLE_MARKDOWN_FLAGS = {"--fno-html", "--fno-html-blocks"}
@@ -16,6 +25,38 @@ def _reject_incompatible_letter_flags(markdown_flags: List[str]) -> None:
         sys.exit(2)
 
 
+def _run_conversion(convert, files: List[str], **kwargs) -> None:
+    try:
+        outputs = convert([Path(f) for f in files], **kwargs)
+    except ConversionError as exc:
+        print(exc, file=sys.stderr)
+        sys.exit(1)
+    if isinstance(outputs, BuildOutputs):
+        print(f"{convert.__name__}: {outputs.summary()}", file=sys.stderr)
+
+
+def _parse_jobs(value: str, usage) -> Union[int, str]:
+    if value == "auto":
+        return value
+    if value.isdigit() and int(value) > 0:
+        return int(value)
+    print(
+        f"--jobs expects a positive integer or 'auto', got {value!r}", file=sys.stderr
+    )
+    usage()
+    return 1
+
+
+def _parse_optimize_pdf(arg: str, usage) -> str:
+    level = arg.split("=", 1)[1] if "=" in arg else "max"
+    if level in PDF_OPTIMIZE_LEVELS:
+        return level
+    levels = ", ".join(PDF_OPTIMIZE_LEVELS)
+    print(f"--optimize-pdf expects one of {levels}, got {level!r}", file=sys.stderr)
+    usage()
+    return level
+
+
 def usage_md2html() -> None:
     usage = """Usage: md2html [options] file1.md [file2.md ...]
 
@@ -62,10 +103,24 @@ HTML generator options:
     --no-toc         Disable Table of Contents (default: enabled)
     --toc-depth=N    TOC depth (levels), default per Pandoc
     --letter         Format as a professional letter for a windowed envelope; disables TOC
+    --prerender-math Render math to cached static SVG instead of loading MathJax
       --html-title=TITLE Sets the title of the document
       --title=TITLE    Sets the title of the document (overrides auto-detection and html-title)
       --html-css=URL   In full HTML or XHTML mode add a css link
       --css=PATH       CSS file to use for styling
+    --assets-dir[=DIR]
+                     Write CSS, MathJax, images and Mermaid SVGs once to a shared,
+                     content-hashed directory (default: _assets next to the inputs)
+    --mermaid=MODE   Render Mermaid diagrams on the server (default) or lazily in the
+                     browser ('client': links mermaid.js, implies non-self-contained HTML)
+    --mount-images   Mount the directories of images outside the input's directory
+                     read-only instead of copying the images next to the input
+    --offline        Use only remote images already in the remote image cache
+    --force          Convert every input, even if its output is up to date
+
+Batch options:
+    --batch          Convert all files in a single container invocation
+    -j, --jobs=N     Convert N files concurrently ('auto': size from CPUs and memory)
 """
     print(usage, file=sys.stderr)
     sys.exit(1)
@@ -82,6 +137,14 @@ def main_md2html(argv: Optional[List[str]] = None) -> None:
     title = None
     html_css = None
     letter = False
+    prerender_math = False
+    assets_dir: Union[str, bool, None] = None
+    mermaid = "server"
+    mount_images = False
+    offline = False
+    force = False
+    batch = False
+    jobs = None
     files = []
     i = 0
 
@@ -121,6 +184,42 @@ def main_md2html(argv: Optional[List[str]] = None) -> None:
             if not letter:
                 markdown_flags.append(arg)
             i += 1
+        elif arg == "--prerender-math":
+            prerender_math = True
+            i += 1
+        elif arg == "--assets-dir":
+            assets_dir = True
+            i += 1
+        elif arg.startswith("--assets-dir="):
+            assets_dir = arg[13:]  # len("--assets-dir=")
+            i += 1
+        elif arg.startswith("--mermaid="):
+            mermaid = arg[10:]  # len("--mermaid=")
+            if mermaid not in ("server", "client"):
+                print(f"Invalid --mermaid mode: {mermaid} (expected server or client)", file=sys.stderr)
+                usage_md2html()
+            i += 1
+        elif arg == "--mount-images":
+            mount_images = True
+            i += 1
+        elif arg == "--offline":
+            offline = True
+            i += 1
+        elif arg == "--force":
+            force = True
+            i += 1
+        elif arg == "--batch":
+            batch = True
+            i += 1
+        elif arg.startswith("--jobs="):
+            jobs = _parse_jobs(arg[7:], usage_md2html)  # len("--jobs=")
+            i += 1
+        elif arg in ("--jobs", "-j"):
+            if i + 1 >= len(argv):
+                print(f"{arg} requires a value", file=sys.stderr)
+                usage_md2html()
+            jobs = _parse_jobs(argv[i + 1], usage_md2html)
+            i += 2
         elif arg == "--commonmark":
             dialect = "commonmark"
             i += 1
@@ -162,8 +261,14 @@ def main_md2html(argv: Optional[List[str]] = None) -> None:
     if letter:
         _reject_incompatible_letter_flags(markdown_flags)
 
-    md2html(
-        [Path(f) for f in files],
+    if assets_dir is True:
+        # Next to the common ancestor of the inputs, shared by all pages
+        parents = [str(Path(f).resolve().parent) for f in files]
+        assets_dir = str(Path(os.path.commonpath(parents)) / "_assets")
+
+    _run_conversion(
+        md2html,
+        files,
         css=css_path,
         dialect=dialect,
         markdown_flags=markdown_flags,
@@ -171,6 +276,16 @@ def main_md2html(argv: Optional[List[str]] = None) -> None:
         title=title,
         html_css=html_css,
         letter=letter,
+        prerender_math=prerender_math,
+        assets_dir=assets_dir,
+        mount_images=mount_images,
+        offline=offline,
+        force=force,
+        # Client-side diagrams need the page to load mermaid.js
+        self_contained=mermaid != "client",
+        mermaid=mermaid,
+        batch=batch,
+        jobs=jobs,
     )
 
 
@@ -220,13 +335,25 @@ HTML generator options:
     --no-toc         Disable Table of Contents (default: enabled)
     --toc-depth=N    TOC depth (levels), default per Pandoc
     --letter         Format as a professional letter for a windowed envelope; disables TOC
+    --prerender-math Render math to cached static SVG instead of loading MathJax
       --html-title=TITLE Sets the title of the document
       --title=TITLE    Sets the title of the document (overrides auto-detection and html-title)
       --html-css=URL   In full HTML or XHTML mode add a css link
       --css=PATH       CSS file to use for styling
+    --mount-images   Mount the directories of images outside the input's directory
+                     read-only instead of copying the images next to the input
+    --offline        Use only remote images already in the remote image cache
+    --force          Convert every input, even if its output is up to date
 
 PDF options:
     --no-page-numbers Disable page numbers in PDF output (default: enabled)
+    --toc-json       Also write the TOC heading -> page map to <output>.toc.json
+    --optimize-pdf[=LEVEL]
+                     Shrink the PDF: basic, max (default) or web (max + linearized)
+
+Batch options:
+    --batch          Convert all files in a single container invocation
+    -j, --jobs=N     Convert N files concurrently ('auto': size from CPUs and memory)
 """
     print(usage, file=sys.stderr)
     sys.exit(1)
@@ -243,7 +370,15 @@ def main_md2pdf(argv: Optional[List[str]] = None) -> None:
     title = None
     html_css = None
     page_numbers = True
+    toc_json = False
+    optimize_pdf = None
     letter = False
+    prerender_math = False
+    mount_images = False
+    offline = False
+    force = False
+    batch = False
+    jobs = None
     files = []
     i = 0
 
@@ -274,6 +409,12 @@ def main_md2pdf(argv: Optional[List[str]] = None) -> None:
         elif arg == "--no-page-numbers":
             page_numbers = False
             i += 1
+        elif arg == "--toc-json":
+            toc_json = True
+            i += 1
+        elif arg == "--optimize-pdf" or arg.startswith("--optimize-pdf="):
+            optimize_pdf = _parse_optimize_pdf(arg, usage_md2pdf)
+            i += 1
         elif arg == "--letter":
             letter = True
             markdown_flags = [
@@ -286,6 +427,30 @@ def main_md2pdf(argv: Optional[List[str]] = None) -> None:
             if not letter:
                 markdown_flags.append(arg)
             i += 1
+        elif arg == "--prerender-math":
+            prerender_math = True
+            i += 1
+        elif arg == "--mount-images":
+            mount_images = True
+            i += 1
+        elif arg == "--offline":
+            offline = True
+            i += 1
+        elif arg == "--force":
+            force = True
+            i += 1
+        elif arg == "--batch":
+            batch = True
+            i += 1
+        elif arg.startswith("--jobs="):
+            jobs = _parse_jobs(arg[7:], usage_md2pdf)  # len("--jobs=")
+            i += 1
+        elif arg in ("--jobs", "-j"):
+            if i + 1 >= len(argv):
+                print(f"{arg} requires a value", file=sys.stderr)
+                usage_md2pdf()
+            jobs = _parse_jobs(argv[i + 1], usage_md2pdf)
+            i += 2
         elif arg == "--commonmark":
             dialect = "commonmark"
             i += 1
@@ -327,8 +492,9 @@ def main_md2pdf(argv: Optional[List[str]] = None) -> None:
     if letter:
         _reject_incompatible_letter_flags(markdown_flags)
 
-    md2pdf(
-        [Path(f) for f in files],
+    _run_conversion(
+        md2pdf,
+        files,
         css=css_path,
         dialect=dialect,
         markdown_flags=markdown_flags,
@@ -336,13 +502,21 @@ def main_md2pdf(argv: Optional[List[str]] = None) -> None:
         title=title,
         html_css=html_css,
         page_numbers=page_numbers,
+        toc_json=toc_json,
+        optimize_pdf=optimize_pdf,
         letter=letter,
+        prerender_math=prerender_math,
+        mount_images=mount_images,
+        offline=offline,
+        force=force,
+        batch=batch,
+        jobs=jobs,
     )
 
 
 def usage_html2pdf() -> None:
     print(
-        "Usage: html2pdf [options] file1.html [file2.html ...]\n\nPDF options:\n    --no-page-numbers Disable page numbers in PDF output (default: enabled)",
+        "Usage: html2pdf [options] file1.html [file2.html ...]\n\nPDF options:\n    --no-page-numbers Disable page numbers in PDF output (default: enabled)\n    --toc-json       Also write the TOC heading -> page map to <output>.toc.json\n    --optimize-pdf[=LEVEL]\n                     Shrink the PDF: basic, max (default) or web (max + linearized)\n\nBatch options:\n    --batch          Convert all files in a single container invocation\n    -j, --jobs=N     Convert N files concurrently ('auto': size from CPUs and memory)",
         file=sys.stderr,
     )
     sys.exit(1)
@@ -353,20 +527,54 @@ def main_html2pdf(argv: Optional[List[str]] = None) -> None:
         argv = sys.argv[1:]
 
     page_numbers = True
+    toc_json = False
+    optimize_pdf = None
+    batch = False
+    jobs = None
     files = []
-    for arg in argv:
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
         if arg == "--no-page-numbers":
             page_numbers = False
+            i += 1
+        elif arg == "--toc-json":
+            toc_json = True
+            i += 1
+        elif arg == "--optimize-pdf" or arg.startswith("--optimize-pdf="):
+            optimize_pdf = _parse_optimize_pdf(arg, usage_html2pdf)
+            i += 1
+        elif arg == "--batch":
+            batch = True
+            i += 1
+        elif arg.startswith("--jobs="):
+            jobs = _parse_jobs(arg[7:], usage_html2pdf)  # len("--jobs=")
+            i += 1
+        elif arg in ("--jobs", "-j"):
+            if i + 1 >= len(argv):
+                print(f"{arg} requires a value", file=sys.stderr)
+                usage_html2pdf()
+            jobs = _parse_jobs(argv[i + 1], usage_html2pdf)
+            i += 2
         elif arg.startswith("-"):
             print(f"Unknown option: {arg}", file=sys.stderr)
             usage_html2pdf()
         else:
             files.append(arg)
+            i += 1
 
     if not files:
         usage_html2pdf()
 
-    html2pdf([Path(f) for f in files], page_numbers=page_numbers)
+    _run_conversion(
+        html2pdf,
+        files,
+        page_numbers=page_numbers,
+        toc_json=toc_json,
+        optimize_pdf=optimize_pdf,
+        batch=batch,
+        jobs=jobs,
+    )
 
 
 if __name__ == "__main__":
@@ -418,6 +626,14 @@ DOCX options:
     --toc-depth=N    TOC depth (levels), default per Pandoc
     --title=TITLE    Sets the title of the document (overrides auto-detection)
     --reference-doc=PATH  Use a Word reference template for styles
+    --mount-images   Mount the directories of images outside the input's directory
+                     read-only instead of copying the images next to the input
+    --offline        Use only remote images already in the remote image cache
+    --force          Convert every input, even if its output is up to date
+
+Batch options:
+    --batch          Convert all files in a single container invocation
+    -j, --jobs=N     Convert N files concurrently ('auto': size from CPUs and memory)
 """
     print(usage, file=sys.stderr)
     sys.exit(1)
@@ -431,6 +647,11 @@ def main_md2docx(argv: Optional[List[str]] = None) -> None:
     markdown_flags: List[str] = ["--toc"]
     title: Optional[str] = None
     reference_doc: Optional[str] = None
+    mount_images = False
+    offline = False
+    force = False
+    batch = False
+    jobs = None
     files: List[str] = []
     i = 0
 
@@ -456,6 +677,27 @@ def main_md2docx(argv: Optional[List[str]] = None) -> None:
                 usage_md2docx()
             reference_doc = argv[i + 1]
             i += 2
+        elif arg == "--mount-images":
+            mount_images = True
+            i += 1
+        elif arg == "--offline":
+            offline = True
+            i += 1
+        elif arg == "--force":
+            force = True
+            i += 1
+        elif arg == "--batch":
+            batch = True
+            i += 1
+        elif arg.startswith("--jobs="):
+            jobs = _parse_jobs(arg[7:], usage_md2docx)  # len("--jobs=")
+            i += 1
+        elif arg in ("--jobs", "-j"):
+            if i + 1 >= len(argv):
+                print(f"{arg} requires a value", file=sys.stderr)
+                usage_md2docx()
+            jobs = _parse_jobs(argv[i + 1], usage_md2docx)
+            i += 2
         elif arg == "--commonmark":
             dialect = "commonmark"
             i += 1
@@ -494,12 +736,18 @@ def main_md2docx(argv: Optional[List[str]] = None) -> None:
     if not files:
         usage_md2docx()
 
-    md2docx(
-        [Path(f) for f in files],
+    _run_conversion(
+        md2docx,
+        files,
         dialect=dialect,
         markdown_flags=markdown_flags,
         title=title,
         reference_doc=reference_doc,
+        mount_images=mount_images,
+        offline=offline,
+        force=force,
+        batch=batch,
+        jobs=jobs,
     )
 
 
@@ -1,9 +1,21 @@
 import subprocess
+import hashlib
 import re
+import json
 import shutil
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List, Optional, Set, Tuple, Union
+from typing import Callable, List, Optional, Set, Tuple, Union
+from . import cache
+from . import manifest
+from .analysis import DocumentAnalysis, analyze_markdown, fenced_blocks
+from . import native
+from . import remote
 from . import runtime as rt
+from . import worker
 import os
 
 
@@ -12,40 +24,10 @@ def collect_local_images(file_path: str | Path) -> set[Path]:
     Extract unique local image paths referenced in a markdown file.
     Returns a set of absolute paths to existing image files.
     """
-    file_path = Path(file_path).resolve()
-    base_dir = file_path.parent
-    images: set[Path] = set()
-
     try:
-        with open(file_path, encoding="utf-8") as f:
-            content = f.read()
-
-        # Match markdown image syntax: ![alt](path) and ![alt](path "title")
-        # Also match HTML img tags: <img src="path" ...>
-        md_pattern = r'!\[[^\]]*\]\(([^)\s"]+)'
-        html_pattern = r'<img[^>]+src=["\']([^"\']+)["\']'
-
-        paths = re.findall(md_pattern, content)
-        paths += re.findall(html_pattern, content, re.IGNORECASE)
-
-        for img_path in paths:
-            # Skip URLs
-            if img_path.startswith(("http://", "https://", "data:")):
-                continue
-
-            img = Path(img_path)
-            if img.is_absolute():
-                if img.exists():
-                    images.add(img.resolve())
-            else:
-                resolved = (base_dir / img).resolve()
-                if resolved.exists():
-                    images.add(resolved)
-
-    except Exception:
-        pass
-
-    return images
+        return analyze_markdown(file_path).local_images
+    except (OSError, UnicodeDecodeError):
+        return set()
 
 
 def copy_images_and_rewrite(
@@ -153,80 +135,158 @@ def copy_images_and_rewrite(
     return content, copied
 
 
-def count_h1_headers(file_path: str | Path) -> int:
-    """Count the number of H1 headers in a markdown file."""
-    try:
-        with open(file_path, encoding="utf-8") as f:
-            content = f.read()
+IMAGE_MOUNT_ROOT = "/images"
+# Cached copies of remote images (md2.remote.RemoteCache)
+REMOTE_MOUNT = "/remote"
+_MD_IMAGE_REF_RE = re.compile(r'(!\[[^\]]*\]\()([^)\s"]+)')
+_HTML_IMAGE_REF_RE = re.compile(r'(<img[^>]+src=["\'])([^"\']+)', re.IGNORECASE)
 
-        # Count ATX-style headers (# Header)
-        atx_count = len(re.findall(r"^# .*$", content, re.MULTILINE))
 
-        # Count Setext-style headers (underlined with =)
-        setext_count = len(re.findall(r"^.+\n=+\s*$", content, re.MULTILINE))
+def image_mounts(images: set[Path]) -> list[rt.Mount]:
+    """
+    Read-only mounts making ``images`` visible in the container: one per
+    directory, leaving out directories below another mounted one. Container
+    paths derive from the host path, so documents sharing an image tree get
+    identical mounts (and can share a batch container).
+    """
+    mounts: list[rt.Mount] = []
+    # Sorted by parts, a directory is directly followed by its descendants
+    for directory in sorted({img.parent for img in images}, key=lambda d: d.parts):
+        if mounts and directory.is_relative_to(mounts[-1][0]):
+            continue
+        digest = hashlib.sha1(str(directory).encode("utf-8")).hexdigest()[:12]
+        mounts.append((directory, f"{IMAGE_MOUNT_ROOT}/{digest}", True))
+    return mounts
 
-        return atx_count + setext_count
-    except Exception:
-        return 0
 
+def _outside_code(content: str, transform: Callable[[str], str]) -> str:
+    """Apply ``transform`` to the Markdown prose, leaving fenced code blocks as they are."""
+    parts: list[str] = []
+    pos = 0
+    for block_start, block_end, _ in fenced_blocks(content):
+        parts.append(transform(content[pos:block_start]))
+        parts.append(content[block_start:block_end])
+        pos = block_end
+    parts.append(transform(content[pos:]))
+    return "".join(parts)
 
-def extract_first_h1_title(file_path: str | Path) -> str | None:
-    """Extract the text of the first H1 header in a markdown file."""
-    try:
-        with open(file_path, encoding="utf-8") as f:
-            content = f.read()
 
-        # Look for ATX-style header first (# Header)
-        atx_match = re.search(r"^# (.+)$", content, re.MULTILINE)
-        if atx_match:
-            return atx_match.group(1).strip()
+def _rewrite_image_refs(content: str, target: Callable[[str], str | None]) -> str:
+    """Replace each image reference ``ref`` by ``target(ref)`` unless that is None.
 
-        # Look for Setext-style header (underlined with =)
-        setext_match = re.search(r"^(.+)\n=+\s*$", content, re.MULTILINE)
-        if setext_match:
-            return setext_match.group(1).strip()
+    Image syntax in fenced code blocks is left alone.
+    """
 
+    def replace(m: re.Match) -> str:
+        new = target(m.group(2))
+        return m.group(0) if new is None else m.group(1) + new
+
+    def rewrite(prose: str) -> str:
+        return _HTML_IMAGE_REF_RE.sub(replace, _MD_IMAGE_REF_RE.sub(replace, prose))
+
+    return _outside_code(content, rewrite)
+
+
+def rewrite_image_paths(content: str, base_dir: Path, mounts: list[rt.Mount]) -> str:
+    """Point image references below one of ``mounts`` at its container path."""
+
+    def container_path(ref: str) -> str | None:
+        if ref.startswith(("http://", "https://", "data:")):
+            return None
+        img = Path(ref)
+        src = (img if img.is_absolute() else base_dir / img).resolve()
+        for host, container, _ in mounts:
+            if src.is_relative_to(host):
+                return f"{container}/{src.relative_to(host).as_posix()}"
         return None
-    except Exception:
-        return None
+
+    return _rewrite_image_refs(content, container_path)
+
+
+def rewrite_remote_images(content: str, files: dict[str, Path], root: Path, prefix: str) -> str:
+    """Point remote image URLs at their cached copies (below ``root``, seen at ``prefix``)."""
+
+    def cached_path(ref: str) -> str | None:
+        if ref not in files:
+            return None
+        return f"{prefix}/{files[ref].relative_to(root).as_posix()}"
+
+    return _rewrite_image_refs(content, cached_path)
+
+
+def _remote_location(runtime: str, remote_cache: remote.RemoteCache) -> tuple[str, list[rt.Mount]]:
+    """Where conversions see the remote image cache, and the mount needed for it."""
+    if runtime == native.NATIVE:
+        return str(remote_cache.files), []
+    return REMOTE_MOUNT, [(remote_cache.files, REMOTE_MOUNT, True)]
 
 
-def shift_headings_and_add_title(file_path: str | Path, title: str) -> str:
+def count_h1_headers(file_path: str | Path) -> int:
+    """Count the number of H1 headers (outside code blocks) in a markdown file."""
+    try:
+        return analyze_markdown(file_path).h1_count
+    except (OSError, UnicodeDecodeError):
+        return 0
+
+
+def extract_first_h1_title(file_path: str | Path) -> str | None:
+    """Extract the text of the first H1 header in a markdown file."""
+    try:
+        titles = analyze_markdown(file_path).h1_titles
+    except (OSError, UnicodeDecodeError):
+        return None
+    return titles[0] if titles else None
+
+
+def _shift_headings(content: str) -> str:
+    """Shift the headings of Markdown prose (no fenced code) down one level."""
+    # Remove trailing spaces before --- to prevent Setext heading misinterpretation
+    # This prevents Pandoc from treating "text\n---" as a Setext H1 heading
+    lines = content.split("\n")
+    processed_lines = []
+    for i, line in enumerate(lines):
+        processed_lines.append(line)
+        # If next line is exactly "---" (a thematic break), remove trailing spaces from current line
+        if (
+            i < len(lines) - 1
+            and lines[i + 1].strip() == "---"
+            and line.endswith((" ", "\t"))
+        ):
+            processed_lines[-1] = line.rstrip()
+    content = "\n".join(processed_lines)
+
+    # Shift ATX-style headers (add one # to each)
+    content = re.sub(r"^(#{1,6}) ", r"#\1 ", content, flags=re.MULTILINE)
+
+    # Shift Setext-style headers (convert to ATX and shift)
+    # H1 (===) becomes H2 (##)
+    content = re.sub(r"^(.+)\n=+\s*$", r"## \1", content, flags=re.MULTILINE)
+    # H2 (---) becomes H3 (###)
+    content = re.sub(r"^(.+)\n-+\s*$", r"### \1", content, flags=re.MULTILINE)
+
+    # Ensure no heading immediately follows ---
+    # This prevents Pandoc from misinterpreting --- as a table separator
+    content = re.sub(r"^---\n(#{1,6} )", r"---\n\n\1", content, flags=re.MULTILINE)
+    return content
+
+
+def shift_headings_and_add_title(
+    file_path: str | Path, title: str, content: str | None = None
+) -> str:
     """
     Shift all headings down by one level and add a title H1 at the top.
-    Returns the modified markdown content.
+    Returns the modified markdown content; ``content`` saves reading the file.
     """
+    original = content
     try:
-        with open(file_path, encoding="utf-8") as f:
-            content = f.read()
-
-        # Remove trailing spaces before --- to prevent Setext heading misinterpretation
-        # This prevents Pandoc from treating "text\n---" as a Setext H1 heading
-        lines = content.split("\n")
-        processed_lines = []
-        for i, line in enumerate(lines):
-            processed_lines.append(line)
-            # If next line is exactly "---" (a thematic break), remove trailing spaces from current line
-            if (
-                i < len(lines) - 1
-                and lines[i + 1].strip() == "---"
-                and line.endswith((" ", "\t"))
-            ):
-                processed_lines[-1] = line.rstrip()
-        content = "\n".join(processed_lines)
-
-        # Shift ATX-style headers (add one # to each)
-        content = re.sub(r"^(#{1,6}) ", r"#\1 ", content, flags=re.MULTILINE)
-
-        # Shift Setext-style headers (convert to ATX and shift)
-        # H1 (===) becomes H2 (##)
-        content = re.sub(r"^(.+)\n=+\s*$", r"## \1", content, flags=re.MULTILINE)
-        # H2 (---) becomes H3 (###)
-        content = re.sub(r"^(.+)\n-+\s*$", r"### \1", content, flags=re.MULTILINE)
-
-        # Ensure no heading immediately follows ---
-        # This prevents Pandoc from misinterpreting --- as a table separator
-        content = re.sub(r"^---\n(#{1,6} )", r"---\n\n\1", content, flags=re.MULTILINE)
+        if content is None:
+            with open(file_path, encoding="utf-8") as f:
+                content = f.read()
+            original = content
+
+        # Headings are shifted outside fenced code only: a "# comment" in a
+        # shell snippet stays as it is
+        content = _outside_code(content, _shift_headings)
 
         # Add title H1 at the top
         modified_content = f"# {title}\n\n{content}"
@@ -235,6 +295,8 @@ def shift_headings_and_add_title(file_path: str | Path, title: str) -> str:
 
     except Exception:
         # If anything fails, return original content
+        if original is not None:
+            return original
         with open(file_path, encoding="utf-8") as f:
             return f.read()
 
@@ -250,32 +312,358 @@ def determine_document_title(
     """
     if title_override:
         return title_override
+    try:
+        return analyze_markdown(file_path).title()
+    except (OSError, UnicodeDecodeError):
+        # Fallback to filename stem
+        return Path(file_path).stem
 
-    h1_count = count_h1_headers(file_path)
-    if h1_count == 1:
-        first_h1 = extract_first_h1_title(file_path)
-        if first_h1:
-            return first_h1
 
-    # Fallback to filename stem
-    return Path(file_path).stem
+class ConversionError(RuntimeError):
+    """One or more documents failed to convert.
 
+    ``failures`` maps each failed input to an error message, ``outputs``
+    lists the outputs that were written successfully (in input order).
+    """
 
-def md2html(
-    input_paths: list[str | Path],
-    css: str | None = None,
-    dialect: str = "pandoc",
-    markdown_flags: list[str] | None = None,
-    html_title: str | None = None,
-    title: str | None = None,
-    html_css: str | None = None,
-    runtime: str | None = None,
-    ensure: bool = True,
-    self_contained: bool = True,  # Default True: embeds MathJax + resources for offline use
-    add_toc_placeholders: bool = False,
-    letter: bool = False,
+    def __init__(self, failures: dict[Path, str], outputs: list[Path]):
+        self.failures = failures
+        self.outputs = outputs
+        lines = [f"{len(failures)} document(s) failed to convert:"]
+        lines += [f"  - {path}: {msg}" for path, msg in failures.items()]
+        super().__init__("\n".join(lines))
+
+
+@dataclass
+class _Job:
+    """One container invocation converting ``source`` into ``output``."""
+
+    source: Path
+    output: Path
+    mounts: list[rt.Mount]
+    env: dict[str, str]
+    inner: list[str]
+    security: bool = True
+    chromium: bool = False
+    cleanup: list[Path] = field(default_factory=list)
+
+    def work_dir(self) -> Path:
+        return next(Path(h) for h, c, _ in self.mounts if c == "/work")
+
+    def remove_temp_files(self) -> None:
+        for path in self.cleanup:
+            if path.exists():
+                path.unlink()
+
+
+def _run_container(
+    runtime: str,
+    mounts: list[rt.Mount],
+    env: dict[str, str],
+    inner: list[str],
+    security: bool = True,
+    chromium: bool = False,
+    capture: bool = False,
+) -> str | None:
+    """Run ``inner`` in the image, through a warm worker when MD2_WORKER is set.
+
+    With ``capture`` the combined stdout/stderr is returned instead of being
+    streamed, so parallel jobs can replay their logs in input order.
+    """
+    if runtime == native.NATIVE:
+        return native.run_job(mounts, env, inner, chromium=chromium, capture=capture)
+    try:
+        if worker.worker_enabled():
+            return worker.run_job(
+                runtime, mounts, env, inner, chromium=chromium, capture=capture, security=security
+            )
+        cmd = rt.container_command(runtime, mounts, env, inner, security=security)
+        if capture:
+            r = subprocess.run(
+                cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+            )
+            return r.stdout
+        subprocess.run(cmd, check=True)
+        return None
+    except subprocess.CalledProcessError as exc:
+        # The image may have been removed since ensure_image last probed it
+        rt.check_image_after_failure(runtime, exc.returncode)
+        raise
+
+
+def prepare_runtime(
+    runtime: str | None = None, ensure: bool = True, backend: str | None = None
+) -> str:
+    """Container runtime to run jobs with, or ``native.NATIVE`` for the host.
+
+    With ``ensure`` the image is built if needed (container backend) or the
+    host tools are checked (native backend).
+    """
+    if native.resolve_backend(backend) == native.NATIVE:
+        if ensure:
+            native.discover()
+        return native.NATIVE
+    runtime = runtime or rt.get_container_runtime()
+    if ensure:
+        rt.ensure_image(runtime, rt.PROJECT_ROOT)
+    return runtime
+
+
+def resolve_jobs(jobs: int | str | None) -> int:
+    """Number of concurrent conversions for ``jobs`` (an int, "auto" or None)."""
+    if jobs is None:
+        return 1
+    if jobs == "auto":
+        return rt.auto_jobs()
+    try:
+        n = int(jobs)
+    except (TypeError, ValueError):
+        n = 0
+    if n < 1:
+        raise ValueError(f"jobs must be a positive integer or 'auto', got {jobs!r}")
+    return n
+
+
+def _error_message(output: str | None, returncode: int | None) -> str:
+    tail = [l for l in (output or "").splitlines() if l.strip()][-5:]
+    return " | ".join(tail) or f"exit status {returncode}"
+
+
+def _run_jobs(
+    runtime: str, jobs: list[_Job], batch: bool = False, concurrency: int = 1
 ) -> list[Path]:
+    # Natively, batching only pays off for PDFs (one Chromium for all of them)
+    native_batch = all(job.chromium for job in jobs)
+    if batch and len(jobs) > 1 and (runtime != native.NATIVE or native_batch):
+        return _run_batch(runtime, jobs, concurrency)
+    if concurrency > 1 and len(jobs) > 1:
+        return _run_parallel(runtime, jobs, concurrency)
+    # Like the parallel and batch paths: every file is attempted and
+    # failures are raised together
+    failures: dict[Path, str] = {}
+    try:
+        for job in jobs:
+            try:
+                _run_container(
+                    runtime,
+                    job.mounts,
+                    job.env,
+                    job.inner,
+                    security=job.security,
+                    chromium=job.chromium,
+                )
+            except subprocess.CalledProcessError as exc:
+                failures[job.source] = _error_message(exc.output, exc.returncode)
+    finally:
+        for job in jobs:
+            job.remove_temp_files()
+
+    outputs = [job.output for job in jobs if job.source not in failures]
+    if failures:
+        raise ConversionError(failures, outputs)
+    return outputs
+
+
+def _build_state(
+    format: str, backend: str | None, force: bool, **options
+) -> manifest.BuildState:
+    """Up-to-date checks for ``format`` outputs converted with ``options``.
+
+    Shared by the blocking and the async API, so both read and record the
+    same manifests.
+    """
+    for name in ("css", "assets_dir", "reference_doc"):
+        if options.get(name):
+            options[name] = Path(options[name]).resolve()
+    options.update(format=format, backend=native.resolve_backend(backend))
+    return manifest.BuildState(options, force)
+
+
+def _run_build(
+    runtime: str,
+    jobs: list[_Job],
+    build: manifest.BuildState,
+    batch: bool = False,
+    concurrency: int = 1,
+) -> manifest.BuildOutputs:
+    """Run the jobs of out-of-date inputs and record manifests for their outputs."""
+    try:
+        outputs = _run_jobs(runtime, jobs, batch, concurrency)
+    except ConversionError as exc:
+        exc.outputs = build.finish(exc.outputs)
+        raise
+    return build.finish(outputs)
+
+
+def _run_parallel(runtime: str, jobs: list[_Job], concurrency: int) -> list[Path]:
+    """Run jobs on a thread pool; logs and failures are reported in input order."""
+
+    def run(job: _Job) -> tuple[str | None, str | None]:
+        try:
+            output = _run_container(
+                runtime,
+                job.mounts,
+                job.env,
+                job.inner,
+                security=job.security,
+                chromium=job.chromium,
+                capture=True,
+            )
+            return output, None
+        except subprocess.CalledProcessError as exc:
+            return exc.output, _error_message(exc.output, exc.returncode)
+        finally:
+            job.remove_temp_files()
+
+    failures: dict[Path, str] = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(run, job) for job in jobs]
+        for job, future in zip(jobs, futures):
+            output, error = future.result()
+            if output:
+                sys.stdout.write(output)
+                sys.stdout.flush()
+            if error:
+                failures[job.source] = error
+
+    outputs = [job.output for job in jobs if job.source not in failures]
+    if failures:
+        raise ConversionError(failures, outputs)
+    return outputs
+
+
+def _batch_groups(jobs: list[_Job]) -> list[tuple[Path, list[_Job]]]:
+    """Group jobs under a common ancestor directory that is mounted once.
+
+    Jobs are only grouped when they share every mount except ``/work`` and
+    the same environment. The filesystem root is never mounted; inputs
+    spread across it fall back to one group per directory.
+    """
+    groups: dict[tuple, list[_Job]] = {}
+    for job in jobs:
+        key = (
+            tuple((str(h), c, ro) for h, c, ro in job.mounts if c != "/work"),
+            tuple(job.env.items()),
+            job.security,
+        )
+        groups.setdefault(key, []).append(job)
+
+    result: list[tuple[Path, list[_Job]]] = []
+    for members in groups.values():
+        root = Path(os.path.commonpath([str(j.work_dir()) for j in members]))
+        if root.parent != root:
+            result.append((root, members))
+            continue
+        by_dir: dict[Path, list[_Job]] = {}
+        for job in members:
+            by_dir.setdefault(job.work_dir(), []).append(job)
+        result.extend(by_dir.items())
+    return result
 
+
+def _run_batch(runtime: str, jobs: list[_Job], concurrency: int = 1) -> list[Path]:
+    """Convert all jobs with one container per common ancestor directory.
+
+    The host writes a job list that ``scripts/batch_runner.py`` (or, for
+    PDFs, ``pdf_generator.sh --batch``) executes inside the container;
+    per-file results are read back and failures are raised together as
+    ConversionError after every file was attempted.
+    """
+    failures: dict[Path, str] = {}
+    try:
+        for root, members in _batch_groups(jobs):
+            failures.update(_run_batch_group(runtime, root, members, concurrency))
+    finally:
+        for job in jobs:
+            job.remove_temp_files()
+
+    outputs = [job.output for job in jobs if job.source not in failures]
+    if failures:
+        raise ConversionError(failures, outputs)
+    return outputs
+
+
+def _run_batch_group(
+    runtime: str, root: Path, jobs: list[_Job], concurrency: int = 1
+) -> dict[Path, str]:
+    argvs = []
+    cwds = []
+    for job in jobs:
+        rel = job.work_dir().relative_to(root).as_posix()
+        prefix = "/work" if rel == "." else f"/work/{rel}"
+        argvs.append(
+            [
+                prefix + arg[len("/work") :] if arg.startswith("/work/") else arg
+                for arg in job.inner
+            ]
+        )
+        cwds.append(prefix)
+
+    first = jobs[0]
+    mounts = [(root, "/work", False)]
+    mounts += [m for m in first.mounts if m[1] != "/work"]
+    failures: dict[Path, str] = {}
+    # The job list lives under /work: a mount of its own would give every
+    # batch a different worker key (and so a new warm worker)
+    with tempfile.TemporaryDirectory(prefix=".md2-batch-", dir=root) as tmp:
+        results_file = Path(tmp) / "results.json"
+        batch_dir = f"/work/{Path(tmp).name}"
+        if all(job.chromium for job in jobs):
+            # One Chromium prints every document (pdf_generator.sh --batch)
+            if runtime == native.NATIVE:
+                argvs = [[native.to_host(a, mounts) for a in argv] for argv in argvs]
+            lines = ["\t".join(argv[2:5]) + "\n" for argv in argvs]
+            (Path(tmp) / "jobs.tsv").write_text("".join(lines), encoding="utf-8")
+            inner = [
+                "bash",
+                "/scripts/pdf_generator.sh",
+                "--batch",
+                f"{batch_dir}/jobs.tsv",
+                f"{batch_dir}/results.json",
+                f"--concurrency={concurrency}",
+            ]
+        else:
+            entries = [{"argv": a, "cwd": c} for a, c in zip(argvs, cwds)]
+            (Path(tmp) / "jobs.json").write_text(json.dumps(entries), encoding="utf-8")
+            inner = [
+                "python3",
+                "/scripts/batch_runner.py",
+                f"{batch_dir}/jobs.json",
+                f"{batch_dir}/results.json",
+                f"--jobs={concurrency}",
+            ]
+        if not any(m[1] == "/scripts" for m in mounts):
+            mounts.append((rt.PROJECT_ROOT / "scripts", "/scripts", True))
+        env = first.env
+        if runtime != native.NATIVE:
+            # Every document of the batch can share one pandoc server
+            env = worker.with_pandoc_server(env)
+        try:
+            _run_container(
+                runtime,
+                mounts,
+                env,
+                inner,
+                security=first.security,
+                chromium=first.chromium,
+            )
+            results = json.loads(results_file.read_text(encoding="utf-8"))
+        except (subprocess.CalledProcessError, OSError, ValueError) as exc:
+            return {job.source: f"batch failed: {exc}" for job in jobs}
+
+    if not isinstance(results, list):
+        results = []
+    for i, job in enumerate(jobs):
+        result = results[i] if i < len(results) else None
+        if not isinstance(result, dict):
+            failures[job.source] = "no result from the batch"
+        elif not result.get("ok"):
+            failures[job.source] = result.get("error") or "conversion failed"
+    return failures
+
+
+def _html_flags(markdown_flags: list[str] | None, letter: bool) -> list[str]:
+    """Validate md2html markdown flags and normalize the TOC flags."""
     if markdown_flags is None:
         markdown_flags = ["--toc"]  # TOC enabled by default
 
@@ -308,74 +696,116 @@ def md2html(
     if toc_disabled:
         processed_flags = [f for f in processed_flags if f != "--toc"]
 
-    markdown_flags = processed_flags
-    runtime = runtime or rt.get_container_runtime()
-    if ensure:
-        rt.ensure_image(runtime, rt.PROJECT_ROOT)
+    return processed_flags
+
+
+# Where Mermaid diagrams of HTML output are rendered: by mermaid-cli during
+# the conversion, or lazily by the reader's browser
+MERMAID_MODES = ("server", "client")
+
 
-    results = []
+def _check_mermaid_mode(mermaid: str) -> None:
+    if mermaid not in MERMAID_MODES:
+        raise ValueError(f"mermaid must be one of {', '.join(MERMAID_MODES)}, got {mermaid!r}")
+
+
+def _plan_md2html(
+    runtime: str,
+    input_paths: list[str | Path],
+    markdown_flags: list[str],
+    css: str | None = None,
+    dialect: str = "pandoc",
+    html_title: str | None = None,
+    title: str | None = None,
+    html_css: str | None = None,
+    self_contained: bool = True,
+    add_toc_placeholders: bool = False,
+    letter: bool = False,
+    prerender_math: bool = False,
+    assets_dir: str | Path | None = None,
+    mermaid: str = "server",
+    mount_images: bool = False,
+    offline: bool = False,
+    analyses: dict[Path, DocumentAnalysis] | None = None,
+) -> list[_Job]:
+    """Build one md2html.sh job per input (temporary files are created here).
+
+    ``mermaid="client"`` only applies to HTML that links its assets: offline
+    self-contained pages keep server-side rendered diagrams.
+    ``mount_images`` mounts the directories of images outside the input's
+    directory read-only instead of copying the images next to the input.
+    ``offline`` only uses remote images already in the remote cache.
+    ``analyses`` are inputs already analyzed (``BuildState.analyses``).
+    """
+    analyses = analyses or {}
+    planned: list[_Job] = []
+    mermaid_cache = cache.mermaid_cache()
+    mermaid_cache.sync()
+    # Shared by all inputs: one result cache and connection pool
+    validator: remote.RemoteImageValidator | None = None
+    remote_cache: remote.RemoteCache | None = None
+    assets_abs = None
+    if assets_dir is not None:
+        assets_abs = Path(assets_dir).resolve()
+        assets_abs.mkdir(parents=True, exist_ok=True)
     for p in input_paths:
         p = Path(p).resolve()
         abs_in = p.resolve()
 
-        # Check for remote images and validate if present
-        with open(abs_in, encoding="utf-8") as f:
-            content = f.read()
-
-        # Only validate if there are HTTP/HTTPS images
-        if re.search(r"!\[[^\]]*\]\([^)]*https?://[^)]+\)", content):
-            scripts_path = Path(__file__).parent / "scripts"
-            validation_cmd = [
-                runtime,
-                "run",
-                "--rm",
-                "--userns=keep-id",
-                "--network=host",
-                "-v",
-                f"{abs_in.parent}:/work:ro",
-                "-v",
-                f"{scripts_path}:/scripts:ro",
-                "md2:latest",
-                "python3",
-                "/scripts/validate_images.py",
-                f"/work/{abs_in.name}",
-            ]
-
-            try:
-                subprocess.run(validation_cmd, check=False, capture_output=False)
-            except Exception:
-                pass
+        # One read and scan of the input serves every decision below
+        analysis = analyses.pop(abs_in, None) or analyze_markdown(abs_in)
+
+        # Remote images embedded into the output are fetched once into the
+        # remote cache and read from there; linked ones are only checked
+        remote_files: dict[str, Path] = {}
+        if analysis.remote_images and (self_contained or assets_abs is not None):
+            remote_cache = remote_cache or remote.RemoteCache(offline=offline)
+            remote_files = remote.cache_remote_images(
+                analysis.remote_images, abs_in.name, remote_cache
+            )
+        elif analysis.remote_images and not offline:
+            validator = validator or remote.RemoteImageValidator()
+            remote.warn_unreachable_images(analysis.remote_images, abs_in.name, validator)
 
         out_abs = abs_in.with_suffix(".html")
         in_dir = abs_in.parent
 
         # Determine the actual title to use
-        actual_title = determine_document_title(abs_in, title)
+        actual_title = analysis.title(title)
 
         # Handle multiple H1s by shifting headings and adding title
-        h1_count = count_h1_headers(abs_in)
+        h1_count = analysis.h1_count
         temp_file = None
         copied_images: list[Path] = []
 
-        # Check if we need to copy external images or shift headings
-        external_images = collect_local_images(abs_in)
-        external_images = {
-            img for img in external_images if not str(img).startswith(str(in_dir))
-        }
-
-        if h1_count > 1 or external_images:
-            import uuid
-
-            if h1_count > 1:
-                modified_content = shift_headings_and_add_title(abs_in, actual_title)
-            else:
-                modified_content = content  # already read above
-
+        # Check if we need to copy external images or shift headings (the
+        # native backend reads them where they are)
+        external_images = analysis.external_images()
+        extra_mounts: list[rt.Mount] = []
+        if runtime == native.NATIVE and mount_images:
+            external_images = set()
+        elif mount_images:
+            extra_mounts = image_mounts(external_images)
+
+        modified_content = analysis.text
+        if h1_count > 1:
+            modified_content = shift_headings_and_add_title(abs_in, actual_title, modified_content)
+        if extra_mounts:
+            modified_content = rewrite_image_paths(modified_content, in_dir, extra_mounts)
+        elif external_images:
             # Copy external images to work dir and rewrite paths
-            if external_images:
-                modified_content, copied_images = copy_images_and_rewrite(
-                    modified_content, abs_in.parent, in_dir
-                )
+            modified_content, copied_images = copy_images_and_rewrite(
+                modified_content, abs_in.parent, in_dir
+            )
+        if remote_files:
+            prefix, remote_mounts = _remote_location(runtime, remote_cache)
+            extra_mounts += remote_mounts
+            modified_content = rewrite_remote_images(
+                modified_content, remote_files, remote_cache.files, prefix
+            )
+
+        if h1_count > 1 or external_images or remote_files:
+            import uuid
 
             temp_name = f"tmp_{uuid.uuid4().hex[:8]}.md"
             temp_file = in_dir / temp_name
@@ -386,40 +816,42 @@ def md2html(
 
         container_out = f"/work/{out_abs.name}"
 
-        css_mount = []
+        mounts: list[rt.Mount] = [
+            (in_dir, "/work", False),
+            (rt.PROJECT_ROOT / "styles", "/styles", True),
+            (rt.PROJECT_ROOT / "filters", "/filters", True),
+            (rt.PROJECT_ROOT / "scripts", "/scripts", True),
+            *extra_mounts,
+        ]
         css_arg = None
         toc_enabled = bool(markdown_flags and any(f == "--toc" for f in markdown_flags))
         if css:
             css_abs = Path(css).resolve()
-            css_mount = ["-v", f"{css_abs.parent}:/custom-styles:ro"]
+            mounts.append((css_abs.parent, "/custom-styles", True))
             css_arg = f"/custom-styles/{css_abs.name}"
         elif toc_enabled:
             css_arg = "/styles/default.toc.css"
 
-        cmd = [runtime, "run", "--rm"]
-        cmd += rt.get_user_args(runtime)
-        cmd += rt.get_security_args(runtime)
-        cmd += [
-            "-v",
-            f"{in_dir}:/work",
-            "-v",
-            f"{rt.PROJECT_ROOT}/styles:/styles:ro",
-            "-v",
-            f"{rt.PROJECT_ROOT}/filters:/filters:ro",
-            "-v",
-            f"{rt.PROJECT_ROOT}/scripts:/scripts:ro",
-        ]
-        cmd += css_mount
-        if self_contained:
-            cmd += ["-e", "INTERNAL_RESOURCES=1", "-e", "LINK_CSS=0"]
+        # Rendered diagrams are reused across documents and runs
+        mounts.append(mermaid_cache.mount())
+        env: dict[str, str] = {"MD2_MERMAID_CACHE": mermaid_cache.container_path}
+        if prerender_math:
+            # Shared across documents and runs: repeated formulas are free
+            mounts.append((rt.cache_dir("math"), "/cache/math", False))
+            env.update(MD2_PRERENDER_MATH="1", MD2_MATH_CACHE="/cache/math")
+        if assets_abs is not None:
+            # Assets are linked from the shared directory, never embedded
+            mounts.append((assets_abs, "/assets", False))
+            env.update(INTERNAL_RESOURCES="0", LINK_CSS="0")
+        elif self_contained:
+            env.update(INTERNAL_RESOURCES="1", LINK_CSS="0")
         else:
             link_css = os.environ.get("LINK_CSS")
             internal = os.environ.get("INTERNAL_RESOURCES")
             if link_css is not None:
-                cmd += ["-e", f"LINK_CSS={link_css}"]
+                env["LINK_CSS"] = link_css
             if internal is not None:
-                cmd += ["-e", f"INTERNAL_RESOURCES={internal}"]
-        cmd.append(rt.IMAGE_NAME)
+                env["INTERNAL_RESOURCES"] = internal
 
         inner = ["bash", "/scripts/md2html.sh", container_in, container_out]
         if css_arg:
@@ -462,57 +894,162 @@ def md2html(
         if add_toc_placeholders:
             inner.extend(["--add-toc-placeholders"])
 
-        cmd += inner
-        subprocess.run(cmd, check=True)
+        if assets_abs is not None:
+            assets_url = Path(os.path.relpath(assets_abs, out_abs.parent)).as_posix()
+            inner.extend(["--assets-dir=/assets", f"--assets-url={assets_url}"])
 
-        # Clean up temporary file and copied images
-        if temp_file and temp_file.exists():
-            temp_file.unlink()
-        for img in copied_images:
-            if img.exists():
-                img.unlink()
+        if mermaid == "client" and (assets_abs is not None or not self_contained):
+            inner.append("--mermaid=client")
 
-        results.append(out_abs)
-    return results
+        # Temporary file and copied images are removed after conversion
+        cleanup = copied_images + ([temp_file] if temp_file else [])
+        planned.append(_Job(abs_in, out_abs, mounts, env, inner, cleanup=cleanup))
+    for client in (validator, remote_cache):
+        if client is not None:
+            client.close()
+    return planned
 
 
-def html2pdf(
+def md2html(
     input_paths: list[str | Path],
+    css: str | None = None,
+    dialect: str = "pandoc",
+    markdown_flags: list[str] | None = None,
+    html_title: str | None = None,
+    title: str | None = None,
+    html_css: str | None = None,
     runtime: str | None = None,
     ensure: bool = True,
-    page_numbers: bool = True,
+    self_contained: bool = True,  # Default True: embeds MathJax + resources for offline use
+    add_toc_placeholders: bool = False,
+    letter: bool = False,
+    batch: bool = False,
+    jobs: int | str | None = None,
+    backend: str | None = None,
+    prerender_math: bool = False,
+    assets_dir: str | Path | None = None,
+    mermaid: str = "server",
+    mount_images: bool = False,
+    offline: bool = False,
+    force: bool = False,
 ) -> list[Path]:
-    runtime = runtime or rt.get_container_runtime()
-    if ensure:
-        rt.ensure_image(runtime, rt.PROJECT_ROOT)
+    markdown_flags = _html_flags(markdown_flags, letter)
+    _check_mermaid_mode(mermaid)
+    concurrency = resolve_jobs(jobs)
+    # Inputs whose HTML is up to date are not converted again
+    build = _build_state(
+        "html",
+        backend,
+        force,
+        css=css,
+        dialect=dialect,
+        markdown_flags=markdown_flags,
+        html_title=html_title,
+        title=title,
+        html_css=html_css,
+        self_contained=self_contained,
+        add_toc_placeholders=add_toc_placeholders,
+        letter=letter,
+        prerender_math=prerender_math,
+        assets_dir=assets_dir,
+        mermaid=mermaid,
+        mount_images=mount_images,
+        offline=offline,
+    )
+    stale = build.select(input_paths, ".html", [css] if css else [])
+    if not stale:
+        return build.finish([])
+    runtime = prepare_runtime(runtime, ensure, backend)
+
+    planned = _plan_md2html(
+        runtime,
+        stale,
+        markdown_flags,
+        css=css,
+        dialect=dialect,
+        html_title=html_title,
+        title=title,
+        html_css=html_css,
+        self_contained=self_contained,
+        add_toc_placeholders=add_toc_placeholders,
+        letter=letter,
+        prerender_math=prerender_math,
+        assets_dir=assets_dir,
+        mermaid=mermaid,
+        mount_images=mount_images,
+        offline=offline,
+        analyses=build.analyses,
+    )
+    return _run_build(runtime, planned, build, batch, concurrency)
+
 
-    results = []
+# pdf_processor.py optimization levels (garbage collection, compression,
+# deduplication; "web" also linearizes)
+PDF_OPTIMIZE_LEVELS = ("none", "basic", "max", "web")
+
+
+def _pdf_env(toc_json: bool = False, optimize_pdf: str | None = None) -> dict[str, str]:
+    """Environment for pdf_generator.sh's post-processing options."""
+    env = {}
+    if toc_json:
+        env["MD2_TOC_JSON"] = "1"
+    if optimize_pdf and optimize_pdf != "none":
+        if optimize_pdf not in PDF_OPTIMIZE_LEVELS:
+            levels = ", ".join(PDF_OPTIMIZE_LEVELS)
+            raise ValueError(f"optimize_pdf must be one of {levels}, got {optimize_pdf!r}")
+        env["MD2_OPTIMIZE_PDF"] = optimize_pdf
+    return env
+
+
+def _plan_html2pdf(
+    input_paths: list[str | Path],
+    page_numbers: bool = True,
+    toc_json: bool = False,
+    optimize_pdf: str | None = None,
+) -> list[_Job]:
+    """Build one pdf_generator.sh job per HTML input."""
+    planned: list[_Job] = []
+    env = _pdf_env(toc_json, optimize_pdf)
     for p in input_paths:
         p = Path(p).resolve()
         in_dir = p.parent
         out_pdf = p.with_suffix(".pdf")
 
         # Use unified container script for HTML->PDF conversion and processing
-        cmd = (
-            [runtime, "run", "--rm"]
-            + rt.get_user_args(runtime)
-            + [
-                "-v",
-                f"{in_dir}:/work",
-                "-v",
-                f"{rt.PROJECT_ROOT}/scripts:/scripts:ro",
-                rt.IMAGE_NAME,
-                "bash",
-                "/scripts/pdf_generator.sh",
-                f"/work/{p.name}",
-                f"/work/{out_pdf.name}",
-                str(page_numbers).lower(),
-            ]
+        mounts: list[rt.Mount] = [
+            (in_dir, "/work", False),
+            (rt.PROJECT_ROOT / "scripts", "/scripts", True),
+        ]
+        inner = [
+            "bash",
+            "/scripts/pdf_generator.sh",
+            f"/work/{p.name}",
+            f"/work/{out_pdf.name}",
+            str(page_numbers).lower(),
+        ]
+        planned.append(
+            _Job(p, out_pdf, mounts, dict(env), inner, security=False, chromium=True)
         )
-        subprocess.run(cmd, check=True)
+    return planned
 
-        results.append(out_pdf)
-    return results
+
+def html2pdf(
+    input_paths: list[str | Path],
+    runtime: str | None = None,
+    ensure: bool = True,
+    page_numbers: bool = True,
+    batch: bool = False,
+    jobs: int | str | None = None,
+    backend: str | None = None,
+    toc_json: bool = False,
+    optimize_pdf: str | None = None,
+) -> list[Path]:
+    concurrency = resolve_jobs(jobs)
+    _pdf_env(optimize_pdf=optimize_pdf)  # reject unknown levels before starting
+    runtime = prepare_runtime(runtime, ensure, backend)
+
+    planned = _plan_html2pdf(input_paths, page_numbers, toc_json, optimize_pdf)
+    return _run_jobs(runtime, planned, batch, concurrency)
 
 
 def md2pdf(
@@ -528,10 +1065,45 @@ def md2pdf(
     self_contained: bool = True,  # Default True: embeds MathJax + resources for offline use
     page_numbers: bool = True,
     letter: bool = False,
+    batch: bool = False,
+    jobs: int | str | None = None,
+    backend: str | None = None,
+    prerender_math: bool = False,
+    toc_json: bool = False,
+    optimize_pdf: str | None = None,
+    mount_images: bool = False,
+    offline: bool = False,
+    force: bool = False,
 ) -> list[Path]:
-    # Generate clean HTML first (without TOC placeholders)
+    _pdf_env(optimize_pdf=optimize_pdf)  # reject unknown levels before starting
+    # Inputs whose PDF is up to date are not converted again
+    build = _build_state(
+        "pdf",
+        backend,
+        force,
+        css=css,
+        dialect=dialect,
+        markdown_flags=_html_flags(markdown_flags, letter),
+        html_title=html_title,
+        title=title,
+        html_css=html_css,
+        self_contained=self_contained,
+        page_numbers=page_numbers,
+        letter=letter,
+        prerender_math=prerender_math,
+        toc_json=toc_json,
+        optimize_pdf=optimize_pdf,
+        mount_images=mount_images,
+        offline=offline,
+    )
+    stale = build.select(input_paths, ".pdf", [css] if css else [])
+    if not stale:
+        return build.finish([])
+
+    # Generate clean HTML first (without TOC placeholders); up-to-date HTML
+    # is reused when only PDF options changed
     html_paths = md2html(
-        input_paths=input_paths,
+        input_paths=stale,
         css=css,
         dialect=dialect,
         markdown_flags=markdown_flags,
@@ -543,32 +1115,41 @@ def md2pdf(
         self_contained=self_contained,
         add_toc_placeholders=False,  # Keep HTML clean
         letter=letter,
+        batch=batch,
+        jobs=jobs,
+        backend=backend,
+        prerender_math=prerender_math,
+        mount_images=mount_images,
+        offline=offline,
+        force=force,
     )
 
     # Convert HTML to PDF (container handles all PDF processing including temp files)
-    pdf_paths = html2pdf(
-        html_paths,
-        runtime=runtime,
-        ensure=False,
-        page_numbers=page_numbers,
-    )
+    try:
+        pdf_paths = html2pdf(
+            html_paths,
+            runtime=runtime,
+            ensure=False,
+            page_numbers=page_numbers,
+            batch=batch,
+            jobs=jobs,
+            backend=backend,
+            toc_json=toc_json,
+            optimize_pdf=optimize_pdf,
+        )
+    except ConversionError as exc:
+        exc.outputs = build.finish(exc.outputs)
+        raise
 
-    return pdf_paths
+    return build.finish(pdf_paths)
 
 
 def _styles_dir() -> Path:
     return rt.PROJECT_ROOT / "styles"
 
 
-def md2docx(
-    input_paths: list[str | Path],
-    dialect: str = "pandoc",
-    markdown_flags: list[str] | None = None,
-    title: str | None = None,
-    reference_doc: str | Path | None = None,
-    runtime: str | None = None,
-    ensure: bool = True,
-) -> list[Path]:
+def _docx_flags(markdown_flags: list[str] | None) -> list[str]:
+    """Normalize md2docx markdown flags (TOC on unless --no-toc)."""
     if markdown_flags is None:
         markdown_flags = ["--toc"]
 
@@ -584,50 +1165,93 @@ def md2docx(
     if toc_disabled:
         processed_flags = [f for f in processed_flags if f != "--toc"]
 
-    markdown_flags = processed_flags
-    runtime = runtime or rt.get_container_runtime()
-    if ensure:
-        rt.ensure_image(runtime, rt.PROJECT_ROOT)
+    return processed_flags
+
+
+def _plan_md2docx(
+    input_paths: list[str | Path],
+    markdown_flags: list[str],
+    dialect: str = "pandoc",
+    title: str | None = None,
+    reference_doc: str | Path | None = None,
+    runtime: str | None = None,
+    mount_images: bool = False,
+    offline: bool = False,
+    analyses: dict[Path, DocumentAnalysis] | None = None,
+) -> list[_Job]:
+    """Build one md2docx.sh job per input.
 
-    results: list[Path] = []
+    ``mount_images``, ``offline`` and ``analyses`` are as for md2html.
+    """
+    analyses = analyses or {}
+    planned: list[_Job] = []
+    remote_cache: remote.RemoteCache | None = None
+    mermaid_cache = cache.mermaid_cache()
+    mermaid_cache.sync()
     for p in input_paths:
         p = Path(p).resolve()
         abs_in = p.resolve()
         out_abs = abs_in.with_suffix(".docx")
         in_dir = abs_in.parent
 
-        # Determine the actual title to use
-        actual_title = determine_document_title(abs_in, title)
+        # Determine the actual title to use (an unreadable input is reported
+        # by the conversion itself)
+        analysis = analyses.pop(abs_in, None)
+        if analysis is None:
+            try:
+                analysis = analyze_markdown(abs_in)
+            except (OSError, UnicodeDecodeError):
+                analysis = DocumentAnalysis(abs_in)
+        actual_title = analysis.title(title)
 
         container_in = f"/work/{abs_in.name}"
         container_out = f"/work/{out_abs.name}"
+        cleanup: list[Path] = []
+
+        extra_mounts: list[rt.Mount] = []
+        content = analysis.text
+        # Several H1s: shift them below a title heading (outside fenced code)
+        if analysis.h1_count > 1:
+            content = shift_headings_and_add_title(abs_in, actual_title, content)
+        if mount_images and runtime != native.NATIVE:
+            extra_mounts = image_mounts(analysis.external_images())
+            content = rewrite_image_paths(content, in_dir, extra_mounts)
+        # Pandoc embeds remote images: it reads the cached copies instead
+        remote_files: dict[str, Path] = {}
+        if analysis.remote_images:
+            remote_cache = remote_cache or remote.RemoteCache(offline=offline)
+            remote_files = remote.cache_remote_images(
+                analysis.remote_images, abs_in.name, remote_cache
+            )
+        if remote_files:
+            prefix, remote_mounts = _remote_location(runtime or "", remote_cache)
+            extra_mounts += remote_mounts
+            content = rewrite_remote_images(content, remote_files, remote_cache.files, prefix)
+        if analysis.h1_count > 1 or extra_mounts or remote_files:
+            import uuid
 
-        cmd = [runtime, "run", "--rm"]
-        cmd += rt.get_user_args(runtime)
-        cmd += rt.get_security_args(runtime)
-
-        mounts = [
-            "-v",
-            f"{in_dir}:/work",
-            "-v",
-            f"{rt.PROJECT_ROOT}/styles:/styles:ro",
-            "-v",
-            f"{rt.PROJECT_ROOT}/filters:/filters:ro",
-            "-v",
-            f"{rt.PROJECT_ROOT}/scripts:/scripts:ro",
+            temp_file = in_dir / f"tmp_{uuid.uuid4().hex[:8]}.md"
+            temp_file.write_text(content, encoding="utf-8")
+            container_in = f"/work/{temp_file.name}"
+            cleanup.append(temp_file)
+
+        mounts: list[rt.Mount] = [
+            (in_dir, "/work", False),
+            (rt.PROJECT_ROOT / "styles", "/styles", True),
+            (rt.PROJECT_ROOT / "filters", "/filters", True),
+            (rt.PROJECT_ROOT / "scripts", "/scripts", True),
+            mermaid_cache.mount(),
+            *extra_mounts,
         ]
+        env: dict[str, str] = {"MD2_MERMAID_CACHE": mermaid_cache.container_path}
 
         if reference_doc:
             ref_abs = Path(reference_doc).resolve()
-            mounts += ["-v", f"{ref_abs.parent}:/ref:ro"]
-            cmd += ["-e", f"REFERENCE_DOC=/ref/{ref_abs.name}"]
-
-        cmd += mounts
+            mounts.append((ref_abs.parent, "/ref", True))
+            env["REFERENCE_DOC"] = f"/ref/{ref_abs.name}"
 
         if os.environ.get("DOCX_SVG") is not None:
-            cmd += ["-e", f"DOCX_SVG={os.environ['DOCX_SVG']}"]
-
-        cmd.append(rt.IMAGE_NAME)
+            env["DOCX_SVG"] = os.environ["DOCX_SVG"]
 
         # Use container script to handle all processing
         inner = [
@@ -643,9 +1267,56 @@ def md2docx(
             inner.append(f"--reference-doc=/ref/{ref_abs.name}")
         inner.extend(markdown_flags)
 
-        cmd += inner
-        subprocess.run(cmd, check=True)
+        planned.append(_Job(abs_in, out_abs, mounts, env, inner, cleanup=cleanup))
+
+    if remote_cache is not None:
+        remote_cache.close()
+    return planned
 
-        results.append(out_abs)
 
-    return results
+def md2docx(
+    input_paths: list[str | Path],
+    dialect: str = "pandoc",
+    markdown_flags: list[str] | None = None,
+    title: str | None = None,
+    reference_doc: str | Path | None = None,
+    runtime: str | None = None,
+    ensure: bool = True,
+    batch: bool = False,
+    jobs: int | str | None = None,
+    backend: str | None = None,
+    mount_images: bool = False,
+    offline: bool = False,
+    force: bool = False,
+) -> list[Path]:
+    markdown_flags = _docx_flags(markdown_flags)
+    concurrency = resolve_jobs(jobs)
+    # Inputs whose DOCX is up to date are not converted again
+    build = _build_state(
+        "docx",
+        backend,
+        force,
+        dialect=dialect,
+        markdown_flags=markdown_flags,
+        title=title,
+        reference_doc=reference_doc,
+        mount_images=mount_images,
+        offline=offline,
+    )
+    stale = build.select(input_paths, ".docx", [reference_doc] if reference_doc else [])
+    if not stale:
+        return build.finish([])
+    runtime = prepare_runtime(runtime, ensure, backend)
+
+    planned = _plan_md2docx(
+        stale,
+        markdown_flags,
+        dialect,
+        title,
+        reference_doc,
+        runtime=runtime,
+        mount_images=mount_images,
+        offline=offline,
+        analyses=build.analyses,
+    )
+    return _run_build(runtime, planned, build, batch, concurrency)
@@ -0,0 +1,89 @@
+-- Pre-render TeX math to static SVG.
+--
+-- All formulas of a document are collected first; those missing from the
+-- content-addressed cache (MD2_MATH_CACHE) are rendered by a single
+-- tex2svg.js run, then every Math element is replaced by its cached SVG.
+-- Formulas that could not be rendered stay Math elements, so pandoc still
+-- loads MathJax for them; otherwise the output needs no JavaScript.
+
+local sha1 = pandoc.utils.sha1
+
+local CACHE = os.getenv('MD2_MATH_CACHE') or '/tmp/md2-math'
+local SCRIPTS = os.getenv('MD2_SCRIPTS') or '/scripts'
+-- Part of every cache key: bump when the rendering setup changes
+local RENDERER = 'mathjax-3.2.2-svg-local-1'
+
+local function cache_key(math)
+  return sha1(RENDERER .. '\0' .. math.mathtype .. '\0' .. math.text)
+end
+
+local function cache_path(key)
+  return CACHE .. '/' .. key:sub(1, 2) .. '/' .. key .. '.svg'
+end
+
+local function read_file(path)
+  local f = io.open(path, 'r')
+  if not f then
+    return nil
+  end
+  local data = f:read('a')
+  f:close()
+  return data
+end
+
+local function json_string(s)
+  local escaped = s:gsub('[%c"\\]', function(c)
+    if c == '"' then return '\\"' end
+    if c == '\\' then return '\\\\' end
+    if c == '\n' then return '\\n' end
+    if c == '\t' then return '\\t' end
+    return string.format('\\u%04x', c:byte())
+  end)
+  return '"' .. escaped .. '"'
+end
+
+local function render_missing(doc)
+  local seen, jobs = {}, {}
+  doc:walk({
+    Math = function(math)
+      local key = cache_key(math)
+      if not seen[key] then
+        seen[key] = true
+        local f = io.open(cache_path(key), 'r')
+        if f then
+          f:close()
+        else
+          jobs[#jobs + 1] = string.format(
+            '{"key":"%s","display":%s,"tex":%s}',
+            key, tostring(math.mathtype == 'DisplayMath'), json_string(math.text))
+        end
+      end
+    end,
+  })
+  if #jobs == 0 then
+    return
+  end
+  local ok, err = pcall(pandoc.pipe, 'node', { SCRIPTS .. '/tex2svg.js', CACHE },
+    '[' .. table.concat(jobs, ',') .. ']')
+  if not ok then
+    io.stderr:write('math_svg: tex2svg.js failed: ' .. tostring(err) .. '\n')
+  end
+end
+
+function Pandoc(doc)
+  render_missing(doc)
+  return doc:walk({
+    Math = function(math)
+      local svg = read_file(cache_path(cache_key(math)))
+      if not svg then
+        return nil
+      end
+      if math.mathtype == 'DisplayMath' then
+        return pandoc.RawInline('html',
+          '<span class="math display" style="display:block;text-align:center;margin:1em 0">'
+          .. svg .. '</span>')
+      end
+      return pandoc.RawInline('html', '<span class="math inline">' .. svg .. '</span>')
+    end,
+  })
+end
@@ -1,169 +1,150 @@
 local sha1 = require('pandoc.utils').sha1
 
-local function url_encode(data)
-  -- URL-encode SVG data for data URI
-  local result = {}
-  for i = 1, #data do
-    local c = data:sub(i, i)
-    local byte = string.byte(c)
-    if (byte >= 65 and byte <= 90) or   -- A-Z
-       (byte >= 97 and byte <= 122) or  -- a-z
-       (byte >= 48 and byte <= 57) or   -- 0-9
-       c == '-' or c == '_' or c == '.' or c == '~' then
-      result[#result + 1] = c
-    else
-      result[#result + 1] = string.format("%%%02X", byte)
-    end
+-- Persistent render cache mounted from the host (see md2/cache.py); without
+-- it diagrams are rendered to /tmp for this document only.
+local CACHE = os.getenv('MD2_MERMAID_CACHE')
+if CACHE == '' then
+  CACHE = nil
+end
+local THEME = os.getenv('MERMAID_THEME') or 'default'
+local SCRIPTS = os.getenv('MD2_SCRIPTS') or '/scripts'
+-- SVG sizing helpers live next to this filter
+local svg = dofile(pandoc.path.join({ pandoc.path.directory(PANDOC_SCRIPT_FILE), 'mermaid_svg.lua' }))
+
+local stats = { hits = 0, misses = 0 }
+
+local function file_exists(path)
+  local f = io.open(path, 'rb')
+  if f then
+    f:close()
+    return true
   end
-  return table.concat(result)
+  return false
 end
 
-local function mermaid_image(code, ext, scale)
-  ext = ext or '.svg'
-  scale = scale or '6'
-  local hash = sha1(code)
-  local base = '/tmp/mermaid-' .. hash
-  local infile = base .. '.mmd'
-  local outfile = base .. ext
-  local f = assert(io.open(infile, 'w'))
-  f:write(code)
-  f:close()
-  local ok, err = pcall(function()
-    pandoc.pipe('mermaid', {'-i', infile, '-o', outfile, '-b', 'transparent', '-s', scale}, '')
-  end)
-  os.remove(infile)
-  if not ok then
-    return nil, 'mermaid cli failed: ' .. tostring(err)
+-- mermaid-cli version, part of every cache key: set in the image
+-- (MD2_MERMAID_VERSION), asked from the CLI once otherwise.
+local cli_version_value
+local function cli_version()
+  if not cli_version_value then
+    cli_version_value = os.getenv('MD2_MERMAID_VERSION')
+    if not cli_version_value or cli_version_value == '' then
+      local ok, out = pcall(pandoc.pipe, 'mermaid', {'--version'}, '')
+      cli_version_value = ok and (out:gsub('%s+$', '')) or 'unknown'
+    end
   end
-  return outfile
+  return cli_version_value
 end
 
--- Make SVGs render at a sensible, responsive size without relying on CSS.
--- Heuristic: use viewBox width to choose a default width percentage.
-local function tune_svg(svg, opts)
-  if type(svg) ~= 'string' then
-    return svg
+-- One journal line per lookup; the host turns them into hit/miss counters
+-- and LRU order.
+local function record(kind, name)
+  if kind == 'hit' then
+    stats.hits = stats.hits + 1
+  else
+    stats.misses = stats.misses + 1
   end
-  opts = opts or {}
-  local open_tag = svg:match('<svg[^>]*>')
-  if not open_tag then
-    return svg
+  if not CACHE then
+    return
+  end
+  local f = io.open(CACHE .. '/journal.log', 'a')
+  if f then
+    f:write(kind .. ' ' .. name .. '\n')
+    f:close()
   end
+end
 
-  -- Extract attributes we care about
-  local viewbox = open_tag:match('view[Bb]ox%s*=%s*"([^"]+)"') or open_tag:match("view[Bb]ox%s*=%s*'([^']+)'")
-  local width_attr = open_tag:match('width%s*=%s*"([^"]+)"') or open_tag:match("width%s*=%s*'([^']+)'")
-  local height_attr = open_tag:match('height%s*=%s*"([^"]+)"') or open_tag:match("height%s*=%s*'([^']+)'")
-  local style_attr = open_tag:match('style%s*=%s*"([^"]*)"') or open_tag:match("style%s*=%s*'([^']*)'")
+local function json_string(s)
+  local escaped = s:gsub('[%c"\\]', function(c)
+    if c == '"' then return '\\"' end
+    if c == '\\' then return '\\\\' end
+    if c == '\n' then return '\\n' end
+    if c == '\t' then return '\\t' end
+    return string.format('\\u%04x', c:byte())
+  end)
+  return '"' .. escaped .. '"'
+end
 
-  -- Determine width percent from viewBox width if available
-  local width_percent = tonumber(opts.width_percent or '') or 100
-  if viewbox then
-    local nums = {}
-    for n in viewbox:gmatch('[-%d%.]+') do
-      nums[#nums+1] = tonumber(n)
-    end
-    local vbw = nums[3] or 0
-    local vbh = nums[4] or 0
-    if vbw > 0 and (not opts.width_percent) then
-      -- Auto-adjust based on viewBox dimensions
-      local aspect = vbw / (vbh > 0 and vbh or vbw)
-      if aspect > 2.5 then
-        -- Very wide diagram: use full width
-        width_percent = 100
-      elseif aspect > 1.8 then
-        -- Wide diagram
-        width_percent = 100
-      elseif vbw < 300 then
-        -- Narrow diagram
-        width_percent = 60
-      elseif vbw < 500 then
-        -- Medium diagram
-        width_percent = 80
-      else
-        -- Large diagram
-        width_percent = 100
-      end
-    end
-  elseif not opts.width_percent then
-    -- No viewBox: pick a safe default
-    width_percent = 90
+-- A render job for one distinct diagram; ``output`` is its place in the
+-- cache, or in /tmp for this document only.
+local function diagram_job(code, ext, scale, theme)
+  local key = sha1(table.concat({ cli_version(), scale, ext, theme, code }, '\0'))
+  local name = key .. ext
+  local output = '/tmp/mermaid-' .. name
+  if CACHE then
+    output = CACHE .. '/' .. key:sub(1, 2) .. '/' .. name
   end
+  return { code = code, ext = ext, scale = scale, theme = theme, key = key, name = name, output = output }
+end
 
-  -- Build new style string
-  local extra_style = string.format('width:%d%%;height:auto;max-width:100%%;', width_percent)
-  local new_style
-  if style_attr and #style_attr > 0 then
-    -- Append, avoiding duplicate width/height if present
-    local cleaned = style_attr
-      :gsub('%s*width%s*:%s*[^;]*;?', '')
-      :gsub('%s*height%s*:%s*[^;]*;?', '')
-    if #cleaned > 0 and cleaned:sub(-1) ~= ';' then
-      cleaned = cleaned .. ';'
+-- Render all jobs with one mermaid_batch.js run (one browser). Returns the
+-- error message of each failed diagram by output path, or nil if the batch
+-- renderer could not run at all.
+local function render_batch(jobs)
+  local items = {}
+  for _, job in ipairs(jobs) do
+    items[#items + 1] = string.format('{"code":%s,"output":%s,"format":"%s","scale":%s,"theme":%s}',
+      json_string(job.code), json_string(job.output), job.ext:sub(2), json_string(job.scale),
+      json_string(job.theme))
+  end
+  local ok, out = pcall(pandoc.pipe, 'node', { SCRIPTS .. '/mermaid_batch.js' },
+    '[' .. table.concat(items, ',') .. ']')
+  if not ok then
+    io.stderr:write('[mermaid] batch renderer failed, using the mermaid CLI: ' .. tostring(out) .. '\n')
+    return nil
+  end
+  local errors, i = {}, 0
+  for line in out:gmatch('[^\n]+') do
+    i = i + 1
+    if jobs[i] and line ~= 'ok' then
+      errors[jobs[i].output] = line:gsub('^error ', '')
     end
-    new_style = cleaned .. extra_style
-  else
-    new_style = extra_style
   end
-
-  -- Remove fixed width/height attributes to allow responsive sizing only if viewBox is present
-  local new_open = open_tag
-  if viewbox then
-    new_open = new_open
-      :gsub('%s+width%s*=%s*"[^"]*"', '')
-      :gsub("%s+width%s*=%s*'[^']*'", '')
-      :gsub('%s+height%s*=%s*"[^"]*"', '')
-      :gsub("%s+height%s*=%s*'[^']*'", '')
+  for j = i + 1, #jobs do
+    errors[jobs[j].output] = 'no result from mermaid_batch.js'
   end
+  return errors
+end
 
-  -- Ensure preserveAspectRatio is set for proper scaling
-  if not new_open:match('preserveAspectRatio%s*=') then
-    new_open = new_open:gsub('>$', ' preserveAspectRatio="xMidYMid meet">')
+-- Render one diagram with the mermaid CLI (a browser of its own); returns
+-- an error message on failure.
+local function render_with_cli(job)
+  local tmpfile = job.output
+  if CACHE then
+    local dir = CACHE .. '/' .. job.key:sub(1, 2)
+    pcall(pandoc.system.make_directory, dir, true)
+    -- Render under a temporary name (mmdc picks the format from the
+    -- extension) and rename: concurrent conversions share the cache.
+    tmpfile = dir .. '/' .. job.key .. '.tmp' .. tostring(math.random(1, 1000000000)) .. job.ext
   end
-
-  -- Ensure a CSS class for centering via stylesheet
-  if new_open:match('class%s*=') then
-    local class_val = new_open:match('class%s*=%s*"([^"]*)"') or new_open:match("class%s*=%s*'([^']*)'") or ''
-    local has_mermaid = false
-    for token in string.gmatch(class_val, "%S+") do
-      if token == "mermaid-svg" then
-        has_mermaid = true
-        break
-      end
-    end
-    if not has_mermaid then
-      new_open = new_open
-        :gsub('class%s*=%s*"([^"]*)"', function(c) return 'class="' .. c .. ' mermaid-svg"' end)
-        :gsub("class%s*=%s*'([^']*)'", function(c) return "class='" .. c .. " mermaid-svg'" end)
-    end
-  else
-    new_open = new_open:gsub('>$', ' class="mermaid-svg">')
+  local infile = '/tmp/mermaid-' .. job.key .. '.mmd'
+  local f = assert(io.open(infile, 'w'))
+  f:write(job.code)
+  f:close()
+  local ok, err = pcall(function()
+    pandoc.pipe('mermaid', {'-i', infile, '-o', tmpfile, '-b', 'transparent', '-s', job.scale, '-t', job.theme}, '')
+  end)
+  os.remove(infile)
+  if not ok then
+    os.remove(tmpfile)
+    return 'mermaid cli failed: ' .. tostring(err)
   end
-
-  -- Upsert style attribute
-  if new_open:match('style%s*=') then
-    new_open = new_open
-      :gsub('style%s*=%s*"[^"]*"', function() return 'style="' .. new_style .. '"' end)
-      :gsub("style%s*=%s*'[^']*'", function() return "style='" .. new_style .. "'" end)
-  else
-    new_open = new_open:gsub('>$', function() return ' style="' .. new_style .. '">' end)
+  if tmpfile ~= job.output then
+    local renamed, rename_err = os.rename(tmpfile, job.output)
+    if not renamed then
+      os.remove(tmpfile)
+      return 'cannot store render: ' .. tostring(rename_err)
+    end
   end
+  return nil
+end
 
-  -- Replace only the first <svg ...> tag (plain find)
-  local s, e = string.find(svg, open_tag, 1, true)
-  if s then
-    return svg:sub(1, s - 1) .. new_open .. svg:sub(e + 1)
-  else
-    return svg
-  end
+local function is_docx_output()
+  return (FORMAT or ''):match('docx') ~= nil
 end
 
-function CodeBlock(el)
-  if not el.classes:includes('mermaid') then
-    return nil
-  end
-  local fmt = (FORMAT or '')
-  local is_docx = fmt:match('docx') ~= nil
+-- Render format, scale and theme of a mermaid code block
+local function block_job(el)
   local force_svg = os.getenv('DOCX_SVG') == '1' or el.attributes['svg'] == '1'
 
   -- Auto-detect scale based on diagram complexity
@@ -176,12 +157,13 @@ function CodeBlock(el)
     scale = '5.5'
   end
 
-  local out, err = mermaid_image(el.text, (is_docx and not force_svg) and '.png' or '.svg', scale)
-  if not out then
-    io.stderr:write('[mermaid] generation failed: ' .. err .. '\n')
-    return nil
-  end
+  local ext = (is_docx_output() and not force_svg) and '.png' or '.svg'
+  return diagram_job(el.text, ext, scale, el.attributes['theme'] or THEME)
+end
 
+-- Replace a mermaid code block by its rendered diagram at ``out``
+local function diagram_block(el, out)
+  local is_docx = is_docx_output()
   if is_docx then
     -- For DOCX: return Image element, keep file for Pandoc to process
     local desired_percent
@@ -211,7 +193,7 @@ function CodeBlock(el)
     end
     return pandoc.Para({ pandoc.Image({}, out, "", attr) })
   else
-    -- For HTML: inline SVG with tuning, remove file
+    -- For HTML: inline SVG with tuning
     local f = io.open(out, 'rb')
     if not f then
       io.stderr:write('[mermaid] cannot read output: ' .. out .. '\n')
@@ -219,7 +201,6 @@ function CodeBlock(el)
     end
     local data = f:read('*all')
     f:close()
-    os.remove(out)
 
     -- Inspect code block attributes for optional sizing control
     local desired_percent
@@ -239,27 +220,77 @@ function CodeBlock(el)
       end
     end
     local scale = el.attributes["scale"] or el.attributes["data-scale"]
-    local scale_num = tonumber(scale)
-    if scale_num and scale_num > 0 and not desired_percent then
-      -- Apply scale to heuristic defaults (handled in tune_svg via opts.width_percent)
-      -- We'll compute after we know heuristic; here we pass a hint to scale the result later.
-    end
+    local tuned = svg.tune(data, { width_percent = desired_percent, scale = scale })
+    -- Inline the SVG so sizing is self-contained and not CSS-dependent.
+    return pandoc.RawBlock('html', tuned)
+  end
+end
 
-    local tuned = tune_svg(data, { width_percent = desired_percent })
-    if scale_num and scale_num > 0 then
-      -- Adjust the inline style width by scaling factor
-      local current_style = tuned:match('<svg[^>]-style%s*=%s*"([^"]*)"') or tuned:match("<svg[^>]-style%s*=%s*'([^']*)'")
-      if current_style then
-        local w = current_style:match('width%s*:%s*(%d+)%%')
-        if w then
-          local newp = math.max(10, math.min(100, math.floor(tonumber(w) * scale_num + 0.5)))
-          local new_style = current_style:gsub('width%s*:%s*%d+%%', 'width:' .. newp .. '%%')
-          tuned = tuned:gsub('style%s*=%s*"[^"]*"', function() return 'style="' .. new_style .. '"' end)
-          tuned = tuned:gsub("style%s*=%s*'[^']*'", function() return "style='" .. new_style .. "'" end)
+function Pandoc(doc)
+  -- Collect every diagram first, so all missing ones render in one batch
+  local jobs, seen, total = {}, {}, 0
+  doc:walk({
+    CodeBlock = function(el)
+      if not el.classes:includes('mermaid') then
+        return nil
+      end
+      total = total + 1
+      local job = block_job(el)
+      if not seen[job.output] then
+        seen[job.output] = true
+        if file_exists(job.output) then
+          record('hit', job.name)
+        else
+          jobs[#jobs + 1] = job
         end
       end
+    end,
+  })
+  if total == 0 then
+    return nil
+  end
+
+  local failed = {}
+  if #jobs > 0 then
+    local errors = render_batch(jobs)
+    for _, job in ipairs(jobs) do
+      local err
+      if errors then
+        err = errors[job.output]
+      else
+        err = render_with_cli(job)
+      end
+      if err then
+        -- This diagram stays a code block; the others are unaffected
+        failed[job.output] = true
+        io.stderr:write('[mermaid] generation failed: ' .. err .. '\n')
+      else
+        record('miss', job.name)
+      end
+    end
+  end
+
+  doc = doc:walk({
+    CodeBlock = function(el)
+      if not el.classes:includes('mermaid') then
+        return nil
+      end
+      local out = block_job(el).output
+      if failed[out] then
+        return nil
+      end
+      return diagram_block(el, out)
+    end,
+  })
+
+  -- Without a cache, HTML renders are inlined and no longer needed (DOCX
+  -- images are read by pandoc after the filter)
+  if not CACHE and not is_docx_output() then
+    for _, job in ipairs(jobs) do
+      os.remove(job.output)
     end
-    -- Inline the SVG so sizing is self-contained and not CSS-dependent.
-    return pandoc.RawBlock('html', tuned)
   end
+  io.stderr:write(string.format('[mermaid] %d diagram(s): %d cached, %d rendered\n',
+    total, stats.hits, stats.misses))
+  return doc
 end
@@ -0,0 +1,113 @@
+-- Sizing of rendered Mermaid SVGs inlined into HTML (used by mermaid.lua).
+--
+-- Only the root <svg> tag is edited: it is located once, rebuilt with the
+-- responsive size, class and aspect ratio, and spliced back. The rest of the
+-- document (often hundreds of KB for generated diagrams) is never scanned
+-- again or re-encoded.
+
+local M = {}
+
+local function attribute(tag, name)
+  return tag:match('%s' .. name .. '%s*=%s*"([^"]*)"') or tag:match('%s' .. name .. "%s*=%s*'([^']*)'")
+end
+
+-- Default width (percent) from the viewBox dimensions
+local function auto_width(viewbox)
+  if not viewbox then
+    -- No viewBox: pick a safe default
+    return 90
+  end
+  local nums = {}
+  for n in viewbox:gmatch('[-%d%.]+') do
+    nums[#nums + 1] = tonumber(n)
+  end
+  local vbw = nums[3] or 0
+  local vbh = nums[4] or 0
+  if vbw <= 0 then
+    return 100
+  end
+  local aspect = vbw / (vbh > 0 and vbh or vbw)
+  if aspect > 1.8 then
+    -- Wide diagram: use full width
+    return 100
+  elseif vbw < 300 then
+    return 60
+  elseif vbw < 500 then
+    return 80
+  end
+  return 100
+end
+
+-- Keep declarations of an existing style except the ones we set
+local function clean_style(style)
+  local kept = {}
+  for decl in style:gmatch('[^;]+') do
+    local prop = decl:match('^%s*([%w-]+)%s*:')
+    if prop and prop ~= 'width' and prop ~= 'height' and prop ~= 'max-width' then
+      kept[#kept + 1] = decl:match('^%s*(.-)%s*$')
+    end
+  end
+  if #kept == 0 then
+    return ''
+  end
+  return table.concat(kept, ';') .. ';'
+end
+
+-- Make an SVG render at a sensible, responsive size without relying on CSS.
+-- opts.width_percent fixes the width (default: chosen from the viewBox),
+-- opts.scale multiplies it (clamped to 10-100%).
+function M.tune(svg, opts)
+  if type(svg) ~= 'string' then
+    return svg
+  end
+  opts = opts or {}
+  local s, e = svg:find('<svg[^>]*>')
+  if not s then
+    return svg
+  end
+  local tag = svg:sub(s, e)
+  local viewbox = attribute(tag, 'view[Bb]ox')
+
+  local width_percent = tonumber(opts.width_percent or '') or auto_width(viewbox)
+  local scale = tonumber(opts.scale or '')
+  if scale and scale > 0 then
+    width_percent = math.max(10, math.min(100, math.floor(width_percent * scale + 0.5)))
+  end
+
+  -- One pass over the attributes: drop the fixed size (only with a viewBox,
+  -- which keeps the aspect ratio) and the style, mark the class
+  local style, has_class, has_ratio = '', false, false
+  local close = tag:sub(-2) == '/>' and '/>' or '>'
+  local attrs = tag:sub(5, -1 - #close):gsub('%s+([%w:_-]+)%s*=%s*(["\'])(.-)%2', function(name, q, value)
+    if name == 'style' then
+      style = clean_style(value)
+      return ''
+    elseif viewbox and (name == 'width' or name == 'height') then
+      return ''
+    elseif name == 'preserveAspectRatio' then
+      has_ratio = true
+    elseif name == 'class' then
+      has_class = true
+      for token in value:gmatch('%S+') do
+        if token == 'mermaid-svg' then
+          return nil
+        end
+      end
+      return ' class=' .. q .. value .. ' mermaid-svg' .. q
+    end
+    return nil
+  end)
+
+  local parts = { '<svg', attrs }
+  if not has_ratio then
+    parts[#parts + 1] = ' preserveAspectRatio="xMidYMid meet"'
+  end
+  if not has_class then
+    parts[#parts + 1] = ' class="mermaid-svg"'
+  end
+  parts[#parts + 1] = string.format(' style="%swidth:%d%%;height:auto;max-width:100%%;"', style, width_percent)
+  parts[#parts + 1] = close
+  return svg:sub(1, s - 1) .. table.concat(parts) .. svg:sub(e + 1)
+end
+
+return M
@@ -0,0 +1,214 @@
+"""
+Dependency manifests for incremental builds.
+
+Every output written by md2html, md2pdf or md2docx gets a manifest in
+``cache_dir("manifests")`` recording what it was built from: the size,
+mtime and SHA-256 of the input, of the local images it references and of
+the CSS or reference document, a hash of the conversion options, and the
+toolchain version (the image build hash plus the mounted scripts, filters
+and styles). When the next run finds a matching manifest and the output is
+unchanged, the input is skipped.
+
+Checking an up-to-date output only reads its manifest and stats the files
+it lists; a file is hashed again only when its size or mtime changed, so a
+touched but unmodified file does not cause a rebuild.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from . import runtime as rt
+from .analysis import DocumentAnalysis, analyze_markdown
+
+# Bind-mounted at run time, so not covered by the image build hash
+TOOLCHAIN_DIRS = ("scripts", "filters", "styles")
+# Host environment variables the conversions pass on to the container
+ENV_OPTIONS = ("LINK_CSS", "INTERNAL_RESOURCES", "DOCX_SVG")
+
+_toolchain: Dict[Path, str] = {}
+
+
+def toolchain_hash(root: Optional[Path] = None) -> str:
+    """Hash of everything besides the inputs that shapes an output."""
+    root = (rt.PROJECT_ROOT if root is None else root).resolve()
+    if root not in _toolchain:
+        h = hashlib.sha256(rt.build_hash(root).encode())
+        for name in TOOLCHAIN_DIRS:
+            for path in sorted((root / name).rglob("*")):
+                if path.is_file() and "__pycache__" not in path.parts:
+                    h.update(path.relative_to(root).as_posix().encode())
+                    h.update(b"\0")
+                    h.update(path.read_bytes())
+                    h.update(b"\0")
+        _toolchain[root] = h.hexdigest()
+    return _toolchain[root]
+
+
+def _stat(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def _digest(path: Path) -> Optional[str]:
+    h = hashlib.sha256()
+    try:
+        with path.open("rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+class BuildOutputs(list):
+    """Output paths in input order; ``rebuilt`` and ``skipped`` split them up."""
+
+    def __init__(self, outputs: Iterable[Path] = (), rebuilt=(), skipped=()):
+        super().__init__(outputs)
+        self.rebuilt: List[Path] = list(rebuilt)
+        self.skipped: List[Path] = list(skipped)
+
+    def summary(self) -> str:
+        return f"{len(self.rebuilt)} rebuilt, {len(self.skipped)} up to date"
+
+
+class BuildState:
+    """
+    Up-to-date checks for the outputs of one conversion call.
+
+    ``select`` returns the inputs to convert and remembers their
+    dependencies and analyses (``analyses``, for the planners to reuse);
+    ``finish`` records manifests for the outputs that were written. With
+    ``force`` every input is converted (manifests are still recorded for the
+    next run).
+    """
+
+    def __init__(
+        self,
+        options: Dict,
+        force: bool = False,
+        directory: Optional[Path] = None,
+    ):
+        self.path = directory or rt.cache_dir("manifests")
+        options = dict(options, toolchain=toolchain_hash())
+        options["env"] = {name: os.environ.get(name) for name in ENV_OPTIONS}
+        encoded = json.dumps(options, sort_keys=True, default=str).encode()
+        self.key = hashlib.sha256(encoded).hexdigest()
+        self.force = force
+        self.skipped: List[Path] = []
+        # Output -> input, for every input passed to select()
+        self.sources: Dict[Path, Path] = {}
+        # Input -> analysis, for the inputs select() returned
+        self.analyses: Dict[Path, DocumentAnalysis] = {}
+        self._outputs: List[Path] = []
+        self._pending: Dict[Path, Dict] = {}
+
+    def _manifest_file(self, output: Path) -> Path:
+        digest = hashlib.sha256(str(output).encode()).hexdigest()
+        return self.path / digest[:2] / f"{digest}.json"
+
+    def _up_to_date(self, output: Path, manifest: Dict) -> bool:
+        try:
+            return self._matches(output, manifest)
+        except (TypeError, ValueError, AttributeError):
+            return False  # a corrupt manifest only costs a rebuild
+
+    def _matches(self, output: Path, manifest: Dict) -> bool:
+        if manifest.get("options") != self.key:
+            return False
+        if list(_stat(output) or ()) != manifest.get("output"):
+            return False
+        dependencies = manifest.get("dependencies") or {}
+        touched = False
+        for name, (size, mtime, digest) in dependencies.items():
+            st = _stat(Path(name))
+            if st is None:
+                return False
+            if st != (size, mtime):
+                if _digest(Path(name)) != digest:
+                    return False
+                dependencies[name] = [*st, digest]
+                touched = True
+        if touched:
+            # Same content: remember the new mtime to skip hashing next time
+            rt.save_json(self._manifest_file(output), manifest)
+        return True
+
+    def _dependencies(self, files: Iterable[Path], previous: Dict) -> Dict[str, list]:
+        dependencies: Dict[str, list] = {}
+        for path in sorted(set(files)):
+            st = _stat(path)
+            if st is None:
+                continue
+            old = previous.get(str(path))
+            if isinstance(old, list) and len(old) == 3 and tuple(old[:2]) == st:
+                digest = old[2]
+            else:
+                digest = _digest(path)
+            dependencies[str(path)] = [*st, digest]
+        return dependencies
+
+    def select(
+        self,
+        input_paths: Iterable,
+        suffix: str,
+        files: Iterable[Path] = (),
+        analyses: Optional[Dict[Path, DocumentAnalysis]] = None,
+    ) -> List[Path]:
+        """Inputs whose ``suffix`` output is missing or out of date.
+
+        ``files`` are dependencies shared by all inputs (CSS, reference doc);
+        ``analyses`` are inputs another BuildState already read.
+        """
+        analyses = analyses or {}
+        files = [Path(f).resolve() for f in files]
+        stale: List[Path] = []
+        for p in input_paths:
+            source = Path(p).resolve()
+            output = source.with_suffix(suffix)
+            self._outputs.append(output)
+            self.sources[output] = source
+            manifest = rt.load_json(self._manifest_file(output))
+            if not self.force and self._up_to_date(output, manifest):
+                self.skipped.append(output)
+                continue
+            stale.append(source)
+            previous = manifest.get("dependencies")
+            if not isinstance(previous, dict):
+                previous = {}
+            dependencies = [source, *files]
+            try:
+                analysis = analyses.get(source) or analyze_markdown(source)
+            except (OSError, UnicodeDecodeError):
+                pass  # reported by the conversion
+            else:
+                self.analyses[source] = analysis
+                dependencies += analysis.local_images
+            self._pending[output] = {
+                "options": self.key,
+                "dependencies": self._dependencies(dependencies, previous),
+            }
+        return stale
+
+    def record(self, output: Path) -> None:
+        """Record the manifest of ``output`` once it was written."""
+        manifest = self._pending.pop(output, None)
+        st = _stat(output)
+        if manifest is not None and st is not None:
+            manifest["output"] = list(st)
+            rt.save_json(self._manifest_file(output), manifest)
+
+    def finish(self, written: Iterable[Path]) -> BuildOutputs:
+        """Record manifests for the ``written`` outputs; all usable outputs."""
+        rebuilt = list(written)
+        for output in rebuilt:
+            self.record(output)
+        done = set(rebuilt) | set(self.skipped)
+        return BuildOutputs(
+            [o for o in self._outputs if o in done], rebuilt, self.skipped
+        )
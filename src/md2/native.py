@@ -0,0 +1,257 @@
+"""
+Native host backend.
+
+Runs the bundled scripts, Lua filters and ``print.js`` directly on the host
+instead of inside the image, for machines (e.g. CI images) that already
+have pandoc, node/puppeteer and PyMuPDF installed.
+
+Select it with ``backend="native"`` or ``MD2_BACKEND=native``; the container
+backend stays the default. Jobs are planned exactly as for the container:
+container paths in their arguments and environment are translated back to
+the host paths they would have been mounted from, and the scripts find
+their siblings through ``MD2_SCRIPTS``/``MD2_FILTERS``/``MD2_STYLES``/
+``MD2_APP`` and the ``MD2_MATHJAX_*`` variables (which default to the
+container paths).
+
+Tools are discovered and version-checked once per process.
+"""
+import os
+import re
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from . import runtime as rt
+
+# Used in place of a container runtime name once the native backend is chosen
+NATIVE = "native"
+CONTAINER = "container"
+BACKENDS = (CONTAINER, NATIVE)
+
+# --embed-resources (self-contained HTML) needs pandoc 2.19
+MIN_PANDOC = (2, 19)
+
+MATHJAX_CDN = "https://cdn.jsdelivr.net/npm/mathjax@3.2.2/es5/tex-svg-full.js"
+
+
+def resolve_backend(backend: Optional[str] = None) -> str:
+    """``backend`` or ``$MD2_BACKEND``, defaulting to the container backend."""
+    choice = (backend or os.environ.get("MD2_BACKEND") or CONTAINER).lower()
+    if choice not in BACKENDS:
+        raise ValueError(f"backend must be one of {', '.join(BACKENDS)}, got {choice!r}")
+    return choice
+
+
+@dataclass
+class Tools:
+    """Host tools found by discover()."""
+
+    pandoc: str
+    pandoc_version: Tuple[int, ...]
+    bash: str
+    python: str
+    node: Optional[str]
+    mermaid_bin: Optional[Path]
+    app_dir: Path
+    mathjax_js: str
+    mathjax_tex_js: Optional[str] = None
+    mathjax_dir: Optional[str] = None
+
+
+def _pandoc_version(pandoc: str) -> Tuple[int, ...]:
+    out = subprocess.run(
+        [pandoc, "--version"], check=True, stdout=subprocess.PIPE, text=True
+    ).stdout
+    m = re.match(r"pandoc(?:\.exe)?\s+([\d.]+)", out)
+    if not m:
+        raise RuntimeError(f"Cannot parse pandoc version from {out.splitlines()[:1]}")
+    return tuple(int(x) for x in m.group(1).strip(".").split("."))
+
+
+def _find_mathjax() -> str:
+    if os.environ.get("MD2_MATHJAX_JS"):
+        return os.environ["MD2_MATHJAX_JS"]
+    candidates = [
+        rt.PROJECT_ROOT / "scripts" / "node_modules" / "mathjax" / "es5" / "tex-svg-full.js",
+        Path("/mathjax/tex-svg-full.js"),
+        Path("/usr/share/nodejs/mathjax-full/es5/tex-svg-full.js"),
+    ]
+    for candidate in candidates:
+        if candidate.is_file():
+            return str(candidate)
+    # pandoc fetches it when embedding resources
+    return MATHJAX_CDN
+
+
+def _find_mathjax_tex(full: str) -> Optional[str]:
+    """The smaller tex-svg.js bundle next to ``full``, if installed."""
+    if os.environ.get("MD2_MATHJAX_TEX_JS"):
+        return os.environ["MD2_MATHJAX_TEX_JS"]
+    if full == MATHJAX_CDN:
+        return None
+    parent = Path(full).parent
+    for candidate in (parent / "tex-svg.js", parent / "es5" / "tex-svg.js"):
+        if candidate.is_file():
+            return str(candidate)
+    return None
+
+
+def _find_mathjax_dir(full: str) -> Optional[str]:
+    """The mathjax ``es5`` directory (with node-main.js) for tex2svg.js."""
+    if os.environ.get("MD2_MATHJAX_DIR"):
+        return os.environ["MD2_MATHJAX_DIR"]
+    if full == MATHJAX_CDN:
+        return None
+    parent = Path(full).parent
+    for candidate in (parent, parent / "es5"):
+        if (candidate / "node-main.js").is_file():
+            return str(candidate)
+    return None
+
+
+def _mermaid_bin() -> Optional[Path]:
+    """Directory with a ``mermaid`` command for the Lua filter, if one is needed.
+
+    The image provides ``mermaid`` as a wrapper around ``mmdc``; on the host a
+    shim is created in the cache directory when only ``mmdc`` is installed.
+    """
+    if rt._cached_which("mermaid") or not rt._cached_which("mmdc"):
+        return None
+    bin_dir = rt.cache_dir("native", "bin")
+    shim = bin_dir / "mermaid"
+    if not shim.exists():
+        shim.write_text('#!/usr/bin/env bash\nexec mmdc "$@"\n', encoding="utf-8")
+        shim.chmod(0o755)
+    return bin_dir
+
+
+def discover() -> Tools:
+    """Find and check the host tools; raises RuntimeError if one is missing."""
+    key = ("native-tools", os.environ.get("PATH"), os.environ.get("MD2_APP"))
+    if key in rt._probes:
+        return rt._probes[key]  # type: ignore[return-value]
+
+    missing = [n for n in ("pandoc", "bash", "python3") if not rt._cached_which(n)]
+    if missing:
+        raise RuntimeError(f"Native backend needs {', '.join(missing)} on PATH")
+    pandoc = rt._cached_which("pandoc")
+    version = _pandoc_version(pandoc)  # type: ignore[arg-type]
+    if version < MIN_PANDOC:
+        found = ".".join(map(str, version))
+        wanted = ".".join(map(str, MIN_PANDOC))
+        raise RuntimeError(f"Native backend needs pandoc >= {wanted}, found {found}")
+
+    mathjax_js = _find_mathjax()
+    tools = Tools(
+        pandoc=pandoc,  # type: ignore[arg-type]
+        pandoc_version=version,
+        bash=rt._cached_which("bash"),  # type: ignore[arg-type]
+        python=rt._cached_which("python3"),  # type: ignore[arg-type]
+        node=rt._cached_which("node"),
+        mermaid_bin=_mermaid_bin(),
+        app_dir=Path(os.environ.get("MD2_APP") or rt.PROJECT_ROOT / "scripts"),
+        mathjax_js=mathjax_js,
+        mathjax_tex_js=_find_mathjax_tex(mathjax_js),
+        mathjax_dir=_find_mathjax_dir(mathjax_js),
+    )
+    rt._probes[key] = tools
+    return tools
+
+
+def check_pdf_tools(tools: Tools) -> None:
+    """Check node/puppeteer and PyMuPDF once, before the first PDF job."""
+    key = ("native-pdf", tools.node, str(tools.app_dir), tools.python)
+    if rt._probes.get(key):
+        return
+    if not tools.node:
+        raise RuntimeError("Native backend needs node on PATH for PDF output")
+    puppeteer = subprocess.run(
+        [tools.node, "-e", "import('puppeteer').catch(() => process.exit(1))"],
+        cwd=tools.app_dir,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    if puppeteer.returncode != 0:
+        raise RuntimeError(
+            f"Native backend cannot import puppeteer from {tools.app_dir} "
+            "(run npm install there or set MD2_APP)"
+        )
+    fitz = subprocess.run(
+        [tools.python, "-c", "import fitz"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    if fitz.returncode != 0:
+        raise RuntimeError("Native backend needs PyMuPDF for python3 for PDF output")
+    rt._probes[key] = True
+
+
+def to_host(value: str, mounts: Sequence[rt.Mount]) -> str:
+    """Translate a container path (also in ``--opt=/path`` form) to the host."""
+    prefix = ""
+    if value.startswith("-") and "=" in value:
+        prefix, value = value.split("=", 1)
+        prefix += "="
+    for host, container, _ in sorted(mounts, key=lambda m: len(m[1]), reverse=True):
+        if value == container or value.startswith(container + "/"):
+            return prefix + str(host) + value[len(container) :]
+    return prefix + value
+
+
+def command(
+    mounts: Sequence[rt.Mount],
+    env: Dict[str, str],
+    inner: List[str],
+    tools: Optional[Tools] = None,
+) -> Tuple[List[str], Dict[str, str], Optional[str]]:
+    """Host ``(argv, environment, cwd)`` for a job planned for the container."""
+    tools = tools or discover()
+    full_env = dict(os.environ)
+    # A pandoc server is only kept for the lifetime of a container
+    full_env.pop("MD2_PANDOC_SERVER", None)
+    full_env.update({k: to_host(v, mounts) for k, v in env.items()})
+    full_env.update(
+        MD2_SCRIPTS=str(rt.PROJECT_ROOT / "scripts"),
+        MD2_FILTERS=str(rt.PROJECT_ROOT / "filters"),
+        MD2_STYLES=str(rt.PROJECT_ROOT / "styles"),
+        MD2_APP=str(tools.app_dir),
+        MD2_MATHJAX_JS=tools.mathjax_js,
+    )
+    if tools.mathjax_tex_js:
+        full_env["MD2_MATHJAX_TEX_JS"] = tools.mathjax_tex_js
+    if tools.mathjax_dir:
+        full_env["MD2_MATHJAX_DIR"] = tools.mathjax_dir
+    if tools.mermaid_bin:
+        full_env["PATH"] = f"{tools.mermaid_bin}{os.pathsep}{full_env.get('PATH', '')}"
+    argv = [to_host(arg, mounts) for arg in inner]
+    # Scripts resolve relative paths (e.g. the CSS name) against /work
+    cwd = next((str(h) for h, c, _ in mounts if c == "/work"), None)
+    return argv, full_env, cwd
+
+
+def run_job(
+    mounts: Sequence[rt.Mount],
+    env: Dict[str, str],
+    inner: List[str],
+    chromium: bool = False,
+    capture: bool = False,
+) -> Optional[str]:
+    """Run a planned job on the host; raises CalledProcessError like the container."""
+    tools = discover()
+    if chromium:
+        check_pdf_tools(tools)
+    argv, full_env, cwd = command(mounts, env, inner, tools)
+    if capture:
+        r = subprocess.run(
+            argv,
+            check=True,
+            env=full_env,
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        return r.stdout
+    subprocess.run(argv, check=True, env=full_env, cwd=cwd)
+    return None
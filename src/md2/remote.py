@@ -0,0 +1,423 @@
+"""
+Checks and cached copies of remote images on the host.
+
+Documents referencing http(s) images have them checked before conversion, so
+inaccessible images are reported up front. URLs are checked concurrently
+(``MD2_REMOTE_WORKERS``, default 8 threads) with keep-alive connections
+reused per host, and at most two connections to the same host. Once a host
+cannot be reached, its remaining URLs are reported without further requests,
+so a host that is down costs one timeout, not one per image.
+
+Results are kept in ``cache_dir("remote")/checks.json``: accessible images
+for ``MD2_REMOTE_CACHE_TTL`` seconds (default one day), failures for five
+minutes, so unchanged URLs are not checked again on every build.
+
+Outputs that embed their images (self-contained HTML, PDF, DOCX) use
+``RemoteCache`` instead: each image is downloaded once into
+``cache_dir("remote")/files`` (content-addressed, revalidated with ETag /
+Last-Modified after the TTL) and conversions read the local copy, so the
+container needs no network access. With ``offline`` only cached copies are
+used and nothing is fetched.
+"""
+import hashlib
+import http.client
+import mimetypes
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+from urllib.parse import urljoin, urlsplit
+
+from . import runtime as rt
+
+DEFAULT_TTL = 24 * 3600
+FAILURE_TTL = 300
+DEFAULT_WORKERS = 8
+PER_HOST = 2
+TIMEOUT = 10.0
+MAX_REDIRECTS = 5
+USER_AGENT = "md2-image-validator/1.0"
+
+HostKey = Tuple[str, str, int]
+T = TypeVar("T")
+
+
+def _env_number(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+@dataclass
+class ImageCheck:
+    """Result of checking one URL; ``checked`` is a ``time.time()`` stamp."""
+
+    url: str
+    ok: bool
+    message: str
+    checked: float = 0.0
+
+
+class HostUnreachable(OSError):
+    """The connection to a host failed (DNS, refused, timeout, TLS)."""
+
+
+def _host_key(url: str) -> HostKey:
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    return scheme, (parts.hostname or "").lower(), parts.port or (443 if scheme == "https" else 80)
+
+
+class ConnectionPool:
+    """Idle keep-alive connections per host, shared by worker threads."""
+
+    def __init__(self, timeout: float = TIMEOUT):
+        self.timeout = timeout
+        self._idle: Dict[HostKey, List[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+
+    def _connection(self, key: HostKey) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        scheme, host, port = key
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return cls(host, port, timeout=self.timeout), False
+
+    def _release(self, key: HostKey, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            self._idle.setdefault(key, []).append(conn)
+
+    def request(
+        self, method: str, url: str, headers: Optional[Dict[str, str]] = None
+    ) -> Tuple[int, http.client.HTTPMessage, bytes]:
+        """Send one request; returns status, headers and body."""
+        key = _host_key(url)
+        parts = urlsplit(url)
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        headers = {"User-Agent": USER_AGENT, **(headers or {})}
+        while True:
+            conn, reused = self._connection(key)
+            try:
+                conn.request(method, target, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read()
+            except (OSError, http.client.HTTPException) as exc:
+                conn.close()
+                if reused:
+                    continue  # the server closed an idle connection: retry on a new one
+                if isinstance(exc, OSError):
+                    raise HostUnreachable(str(exc) or type(exc).__name__) from exc
+                raise
+            if resp.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+            return resp.status, resp.headers, body
+
+    def close(self) -> None:
+        with self._lock:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.close()
+            self._idle.clear()
+
+
+def _run_per_host(
+    urls: List[str],
+    workers: int,
+    work: Callable[[str], T],
+    failure: Callable[[str, str], T],
+) -> List[T]:
+    """
+    ``work(url)`` for every URL on a pool of ``workers`` threads, with at
+    most PER_HOST at a time per host. Once a host is unreachable, its
+    remaining URLs get ``failure(url, message)`` without further requests.
+    """
+    by_host: Dict[HostKey, List[str]] = {}
+    for url in urls:
+        by_host.setdefault(_host_key(url), []).append(url)
+
+    def run(host_urls: List[str], down: threading.Event, reason: List[str]) -> List[T]:
+        results = []
+        for url in host_urls:
+            if down.is_set():
+                results.append(failure(url, f"URL error: {reason[0]}"))
+                continue
+            try:
+                results.append(work(url))
+            except HostUnreachable as exc:
+                reason.append(str(exc))
+                down.set()
+                results.append(failure(url, f"URL error: {exc}"))
+            except Exception as exc:
+                results.append(failure(url, f"Request failed: {exc}"))
+        return results
+
+    # The tasks of one host share its state
+    tasks = []
+    for host_urls in by_host.values():
+        down, reason = threading.Event(), []
+        for i in range(min(PER_HOST, len(host_urls))):
+            tasks.append((host_urls[i::PER_HOST], down, reason))
+    if not tasks:
+        return []
+    with ThreadPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+        return [r for batch in pool.map(lambda t: run(*t), tasks) for r in batch]
+
+
+def _cache_file() -> Path:
+    return rt.cache_dir("remote") / "checks.json"
+
+
+class RemoteImageValidator:
+    """Concurrent, cached accessibility checks of remote image URLs."""
+
+    def __init__(
+        self,
+        cache_file: Optional[Path] = None,
+        ttl: Optional[int] = None,
+        workers: Optional[int] = None,
+        timeout: float = TIMEOUT,
+    ):
+        self.cache_file = cache_file or _cache_file()
+        self.ttl = _env_number("MD2_REMOTE_CACHE_TTL", DEFAULT_TTL) if ttl is None else ttl
+        self.workers = workers or _env_number("MD2_REMOTE_WORKERS", DEFAULT_WORKERS) or 1
+        self.pool = ConnectionPool(timeout)
+
+    def _load(self) -> Dict[str, ImageCheck]:
+        try:
+            return {url: ImageCheck(**entry) for url, entry in rt.load_json(self.cache_file).items()}
+        except (TypeError, AttributeError):
+            return {}
+
+    def _save(self, results: Iterable[ImageCheck]) -> None:
+        # Merge with checks other conversions saved in the meantime
+        entries = self._load()
+        entries.update((r.url, r) for r in results)
+        now = time.time()
+        keep = {u: asdict(c) for u, c in entries.items() if now - c.checked < max(self.ttl, FAILURE_TTL)}
+        rt.save_json(self.cache_file, keep)
+
+    def _fresh(self, check: ImageCheck, now: float) -> bool:
+        ttl = self.ttl if check.ok else min(self.ttl, FAILURE_TTL)
+        return now - check.checked < ttl
+
+    def _check(self, url: str) -> ImageCheck:
+        target = url
+        for _ in range(MAX_REDIRECTS + 1):
+            status, headers, _ = self.pool.request("HEAD", target)
+            if status in (405, 501):
+                # HEAD not supported: ask for the first byte only
+                status, headers, _ = self.pool.request("GET", target, {"Range": "bytes=0-0"})
+            if status in (301, 302, 303, 307, 308) and headers.get("Location"):
+                target = urljoin(target, headers["Location"])
+                continue
+            if not 200 <= status < 300:
+                return ImageCheck(url, False, f"HTTP {status}")
+            content_type = headers.get("Content-Type", "").lower()
+            if not content_type.startswith("image/"):
+                return ImageCheck(url, False, f"Not an image (content-type: {content_type})")
+            return ImageCheck(url, True, "OK")
+        return ImageCheck(url, False, "Too many redirects")
+
+    def check(self, urls: Iterable[str]) -> Dict[str, ImageCheck]:
+        """Check ``urls``, using cached results that have not expired."""
+        urls = list(dict.fromkeys(urls))
+        now = time.time()
+        cached = self._load()
+        results = {u: cached[u] for u in urls if u in cached and self._fresh(cached[u], now)}
+
+        stale = [u for u in urls if u not in results]
+        if not stale:
+            return results
+        checked = _run_per_host(
+            stale, self.workers, self._check, lambda url, msg: ImageCheck(url, False, msg)
+        )
+
+        stamp = time.time()
+        for r in checked:
+            r.checked = stamp
+            results[r.url] = r
+        self._save(checked)
+        return results
+
+    def close(self) -> None:
+        """Close the idle connections kept for later checks."""
+        self.pool.close()
+
+
+def _warn(failed: List, name: str) -> None:
+    if failed:
+        print(f"WARNING: Found {len(failed)} inaccessible remote image(s) in {name}:", file=sys.stderr)
+        for item in failed:
+            print(f"  - {item.url}: {item.message}", file=sys.stderr)
+        print("  These images may not render correctly in the output.", file=sys.stderr)
+
+
+def warn_unreachable_images(
+    urls: Iterable[str], name: str, validator: Optional[RemoteImageValidator] = None
+) -> List[ImageCheck]:
+    """Check ``urls`` of document ``name`` and warn about inaccessible images."""
+    own = validator is None
+    validator = validator or RemoteImageValidator()
+    try:
+        failed = [c for c in validator.check(urls).values() if not c.ok]
+    finally:
+        if own:
+            validator.close()
+    _warn(failed, name)
+    return failed
+
+
+@dataclass
+class CachedFile:
+    """A remote image and its cached copy (``path`` is None if unavailable)."""
+
+    url: str
+    path: Optional[Path]
+    message: str = "OK"
+
+    @property
+    def ok(self) -> bool:
+        return self.path is not None
+
+
+class RemoteCache:
+    """
+    Fetch-once copies of remote images, shared by all documents and runs.
+
+    Files are stored under ``files/`` by content hash; ``index.json`` maps
+    each URL to its file with the ETag and Last-Modified it was served with.
+    Copies younger than the TTL are used as they are, older ones are
+    revalidated with a conditional GET (a 304 costs no download). If the
+    server cannot be reached, a cached copy is used anyway. ``offline``
+    serves cached copies only and never connects.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[Path] = None,
+        ttl: Optional[int] = None,
+        workers: Optional[int] = None,
+        timeout: float = TIMEOUT,
+        offline: bool = False,
+    ):
+        self.path = directory or rt.cache_dir("remote")
+        self.files = self.path / "files"
+        self.files.mkdir(parents=True, exist_ok=True)
+        self.index_file = self.path / "index.json"
+        self.ttl = _env_number("MD2_REMOTE_CACHE_TTL", DEFAULT_TTL) if ttl is None else ttl
+        self.workers = workers or _env_number("MD2_REMOTE_WORKERS", DEFAULT_WORKERS) or 1
+        self.offline = offline
+        self.pool = ConnectionPool(timeout)
+        self._index: Dict[str, Dict] = {}
+
+    def _cached(self, url: str) -> Optional[Path]:
+        entry = self._index.get(url)
+        if not entry:
+            return None
+        path = self.files / entry.get("file", "")
+        return path if path.is_file() else None
+
+    def _store(self, body: bytes, url: str, content_type: str) -> str:
+        digest = hashlib.sha256(body).hexdigest()
+        ext = Path(urlsplit(url).path).suffix.lower()
+        if not ext or mimetypes.guess_type(f"x{ext}")[0] != content_type:
+            ext = mimetypes.guess_extension(content_type) or ext
+        name = f"{digest[:2]}/{digest}{ext}"
+        target = self.files / name
+        if not target.exists():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_name(f"{target.name}.{uuid.uuid4().hex}.tmp")
+            tmp.write_bytes(body)
+            os.replace(tmp, target)
+        return name
+
+    def _fetch(self, url: str) -> CachedFile:
+        entry = self._index.get(url) or {}
+        cached = self._cached(url)
+        headers = {}
+        if cached is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        target = url
+        try:
+            for _ in range(MAX_REDIRECTS + 1):
+                status, resp_headers, body = self.pool.request("GET", target, headers)
+                if status in (301, 302, 303, 307, 308) and resp_headers.get("Location"):
+                    target = urljoin(target, resp_headers["Location"])
+                    continue
+                break
+            else:
+                return CachedFile(url, cached, "Too many redirects")
+        except OSError:
+            if cached is not None:
+                return CachedFile(url, cached, "Stale copy (host unreachable)")
+            raise
+
+        if status == 304 and cached is not None:
+            entry["fetched"] = time.time()
+            self._index[url] = entry
+            return CachedFile(url, cached)
+        if not 200 <= status < 300:
+            return CachedFile(url, None, f"HTTP {status}")
+        content_type = resp_headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if not content_type.startswith("image/"):
+            return CachedFile(url, None, f"Not an image (content-type: {content_type})")
+        self._index[url] = {
+            "file": self._store(body, url, content_type),
+            "etag": resp_headers.get("ETag"),
+            "last_modified": resp_headers.get("Last-Modified"),
+            "fetched": time.time(),
+        }
+        return CachedFile(url, self._cached(url))
+
+    def fetch(self, urls: Iterable[str]) -> Dict[str, CachedFile]:
+        """Cached copies of ``urls``, downloading what is missing or expired."""
+        urls = list(dict.fromkeys(urls))
+        self._index = rt.load_json(self.index_file)
+        now = time.time()
+        results: Dict[str, CachedFile] = {}
+        stale = []
+        for url in urls:
+            cached = self._cached(url)
+            if self.offline:
+                results[url] = CachedFile(url, cached, "OK" if cached else "Not cached (offline mode)")
+            elif cached is not None and now - self._index[url].get("fetched", 0) < self.ttl:
+                results[url] = CachedFile(url, cached)
+            else:
+                stale.append(url)
+        if not stale:
+            return results
+
+        def failure(url: str, message: str) -> CachedFile:
+            return CachedFile(url, self._cached(url), message)
+
+        fetched = _run_per_host(stale, self.workers, self._fetch, failure)
+        results.update((r.url, r) for r in fetched)
+        # Merge with entries other conversions saved in the meantime
+        index = rt.load_json(self.index_file)
+        index.update((url, self._index[url]) for url in stale if url in self._index)
+        rt.save_json(self.index_file, index)
+        return results
+
+    def close(self) -> None:
+        """Close the idle connections kept for later fetches."""
+        self.pool.close()
+
+
+def cache_remote_images(urls: Iterable[str], name: str, remote_cache: RemoteCache) -> Dict[str, Path]:
+    """Cached copies of the remote images of document ``name``, by URL; warns about the others."""
+    results = remote_cache.fetch(urls)
+    _warn([r for r in results.values() if not r.ok], name)
+    return {url: r.path for url, r in results.items() if r.path is not None}
@@ -1,20 +1,107 @@
 import subprocess
 import shutil
 import os
+import hashlib
+import json
+import time
+import uuid
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
-IMAGE_NAME = "md2:latest"
+IMAGE_REPO = "md2"
+IMAGE_NAME = f"{IMAGE_REPO}:latest"
 PROJECT_ROOT = Path(__file__).parent
 
+# (host path, container path, read-only)
+Mount = Tuple[Union[str, Path], str, bool]
+
+# How long an on-disk "image exists" probe result is trusted (seconds)
+PROBE_TTL = 24 * 3600
+# Exit status of ``docker/podman run`` when the runtime itself failed (no such
+# image, bad mount, ...) rather than the command in the container
+RUNTIME_ERROR = 125
+
+# Memory budgeted per concurrent conversion in auto mode: the 1g /dev/shm
+# granted by get_security_args plus headroom for pandoc/Chromium processes.
+JOB_MEMORY_BYTES = 1536 * 1024 * 1024
+
+# In-process probe results; see clear_probe_cache()
+_probes: Dict[Tuple, object] = {}
+
+
+def clear_probe_cache() -> None:
+    _probes.clear()
+
+
+def _cached_which(name: str) -> Optional[str]:
+    key = ("which", name, os.environ.get("PATH"))
+    if key not in _probes:
+        _probes[key] = shutil.which(name)
+    return _probes[key]  # type: ignore[return-value]
+
+
+def cache_dir(*parts: str) -> Path:
+    """Per-user md2 cache directory (``$XDG_CACHE_HOME/md2``), created on demand."""
+    base = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    path = Path(base, "md2", *parts)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def load_json(path: Path) -> Dict:
+    """The JSON object stored in ``path``, or {} if it is missing or unreadable."""
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def save_json(path: Path, data: Dict) -> None:
+    """Atomically replace ``path`` with ``data``; errors are ignored (caches only)."""
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp, path)
+    except OSError:
+        tmp.unlink(missing_ok=True)
+
+
+def available_memory() -> Optional[int]:
+    """Available physical memory in bytes, or None if it cannot be determined."""
+    try:
+        with open("/proc/meminfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def auto_jobs() -> int:
+    """Concurrency for ``jobs="auto"``: usable CPUs, capped by available memory."""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    memory = available_memory()
+    if memory is not None:
+        cpus = min(cpus, memory // JOB_MEMORY_BYTES)
+    return max(1, cpus)
+
 
 def get_container_runtime() -> str:
     env_choice = os.environ.get("RUNTIME")
-    if env_choice in ("podman", "docker") and shutil.which(env_choice):
+    if env_choice in ("podman", "docker") and _cached_which(env_choice):
         return env_choice
-    if shutil.which("podman"):
+    if _cached_which("podman"):
         return "podman"
-    if shutil.which("docker"):
+    if _cached_which("docker"):
         return "docker"
     raise RuntimeError("Neither docker nor podman found")
 
@@ -22,7 +109,7 @@ def get_container_runtime() -> str:
 def get_user_args(runtime: str) -> List[str]:
     if runtime == "podman":
         args = ["--userns=keep-id"]
-        if shutil.which("slirp4netns"):
+        if _cached_which("slirp4netns"):
             args += ["--network=slirp4netns"]
         else:
             args += ["--network=host"]
@@ -44,6 +131,156 @@ def get_security_args(runtime: str) -> List[str]:
     ]
 
 
+def format_mounts(mounts: Sequence[Mount]) -> List[str]:
+    args: List[str] = []
+    for host, container, read_only in mounts:
+        spec = f"{host}:{container}"
+        if read_only:
+            spec += ":ro"
+        args += ["-v", spec]
+    return args
+
+
+def format_env(env: Dict[str, str]) -> List[str]:
+    args: List[str] = []
+    for key, value in env.items():
+        args += ["-e", f"{key}={value}"]
+    return args
+
+
+def container_command(
+    runtime: str,
+    mounts: Sequence[Mount],
+    env: Dict[str, str],
+    inner: List[str],
+    security: bool = True,
+    name: Optional[str] = None,
+) -> List[str]:
+    """Build a one-shot ``run --rm`` command executing ``inner`` in the image.
+
+    ``name`` names the container so it can be removed from outside, e.g.
+    when the caller is cancelled.
+    """
+    cmd = [runtime, "run", "--rm"]
+    if name:
+        cmd += ["--name", name]
+    cmd += get_user_args(runtime)
+    if security:
+        cmd += get_security_args(runtime)
+    cmd += format_mounts(mounts)
+    cmd += format_env(env)
+    cmd.append(image_name())
+    return cmd + inner
+
+
+def _build_inputs(context: Path) -> List[Path]:
+    """The Dockerfile plus every file it COPYs from the build context.
+
+    Scripts, filters and styles are bind-mounted at run time, so only files
+    baked into the image participate in the image tag.
+    """
+    dockerfile = context / "Dockerfile"
+    files = [dockerfile]
+    for line in dockerfile.read_text(encoding="utf-8").splitlines():
+        tokens = line.split()
+        if not tokens or tokens[0].upper() not in ("COPY", "ADD"):
+            continue
+        sources = [t for t in tokens[1:-1] if not t.startswith("--")]
+        if any(t.startswith("--from") for t in tokens):
+            continue
+        for src in sources:
+            path = context / src
+            if path.is_dir():
+                files += sorted(p for p in path.rglob("*") if p.is_file())
+            elif path.exists():
+                files.append(path)
+    return files
+
+
+def build_hash(root: Path | None = None) -> str:
+    context = (PROJECT_ROOT if root is None else root).resolve()
+    key = ("build_hash", str(context))
+    if key not in _probes:
+        h = hashlib.sha256()
+        for path in _build_inputs(context):
+            h.update(path.relative_to(context).as_posix().encode())
+            h.update(b"\0")
+            h.update(path.read_bytes())
+            h.update(b"\0")
+        _probes[key] = h.hexdigest()
+    return _probes[key]  # type: ignore[return-value]
+
+
+def image_name(root: Path | None = None) -> str:
+    """Image tag derived from the build inputs, e.g. ``md2:3f2a9c0d1e4b``.
+
+    Editing the Dockerfile or a copied file yields a new tag, so a stale
+    image is detected without inspecting it.
+    """
+    return f"{IMAGE_REPO}:{build_hash(root)[:12]}"
+
+
+def _probe_file() -> Path:
+    return cache_dir() / "probes.json"
+
+
+def _load_probes() -> Dict[str, float]:
+    try:
+        images = load_json(_probe_file()).get("images", {})
+        return {k: float(v) for k, v in images.items()}
+    except (TypeError, ValueError, AttributeError):
+        return {}
+
+
+def _store_probes(images: Dict[str, float]) -> None:
+    save_json(_probe_file(), {"images": images})
+
+
+def _image_known(runtime: str, image: str) -> bool:
+    key = ("image", runtime, image)
+    if _probes.get(key):
+        return True
+    checked = _load_probes().get(f"{runtime} {image}")
+    if checked is not None and time.time() - checked < PROBE_TTL:
+        _probes[key] = True
+        return True
+    return False
+
+
+def _remember_image(runtime: str, image: str) -> None:
+    _probes[("image", runtime, image)] = True
+    images = _load_probes()
+    images[f"{runtime} {image}"] = time.time()
+    _store_probes(images)
+
+
+def _forget_images(runtime: str, image: Optional[str] = None) -> None:
+    """Drop the probes of ``image`` (default: every image) for ``runtime``."""
+    for key in [k for k in _probes if k[0] == "image" and k[1] == runtime]:
+        if image is None or key[2] == image:
+            del _probes[key]
+    images = _load_probes()
+    if image is None:
+        images = {k: v for k, v in images.items() if not k.startswith(f"{runtime} ")}
+    else:
+        images.pop(f"{runtime} {image}", None)
+    _store_probes(images)
+
+
+def check_image_after_failure(runtime: str, returncode: int, root: Path | None = None) -> None:
+    """Forget a cached "image exists" probe if a failed run means the image is gone.
+
+    Only runs that failed in the runtime itself (RUNTIME_ERROR) are checked,
+    with one ``image inspect``; the next ensure_image then builds the image
+    instead of trusting the probe until PROBE_TTL runs out.
+    """
+    if returncode != RUNTIME_ERROR:
+        return
+    image = image_name(root)
+    if not image_exists(runtime, image):
+        _forget_images(runtime, image)
+
+
 def image_exists(runtime: str, image: str = IMAGE_NAME) -> bool:
     r = subprocess.run(
         [runtime, "image", "inspect", image],
@@ -54,24 +291,46 @@ def image_exists(runtime: str, image: str = IMAGE_NAME) -> bool:
 
 
 def ensure_image(runtime: str, root: Path | None = None) -> None:
-    if image_exists(runtime):
+    """Make sure the image for the current build inputs exists.
+
+    Once an image is known to exist (in-process, or on disk within
+    PROBE_TTL) this returns without spawning a subprocess.
+    """
+    image = image_name(root)
+    if _image_known(runtime, image):
         return
-    context = PROJECT_ROOT if root is None else root
-    subprocess.run(
-        [runtime, "build", "-t", IMAGE_NAME, "-f", "Dockerfile", str(context)],
-        check=True,
-        cwd=str(context),
-    )
+    if not image_exists(runtime, image):
+        context = PROJECT_ROOT if root is None else root
+        subprocess.run(
+            [
+                runtime,
+                "build",
+                "-t",
+                image,
+                "-t",
+                IMAGE_NAME,
+                "-f",
+                "Dockerfile",
+                str(context),
+            ],
+            check=True,
+            cwd=str(context),
+        )
+    _remember_image(runtime, image)
 
 
 def rebuild_image(runtime: str, root: Path | None = None) -> None:
     context = PROJECT_ROOT if root is None else root
+    image = image_name(root)
+    _forget_images(runtime)
     subprocess.run(
         [
             runtime,
             "build",
             "--no-cache",
             "-t",
+            image,
+            "-t",
             IMAGE_NAME,
             "-f",
             "Dockerfile",
@@ -80,3 +339,4 @@ def rebuild_image(runtime: str, root: Path | None = None) -> None:
         check=True,
         cwd=str(context),
     )
+    _remember_image(runtime, image)
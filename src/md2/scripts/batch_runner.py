@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Container-side batch driver.
+
+Runs every job of a host-written job list inside one container invocation
+and writes per-job results back, so a batch of documents pays for a single
+container start instead of one per file.
+
+Job list (JSON): [{"argv": ["bash", "/scripts/md2html.sh", ...], "cwd": "/work/sub"}, ...]
+Results (JSON):  [{"ok": true, "returncode": 0, "error": ""}, ...] in job order.
+
+Usage: batch_runner.py <jobs.json> <results.json> [--jobs=N]
+"""
+import json
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+# Lines of stderr kept as the error message of a failed job
+ERROR_TAIL_LINES = 5
+
+
+def run_job(job: Dict) -> Dict:
+    """Run one job; its output is kept in the result and replayed by run_batch."""
+    try:
+        proc = subprocess.run(
+            job["argv"],
+            cwd=job.get("cwd") or None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+    except OSError as exc:
+        return {"ok": False, "returncode": None, "error": str(exc)}
+
+    result = {"ok": proc.returncode == 0, "returncode": proc.returncode, "error": ""}
+    result["stdout"], result["stderr"] = proc.stdout, proc.stderr
+    if proc.returncode != 0:
+        tail = [l for l in proc.stderr.splitlines() if l.strip()][-ERROR_TAIL_LINES:]
+        result["error"] = " | ".join(tail) or f"exit status {proc.returncode}"
+    return result
+
+
+def run_batch(jobs: List[Dict], concurrency: int = 1) -> List[Dict]:
+    """Run all jobs, ``concurrency`` at a time; output is replayed in job order."""
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = [pool.submit(run_job, job) for job in jobs]
+        results = []
+        for future in futures:
+            result = future.result()
+            sys.stdout.write(result.pop("stdout", "") or "")
+            sys.stderr.write(result.pop("stderr", "") or "")
+            sys.stdout.flush()
+            results.append(result)
+    return results
+
+
+def main(argv: List[str]) -> int:
+    concurrency = 1
+    args = []
+    for arg in argv:
+        if arg.startswith("--jobs="):
+            concurrency = int(arg.split("=", 1)[1])
+        else:
+            args.append(arg)
+    if len(args) != 2:
+        print(
+            "Usage: batch_runner.py <jobs.json> <results.json> [--jobs=N]",
+            file=sys.stderr,
+        )
+        return 2
+
+    jobs = json.loads(Path(args[0]).read_text(encoding="utf-8"))
+    results = run_batch(jobs, concurrency)
+    Path(args[1]).write_text(json.dumps(results), encoding="utf-8")
+
+    failed = sum(1 for r in results if not r["ok"])
+    print(f"batch: {len(results) - failed} succeeded, {failed} failed")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
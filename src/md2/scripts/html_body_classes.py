@@ -1,36 +1,13 @@
 #!/usr/bin/env python3
-import re
+"""Add classes to the <body> of an HTML file (see html_postprocess.py)."""
 import sys
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent))
 
-BODY_RE = re.compile(r"<body(?P<attrs>[^>]*)>", re.IGNORECASE)
-CLASS_RE = re.compile(r"\bclass\s*=\s*([\"'])(?P<value>.*?)\1", re.IGNORECASE | re.DOTALL)
+from html_postprocess import BodyClassError, add_body_classes  # noqa: E402
 
-
-class BodyClassError(ValueError):
-    pass
-
-
-def add_body_classes(html: str, classes: list[str]) -> str:
-    match = BODY_RE.search(html)
-    if not match:
-        raise BodyClassError("No <body> tag found")
-
-    attrs = match.group("attrs")
-    class_match = CLASS_RE.search(attrs)
-    if class_match:
-        existing = class_match.group("value").split()
-        merged = existing[:]
-        for class_name in classes:
-            if class_name not in merged:
-                merged.append(class_name)
-        new_class_attr = f'class="{" ".join(merged)}"'
-        new_attrs = attrs[: class_match.start()] + new_class_attr + attrs[class_match.end() :]
-    else:
-        new_attrs = attrs + f' class="{" ".join(classes)}"'
-
-    return html[: match.start()] + f"<body{new_attrs}>" + html[match.end() :]
+__all__ = ["BodyClassError", "add_body_classes", "main"]
 
 
 def main(argv: list[str]) -> int:
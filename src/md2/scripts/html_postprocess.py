@@ -1,68 +1,544 @@
 #!/usr/bin/env python3
+"""
+Post-process the HTML written by pandoc in one pass.
+
+The file is read once, every transform is applied to the text in memory
+and the result is written once:
+
+  body classes       add classes to <body> (letter, no-toc, ...)
+  inline CSS         replace the stylesheet <link> with a <style> block
+  src rewrites       e.g. point MathJax at a copy next to the HTML
+  TOC                flatten the H1 level of nav#TOC, move the TOC after the
+                     first H1 (before the first H2) and add "back to TOC"
+                     links to the h2-h6 headings
+  TOC placeholders   data-toc-placeholder="P#0001" attributes on the TOC
+                     links, filled in with page numbers after printing
+                     (pdf_processor.py)
+  lazy Mermaid       keep the Mermaid sources of pandoc's code blocks and
+                     load the Mermaid runtime in the browser, rendering each
+                     diagram when it is scrolled into view
+  shared assets      move local stylesheets, scripts (MathJax), images and
+                     inline Mermaid SVGs into a directory shared by many
+                     pages, named by content hash, and link them relatively
+
+Every transform is a single regex scan or a splice at positions found once,
+so the time is linear in the size of the document.
+
+Usage:
+  html_postprocess.py <html_file> [<html_file> ...] [--body-class=NAME ...]
+      [--inline-css=PATH [--css-name=NAME]] [--replace-src OLD NEW ...]
+      [--toc] [--toc-placeholders] [--mermaid-runtime=URL]
+      [--assets-dir=DIR [--assets-url=URL] [--asset-path=DIR ...]]
+  html_postprocess.py <html_file> <page_numbers_enabled>   (placeholders only)
+"""
+import argparse
+import hashlib
+import json
+import os
 import re
 import sys
+from dataclasses import dataclass, field, replace as dc_replace
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, unquote
 
 
-def add_toc_page_number_placeholders(
-    html_path: Path, page_numbers_enabled: bool
-) -> None:
-    """Add TOC page number placeholders when page numbers are enabled"""
-    if not page_numbers_enabled:
-        return
+BODY_RE = re.compile(r"<body(?P<attrs>[^>]*)>", re.IGNORECASE)
+CLASS_RE = re.compile(r"\bclass\s*=\s*([\"'])(?P<value>.*?)\1", re.IGNORECASE | re.DOTALL)
+NAV_TOC_RE = re.compile(r"<nav\b[^>]*\bid\s*=\s*([\"'])TOC\1[^>]*>", re.IGNORECASE)
+STYLESHEET_LINE_RE = re.compile(r'^[^\n]*<link rel="stylesheet"[^\n]*\n?', re.MULTILINE)
+HEADING_RE = re.compile(
+    r"<h(?P<tag>[2-6])(?P<attrs>[^>]*)>(?P<inner>.*?)</h(?P=tag)>", re.IGNORECASE | re.DOTALL
+)
+TOC_LINK_RE = re.compile(r'<a href="(#[^"]*)" id="(toc-[^"]*)"[^>]*>([^<]*)</a>')
+ASSET_REF_RE = re.compile(
+    r'(?P<pre><(?:link\b[^>]*?\bhref|script\b[^>]*?\bsrc|img\b[^>]*?\bsrc)\s*=\s*")'
+    r'(?P<url>[^"]+)"',
+    re.IGNORECASE,
+)
+SVG_OPEN_RE = re.compile(r"<svg\b[^>]*>", re.IGNORECASE)
+STYLE_ATTR_RE = re.compile(r'\bstyle\s*=\s*"([^"]*)"', re.IGNORECASE)
+# pandoc's rendering of a ```mermaid code block
+MERMAID_PRE_RE = re.compile(
+    r'<pre(?P<attrs>[^>]*\bclass="(?:[^"]*\s)?mermaid(?:\s[^"]*)?"[^>]*)>\s*'
+    r"<code[^>]*>(?P<source>.*?)</code>\s*</pre>",
+    re.IGNORECASE | re.DOTALL,
+)
+# URLs that are not local files
+REMOTE_URL_RE = re.compile(r"^(?:[a-z][a-z0-9+.-]*:|//|#)", re.IGNORECASE)
 
-    try:
-        with open(html_path, "r", encoding="utf-8") as f:
-            content = f.read()
+TOC_BACKLINK = (
+    '<a class="toc-back" href="#TOC" aria-label="Back to table of contents">⇧ TOC</a>'
+)
 
-        # Check if TOC exists
-        if 'id="TOC"' not in content:
-            return
+# Loads the Mermaid runtime once the first diagram comes near the viewport
+# and renders every diagram when it becomes visible.
+MERMAID_LOADER = """<script>
+(function () {
+  var nodes = Array.prototype.slice.call(document.querySelectorAll('pre.mermaid'));
+  var loading = null;
+  function load() {
+    if (!loading) {
+      loading = new Promise(function (resolve, reject) {
+        var script = document.createElement('script');
+        script.src = __RUNTIME__;
+        script.onload = function () {
+          window.mermaid.initialize({ startOnLoad: false });
+          resolve(window.mermaid);
+        };
+        script.onerror = reject;
+        document.head.appendChild(script);
+      });
+    }
+    return loading;
+  }
+  function render(node) {
+    load().then(function (mermaid) {
+      return mermaid.run({ nodes: [node] });
+    }).catch(function (err) {
+      console.error('mermaid:', err);
+    });
+  }
+  if (!('IntersectionObserver' in window)) {
+    nodes.forEach(render);
+    return;
+  }
+  var observer = new IntersectionObserver(function (entries) {
+    entries.forEach(function (entry) {
+      if (entry.isIntersecting) {
+        observer.unobserve(entry.target);
+        render(entry.target);
+      }
+    });
+  }, { rootMargin: '200px 0px' });
+  nodes.forEach(function (node) { observer.observe(node); });
+})();
+</script>
+"""
 
-        # Add body class for page numbers
-        content = re.sub(
-            r"<body([^>]*)>", r'<body\1 class="toc-page-numbers">', content
-        )
 
-        # Add placeholder attributes to TOC links
-        toc_counter = 1
+class BodyClassError(ValueError):
+    pass
+
+
+@dataclass
+class PostprocessOptions:
+    """The transforms to apply; the defaults leave the document unchanged."""
+
+    body_classes: List[str] = field(default_factory=list)
+    # Stylesheet text replacing the <link rel="stylesheet"> lines naming css_name
+    inline_css: Optional[str] = None
+    css_name: Optional[str] = None
+    # src="old" -> src="new"
+    replace_src: Dict[str, str] = field(default_factory=dict)
+    toc: bool = False
+    toc_placeholders: bool = False
+    # URL of the Mermaid runtime for lazy in-browser rendering (a local file
+    # is moved into the asset directory when one is given)
+    mermaid_runtime: Optional[str] = None
+    # Shared asset directory, its URL relative to the page, and where to look
+    # for referenced files besides the page's directory (base_dir)
+    assets_dir: Optional[Path] = None
+    assets_url: Optional[str] = None
+    asset_paths: List[Path] = field(default_factory=list)
+    base_dir: Optional[Path] = None
+
+
+def add_body_classes(html: str, classes: List[str]) -> str:
+    match = BODY_RE.search(html)
+    if not match:
+        raise BodyClassError("No <body> tag found")
+
+    attrs = match.group("attrs")
+    class_match = CLASS_RE.search(attrs)
+    if class_match:
+        existing = class_match.group("value").split()
+        merged = existing[:]
+        for class_name in classes:
+            if class_name not in merged:
+                merged.append(class_name)
+        new_class_attr = f'class="{" ".join(merged)}"'
+        new_attrs = attrs[: class_match.start()] + new_class_attr + attrs[class_match.end() :]
+    else:
+        new_attrs = attrs + f' class="{" ".join(classes)}"'
+
+    return html[: match.start()] + f"<body{new_attrs}>" + html[match.end() :]
+
 
-        def add_placeholder(match):
-            nonlocal toc_counter
-            href = match.group(1)
-            toc_id = match.group(2)
-            inner_text = match.group(3)
+def _line_start(html: str, pos: int) -> int:
+    return html.rfind("\n", 0, pos) + 1
 
-            placeholder = f"P#{toc_counter:04d}"
-            toc_counter += 1
 
-            return f'<a href="{href}" id="{toc_id}" data-toc-placeholder="{placeholder}">{inner_text}</a>'
+def _line_end(html: str, pos: int) -> int:
+    end = html.find("\n", pos)
+    return len(html) if end == -1 else end + 1
 
-        # Match TOC links and add placeholders
-        content = re.sub(
-            r'<a href="(#[^"]*)" id="(toc-[^"]*)"[^>]*>([^<]*)</a>',
-            add_placeholder,
-            content,
+
+def inline_stylesheet(html: str, css: str, css_name: Optional[str]) -> str:
+    """Drop the stylesheet links naming ``css_name``; put ``css`` before </head>."""
+    if css_name:
+        html = STYLESHEET_LINE_RE.sub(
+            lambda m: "" if css_name in m.group(0) else m.group(0), html
         )
+    head = html.lower().find("</head>")
+    if head == -1:
+        return html
+    if not css.endswith("\n"):
+        css += "\n"
+    block = f'  <style type="text/css">\n{css}  </style>\n'
+    at = _line_start(html, head)
+    return html[:at] + block + html[at:]
+
+
+def replace_src(html: str, replacements: Dict[str, str]) -> str:
+    for old, new in replacements.items():
+        html = html.replace(f'src="{old}"', f'src="{new}"')
+    return html
+
+
+def _find_tag_block(h: str, tag: str, start: int = 0) -> Optional[Tuple[int, int]]:
+    """Span of the first <tag>...</tag> element from ``start``, nesting aware."""
+    tag_any = re.compile(r"<(/?)%s(\s[^>]*)?>" % re.escape(tag), re.I)
+    m = tag_any.search(h, start)
+    while m and m.group(1) == "/":
+        m = tag_any.search(h, m.end())
+    if not m:
+        return None
+    pos = m.start()
+    i = m.end()
+    depth = 1
+    while depth > 0:
+        m2 = tag_any.search(h, i)
+        if not m2:
+            return None
+        depth += -1 if m2.group(1) == "/" else 1
+        i = m2.end()
+    return (pos, i)
+
+
+def _toc_span(html: str) -> Optional[Tuple[int, int, int]]:
+    """(nav start, content start, nav end) of nav#TOC."""
+    m = NAV_TOC_RE.search(html)
+    if not m:
+        return None
+    close = html.lower().find("</nav>", m.end())
+    if close == -1:
+        return None
+    return (m.start(), m.end(), close + len("</nav>"))
+
+
+def flatten_toc(html: str) -> str:
+    """Replace the TOC's top-level list by the children of its first entry.
+
+    Documents have one H1, so the TOC would otherwise nest everything under
+    it. Anchors are kept unchanged.
+    """
+    span = _toc_span(html)
+    if not span:
+        return html
+    _, content_start, nav_end = span
+    content_end = nav_end - len("</nav>")
+    content = html[content_start:content_end]
+
+    ul = _find_tag_block(content, "ul")
+    if not ul:
+        return html
+    ul_html = content[ul[0] : ul[1]]
+    li = _find_tag_block(ul_html, "li")
+    if not li:
+        return html
+    li_html = ul_html[li[0] : li[1]]
+    nested = _find_tag_block(li_html, "ul")
+    if not nested:
+        return html
+    new_content = content[: ul[0]] + li_html[nested[0] : nested[1]] + content[ul[1] :]
+    return html[:content_start] + new_content + html[content_end:]
+
+
+def move_toc(html: str) -> str:
+    """Place the TOC after the first </h1>, before the first <h2> after it.
+
+    Without a following <h2> it goes right after the </h1> line, without any
+    <h1> to the end of the body.
+    """
+    span = _toc_span(html)
+    if not span:
+        return html
+    start = _line_start(html, span[0])
+    end = _line_end(html, span[2])
+    toc = html[start:end]
+    if not toc.endswith("\n"):
+        toc += "\n"
+    rest = html[:start] + html[end:]
+
+    lower = rest.lower()
+    h1_close = lower.find("</h1>")
+    if h1_close == -1:
+        at = lower.rfind("</body>")
+        at = len(rest) if at == -1 else _line_start(rest, at)
+    else:
+        after_h1 = _line_end(rest, h1_close)
+        h2 = re.compile(r"<h2[^>]*>", re.I).search(rest, after_h1)
+        at = _line_start(rest, h2.start()) if h2 else after_h1
+    return rest[:at] + toc + rest[at:]
+
+
+def add_toc_backlinks(html: str) -> str:
+    """Append a link back to the TOC to every h2-h6 heading."""
+    if not NAV_TOC_RE.search(html):
+        return html
+
+    def repl(m: "re.Match[str]") -> str:
+        inner = m.group("inner")
+        # Skip if a toc-back link already exists within the header
+        if 'class="toc-back"' in inner or "class='toc-back'" in inner:
+            return m.group(0)
+        tag = m.group("tag")
+        return f"<h{tag}{m.group('attrs')}>{inner}{TOC_BACKLINK}</h{tag}>"
+
+    return HEADING_RE.sub(repl, html)
+
 
-        with open(html_path, "w", encoding="utf-8") as f:
-            f.write(content)
+def add_toc_placeholders(html: str) -> str:
+    """Number the TOC links (P#0001, ...) for pdf_processor.py."""
+    if 'id="TOC"' not in html:
+        return html
+    html = add_body_classes(html, ["toc-page-numbers"])
 
+    toc_counter = 1
+
+    def add_placeholder(match: "re.Match[str]") -> str:
+        nonlocal toc_counter
+        href, toc_id, inner_text = match.groups()
+        placeholder = f"P#{toc_counter:04d}"
+        toc_counter += 1
+        return f'<a href="{href}" id="{toc_id}" data-toc-placeholder="{placeholder}">{inner_text}</a>'
+
+    return TOC_LINK_RE.sub(add_placeholder, html)
+
+
+class AssetStore:
+    """Files in a directory shared by many pages, named by content hash.
+
+    ``name.<hash>.ext`` never changes once written, so pages can share it and
+    browsers and CDNs can cache it indefinitely. Files are written atomically
+    and only once; concurrent conversions may share the directory.
+    """
+
+    def __init__(self, directory: Path, url: str) -> None:
+        self.directory = Path(directory)
+        self.url = url.rstrip("/")
+        self._files: Dict[Tuple[str, int, int], str] = {}
+
+    def add_bytes(self, data: bytes, name: str) -> str:
+        """Store ``data`` under a hashed version of ``name``; returns its URL."""
+        stem, suffix = os.path.splitext(name)
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        filename = f"{stem}.{digest}{suffix}"
+        target = self.directory / filename
+        if not target.exists():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp = self.directory / f".{filename}.{os.getpid()}.tmp"
+            tmp.write_bytes(data)
+            os.replace(tmp, target)
+        return f"{self.url}/{quote(filename)}" if self.url else quote(filename)
+
+    def add_file(self, path: Path) -> str:
+        st = path.stat()
+        key = (str(path), st.st_mtime_ns, st.st_size)
+        if key not in self._files:
+            self._files[key] = self.add_bytes(path.read_bytes(), path.name)
+        return self._files[key]
+
+
+_stores: Dict[Tuple[str, str], AssetStore] = {}
+
+
+def _store(directory: Path, url: str) -> AssetStore:
+    # One store per directory and URL, so files are hashed once per process
+    key = (str(directory), url)
+    if key not in _stores:
+        _stores[key] = AssetStore(directory, url)
+    return _stores[key]
+
+
+def _resolve_local(url: str, search: List[Path]) -> Optional[Path]:
+    if REMOTE_URL_RE.match(url):
+        return None
+    path = unquote(url.split("#", 1)[0].split("?", 1)[0])
+    if not path:
+        return None
+    if os.path.isabs(path):
+        return Path(path) if os.path.isfile(path) else None
+    for directory in search:
+        candidate = directory / path
+        if candidate.is_file():
+            return candidate
+    return None
+
+
+def _extract_mermaid_svgs(html: str, store: AssetStore) -> str:
+    """Replace inline Mermaid SVGs by <img> elements pointing at asset files."""
+    parts: List[str] = []
+    pos = 0
+    for m in SVG_OPEN_RE.finditer(html):
+        if m.start() < pos or "mermaid-svg" not in m.group(0):
+            continue
+        block = _find_tag_block(html, "svg", m.start())
+        if not block:
+            continue
+        svg = html[block[0] : block[1]]
+        open_tag = m.group(0)
+        if "xmlns=" not in open_tag:
+            svg = '<svg xmlns="http://www.w3.org/2000/svg"' + svg[len("<svg") :]
+        style = STYLE_ATTR_RE.search(open_tag)
+        style_attr = f' style="{style.group(1)}"' if style else ""
+        url = store.add_bytes(svg.encode("utf-8"), "mermaid.svg")
+        parts.append(html[pos : block[0]])
+        parts.append(f'<img class="mermaid-svg" src="{url}"{style_attr} alt="Diagram" />')
+        pos = block[1]
+    if not parts:
+        return html
+    parts.append(html[pos:])
+    return "".join(parts)
+
+
+def share_assets(
+    html: str, store: AssetStore, base_dir: Optional[Path], asset_paths: List[Path]
+) -> str:
+    """Move the page's local assets into ``store`` and link them from there."""
+    search = ([base_dir] if base_dir else []) + list(asset_paths)
+
+    def repl(m: "re.Match[str]") -> str:
+        url = m.group("url")
+        path = _resolve_local(url, search)
+        if path is None:
+            return m.group(0)
+        return f'{m.group("pre")}{store.add_file(path)}"'
+
+    # References first: the <img> elements for Mermaid already point at the store
+    return _extract_mermaid_svgs(ASSET_REF_RE.sub(repl, html), store)
+
+
+def lazy_mermaid(html: str, runtime_url: str) -> str:
+    """Keep Mermaid sources for rendering in the browser, loading ``runtime_url`` lazily."""
+    # Mermaid reads the diagram from the element's markup, so drop <code>
+    html, count = MERMAID_PRE_RE.subn(
+        lambda m: f'<pre{m.group("attrs")}>{m.group("source")}</pre>', html
+    )
+    if not count:
+        return html
+    loader = MERMAID_LOADER.replace("__RUNTIME__", json.dumps(runtime_url))
+    end = html.lower().rfind("</body>")
+    if end == -1:
+        return html + loader
+    return html[:end] + loader + html[end:]
+
+
+def postprocess(html: str, options: PostprocessOptions) -> str:
+    """Apply the transforms selected in ``options`` to ``html``."""
+    store = None
+    if options.assets_dir is not None:
+        store = _store(options.assets_dir, options.assets_url or "")
+    if options.body_classes:
+        html = add_body_classes(html, options.body_classes)
+    if options.inline_css is not None:
+        html = inline_stylesheet(html, options.inline_css, options.css_name)
+    if options.replace_src:
+        html = replace_src(html, options.replace_src)
+    if options.toc:
+        html = add_toc_backlinks(move_toc(flatten_toc(html)))
+    if options.toc_placeholders:
+        html = add_toc_placeholders(html)
+    if options.mermaid_runtime:
+        url = options.mermaid_runtime
+        if store is not None and os.path.isfile(url):
+            url = store.add_file(Path(url))
+        html = lazy_mermaid(html, url)
+    if store is not None:
+        html = share_assets(html, store, options.base_dir, options.asset_paths)
+    return html
+
+
+def postprocess_file(path: Path, options: PostprocessOptions) -> bool:
+    """Rewrite ``path`` in place; returns whether anything changed."""
+    path = Path(path)
+    html = path.read_text(encoding="utf-8")
+    if options.assets_dir is not None:
+        if options.base_dir is None:
+            options = dc_replace(options, base_dir=path.parent)
+        if options.assets_url is None:
+            url = os.path.relpath(options.assets_dir, path.parent)
+            options = dc_replace(options, assets_url=Path(url).as_posix())
+    result = postprocess(html, options)
+    if result == html:
+        return False
+    path.write_text(result, encoding="utf-8")
+    return True
+
+
+def add_toc_page_number_placeholders(
+    html_path: Path, page_numbers_enabled: bool
+) -> None:
+    """Add TOC page number placeholders when page numbers are enabled"""
+    if not page_numbers_enabled:
+        return
+    try:
+        postprocess_file(html_path, PostprocessOptions(toc_placeholders=True))
     except Exception as e:
         # If processing fails, keep original file
         print(f"Warning: HTML postprocessing failed: {e}", file=sys.stderr)
 
 
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print(
-            "Usage: html_postprocess.py <html_file> <page_numbers_enabled>",
-            file=sys.stderr,
+def _parse_args(argv: List[str]) -> Tuple[List[Path], PostprocessOptions]:
+    parser = argparse.ArgumentParser(prog="html_postprocess.py")
+    parser.add_argument("html_files", nargs="+", type=Path)
+    parser.add_argument("--body-class", action="append", default=[])
+    parser.add_argument("--inline-css", type=Path)
+    parser.add_argument("--css-name")
+    parser.add_argument("--replace-src", nargs=2, action="append", default=[])
+    parser.add_argument("--toc", action="store_true")
+    parser.add_argument("--toc-placeholders", action="store_true")
+    parser.add_argument("--mermaid-runtime")
+    parser.add_argument("--assets-dir", type=Path)
+    parser.add_argument("--assets-url")
+    parser.add_argument("--asset-path", action="append", default=[], type=Path)
+    args = parser.parse_args(argv)
+    options = PostprocessOptions(
+        body_classes=args.body_class,
+        inline_css=(
+            args.inline_css.read_text(encoding="utf-8") if args.inline_css else None
+        ),
+        css_name=args.css_name,
+        replace_src=dict(args.replace_src),
+        toc=args.toc,
+        toc_placeholders=args.toc_placeholders,
+        mermaid_runtime=args.mermaid_runtime,
+        assets_dir=args.assets_dir,
+        assets_url=args.assets_url,
+        asset_paths=args.asset_path,
+    )
+    return args.html_files, options
+
+
+def main(argv: List[str]) -> int:
+    if len(argv) == 2 and argv[1].lower() in ("true", "false", "1", "0", "yes", "no"):
+        # html_postprocess.py <html_file> <page_numbers_enabled>
+        add_toc_page_number_placeholders(
+            Path(argv[0]), argv[1].lower() in ("true", "1", "yes")
         )
-        sys.exit(1)
+        return 0
 
-    html_file = Path(sys.argv[1])
-    page_numbers_enabled = sys.argv[2].lower() in ("true", "1", "yes")
+    files, options = _parse_args(argv)
+    status = 0
+    for path in files:
+        try:
+            postprocess_file(path, options)
+        except (BodyClassError, OSError) as exc:
+            print(f"html_postprocess: {path}: {exc}", file=sys.stderr)
+            status = 1
+    return status
 
-    add_toc_page_number_placeholders(html_file, page_numbers_enabled)
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Decide which MathJax bundle a Markdown document needs.
+
+Prints one of:
+  none  no math delimiters outside code, MathJax is not loaded at all
+  tex   math that the smaller tex-svg.js component set can typeset
+  full  math using macros that tex-svg.js would have to autoload
+        (color, cancel, mhchem, ...); autoloading cannot work with
+        embedded resources, so tex-svg-full.js is used
+
+The scan is conservative: anything that might be math counts as math, since
+a false "none" would leave formulas untypeset while a false "tex" only costs
+an unused script.
+
+Usage: math_scan.py <input.md>
+"""
+from __future__ import annotations
+
+import re
+import sys
+from typing import List
+
+FENCE_RE = re.compile(r"^[\t ]*(```+|~~~+)")
+# A code span cannot continue past a blank line (the end of its paragraph)
+CODE_SPAN_RE = re.compile(r"(`+)(?:[^\n]|\n(?!\s*\n))*?(?<!`)\1(?!`)")
+MATH_RE = re.compile(r"\$|\\\(|\\\[|\\begin\{")
+# Macros and environments provided by extensions that tex-svg.js autoloads
+FULL_RE = re.compile(
+    r"\\(?:mathtip|texttip|toggle|bbox|boldsymbol|bra|ket|braket|set|Bra|Ket|"
+    r"Braket|Set|ketbra|Ketbra|cancel|bcancel|xcancel|cancelto|color|"
+    r"definecolor|textcolor|colorbox|fcolorbox|enclose|href|class|style|cssId|"
+    r"ce|pu|unicode|verb|require|x[a-zA-Z]*(?:arrow|mapsto|longequal|tofrom))"
+    r"(?![A-Za-z])"
+    r"|\\begin\{(?:CD|prooftree)\}"
+)
+
+
+def strip_code(lines: List[str]) -> str:
+    """Text without fenced code blocks and inline code spans."""
+    kept: List[str] = []
+    fence = None
+    for line in lines:
+        m = FENCE_RE.match(line)
+        if m:
+            marker = m.group(1)
+            if fence is None:
+                fence = marker
+                continue
+            if marker[0] == fence[0] and len(marker) >= len(fence):
+                fence = None
+                continue
+        if fence is None:
+            kept.append(line)
+    return CODE_SPAN_RE.sub("", "\n".join(kept))
+
+
+def math_level(text: str) -> str:
+    body = strip_code(text.splitlines())
+    if not MATH_RE.search(body):
+        return "none"
+    if FULL_RE.search(body):
+        return "full"
+    return "tex"
+
+
+def main(argv: List[str]) -> int:
+    if len(argv) != 2:
+        sys.stderr.write("Usage: math_scan.py <input.md>\n")
+        return 2
+    try:
+        with open(argv[1], encoding="utf-8") as f:
+            print(math_level(f.read()))
+    except Exception as e:
+        # Unknown content: keep the full bundle
+        sys.stderr.write(f"math scan error: {e}\n")
+        print("full")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv))
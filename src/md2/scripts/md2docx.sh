@@ -4,6 +4,11 @@ set -euo pipefail
 # DOCX generation script that handles temporary markdown processing inside container
 # Usage: md2docx.sh <input_md> <output_docx> <title> <dialect> <markdown_flags...>
 
+# Bundled file locations (see md2html.sh)
+MD2_SCRIPTS="${MD2_SCRIPTS:-/scripts}"
+MD2_FILTERS="${MD2_FILTERS:-/filters}"
+MD2_STYLES="${MD2_STYLES:-/styles}"
+
 INPUT_MD="${1:-/work/input.md}"
 OUTPUT_DOCX="${2:-/work/output.docx}"
 DOC_TITLE="${3:-}"
@@ -16,46 +21,19 @@ if [[ ! -f "$INPUT_MD" ]]; then
     exit 1
 fi
 
-# Determine the actual title to use
-ACTUAL_TITLE="$DOC_TITLE"
-if [[ -z "$ACTUAL_TITLE" ]]; then
-    # Auto-detect title from H1 headers or use filename
-    H1_COUNT=$(grep -c '^# ' "$INPUT_MD" 2>/dev/null || echo "0")
-    if [[ "$H1_COUNT" == "1" ]]; then
-        ACTUAL_TITLE=$(grep '^# ' "$INPUT_MD" | head -1 | sed 's/^# *//' || echo "")
-    fi
-    if [[ -z "$ACTUAL_TITLE" ]]; then
-        ACTUAL_TITLE=$(basename "$INPUT_MD" .md)
-    fi
-fi
+# The host passes the detected title and shifts the headings of documents
+# with several H1s (fence-aware), so the input is converted as it is
+ACTUAL_TITLE="${DOC_TITLE:-$(basename "$INPUT_MD" .md)}"
 
-# Check if we need to handle multiple H1s
+# Per-job scratch directory (see md2html.sh)
+JOB_TMP="$(mktemp -d /tmp/md2docx.XXXXXX)"
+trap 'rm -rf "$JOB_TMP"' EXIT
 WORKING_MD="$INPUT_MD"
-H1_COUNT=$(grep -c '^# ' "$INPUT_MD" 2>/dev/null || echo "0")
-
-if [[ "$H1_COUNT" -gt 1 ]]; then
-    # Create temporary markdown with shifted headings inside container
-    TEMP_MD="/tmp/temp_docx_$(basename "$INPUT_MD")"
-    echo "Creating temporary markdown with shifted headings: $TEMP_MD"
-
-    # Shift headings and add title
-    {
-        echo "# $ACTUAL_TITLE"
-        echo ""
-        # Shift ATX-style headers (add one # to each)
-        sed 's/^#\(#*\) /##\1 /' "$INPUT_MD" |
-        # Convert Setext-style headers to ATX and shift
-        sed '/^.\+$/N;s/\(.*\)\n=\+$/## \1/' |
-        sed '/^.\+$/N;s/\(.*\)\n-\+$/### \1/'
-    } > "$TEMP_MD"
-
-    WORKING_MD="$TEMP_MD"
-fi
 
 # Always run generic preprocessing before conversion (ensures blank line before lists)
-PRE_MD="/tmp/pre_$(basename "$WORKING_MD")"
-if [[ -f /scripts/preprocess_md.py ]]; then
-    python3 /scripts/preprocess_md.py "$WORKING_MD" "$PRE_MD" || cp -f "$WORKING_MD" "$PRE_MD"
+PRE_MD="$JOB_TMP/pre_$(basename "$WORKING_MD")"
+if [[ -f "$MD2_SCRIPTS/preprocess_md.py" ]]; then
+    python3 "$MD2_SCRIPTS/preprocess_md.py" "$WORKING_MD" "$PRE_MD" || cp -f "$WORKING_MD" "$PRE_MD"
 else
     cp -f "$WORKING_MD" "$PRE_MD"
 fi
@@ -74,15 +52,23 @@ case "$DIALECT" in
         ;;
 esac
 
-# Build pandoc command
-PANDOC_CMD=(
-    "pandoc"
+# Build pandoc command; MD2_PANDOC_SERVER=1 (worker and batch containers)
+# submits the conversion to a warm pandoc server, pandoc_client.py runs the
+# CLI when it cannot.
+PANDOC_CMD=("pandoc")
+if [[ "${MD2_PANDOC_SERVER:-0}" == "1" ]]; then
+    PANDOC_CMD=("python3" "$MD2_SCRIPTS/pandoc_client.py")
+fi
+PANDOC_CMD+=(
     "-f" "$INPUT_FORMAT"
     "-t" "docx"
     "--standalone"
-    "--resource-path=/work:/styles:/tmp"
-    "--lua-filter=/filters/mermaid.lua"
+    "--resource-path=$(dirname "$INPUT_MD"):/work:$MD2_STYLES:/tmp"
 )
+# The mermaid filter only touches mermaid code blocks
+if grep -Eq '(```|~~~).*mermaid' "$WORKING_MD"; then
+    PANDOC_CMD+=("--lua-filter=$MD2_FILTERS/mermaid.lua")
+fi
 
 # Add markdown flags
 PANDOC_CMD+=("${MARKDOWN_FLAGS[@]}")
@@ -103,12 +89,4 @@ echo "Converting markdown to DOCX: $WORKING_MD -> $OUTPUT_DOCX"
 # Run pandoc
 "${PANDOC_CMD[@]}"
 
-# Clean up temporary file if created
-if [[ "$H1_COUNT" -gt 1 && -f "$TEMP_MD" ]]; then
-    rm -f "$TEMP_MD"
-fi
-
-# Clean preprocessed temp file
-rm -f "$PRE_MD" || true
-
 echo "DOCX generation complete: $OUTPUT_DOCX"
@@ -6,6 +6,18 @@ set -euo pipefail
 # DO NOT change to generic --mathjax flag as it causes visual rendering issues (broken sqrt, brackets)
 # The specific file is installed in the container at /mathjax/tex-svg-full.js
 
+# Bundled scripts/filters/styles and MathJax; the defaults are the container
+# paths, the native backend points them at the host.
+MD2_SCRIPTS="${MD2_SCRIPTS:-/scripts}"
+MD2_FILTERS="${MD2_FILTERS:-/filters}"
+MD2_STYLES="${MD2_STYLES:-/styles}"
+MATHJAX_JS="${MD2_MATHJAX_JS:-/mathjax/tex-svg-full.js}"
+# Smaller component set (no autoloaded extensions) for documents that allow it
+MATHJAX_TEX_JS="${MD2_MATHJAX_TEX_JS:-/mathjax/es5/tex-svg.js}"
+# Mermaid runtime for --mermaid=client (installed with mermaid-cli)
+MERMAID_JS="${MD2_MERMAID_JS:-/usr/local/lib/node_modules/@mermaid-js/mermaid-cli/node_modules/mermaid/dist/mermaid.min.js}"
+MERMAID_CDN="https://cdn.jsdelivr.net/npm/mermaid@11/dist/mermaid.min.js"
+
 IN="${1:-/work/input.md}"
 OUT="${2:-/work/output.html}"
 CSS_BASENAME="default.css"
@@ -16,6 +28,8 @@ PAGE_TITLE="${BASE_NAME%.*}"
 LINK_CSS="${LINK_CSS:-0}"
 # INTERNAL_RESOURCES=1 embeds images/fonts/etc. (default = external references)
 INTERNAL_RESOURCES="${INTERNAL_RESOURCES:-0}"
+# MD2_PRERENDER_MATH=1 turns math into static SVG (cached in MD2_MATH_CACHE)
+MD2_PRERENDER_MATH="${MD2_PRERENDER_MATH:-0}"
 
 # Parse additional arguments for format and HTML options
 # Default to a rich Pandoc Markdown with helpful extensions for best results
@@ -29,6 +43,11 @@ ENABLE_TOC=0
 TOC_DEPTH=""
 ADD_TOC_PLACEHOLDERS=false
 LETTER_MODE=0
+# Shared asset directory (--assets-dir) and its URL relative to the output
+ASSETS_DIR=""
+ASSETS_URL=""
+# server: diagrams rendered by mermaid.lua; client: rendered in the browser
+MERMAID_MODE="server"
 
 # If a third positional arg exists and is not an option, treat it as CSS
 if [[ $# -ge 3 && "${3}" != --* ]]; then
@@ -66,6 +85,15 @@ while [[ $# -gt 0 ]]; do
     --add-toc-placeholders)
       ADD_TOC_PLACEHOLDERS=true
       ;;
+    --assets-dir=*)
+      ASSETS_DIR="${1#--assets-dir=}"
+      ;;
+    --assets-url=*)
+      ASSETS_URL="${1#--assets-url=}"
+      ;;
+    --mermaid=*)
+      MERMAID_MODE="${1#--mermaid=}"
+      ;;
     --letter)
       LETTER_MODE=1
       ENABLE_TOC=0
@@ -88,38 +116,60 @@ fi
 
 export PUPPETEER_ARGS="--no-sandbox --disable-setuid-sandbox --disable-dev-shm-usage --disable-gpu"
 
-# CRITICAL: Always embed MathJax for offline math support
-# Must use specific MathJax file (/mathjax/tex-svg-full.js) for proper visual quality:
+# CRITICAL: Embed MathJax locally for offline math support
+# Must use the local SVG MathJax files (/mathjax/tex-svg-full.js) for proper visual quality:
 # - Connected lines in sqrt symbols
 # - Properly rendered brackets and braces
 # - High-quality mathematical typography
 # DO NOT change to generic --mathjax flag - it breaks visual rendering
-MATHJAX_URL="/mathjax/tex-svg-full.js"
-# Preprocess markdown inside container (write to /tmp and use as input for pandoc)
-PRE_MD="/tmp/pre_$(basename "$IN")"
-if [[ -f /scripts/preprocess_md.py ]]; then
-  python3 /scripts/preprocess_md.py "$IN" "$PRE_MD" || cp -f "$IN" "$PRE_MD"
+# Only documents with math load MathJax; tex-svg.js (same SVG output, fewer
+# TeX extensions) is used when the math needs no autoloaded extension
+# (see math_scan.py).
+MATHJAX_URL="$MATHJAX_JS"
+# Per-job scratch directory: several jobs may share one (warm worker) container
+JOB_TMP="$(mktemp -d /tmp/md2html.XXXXXX)"
+trap 'rm -rf "$JOB_TMP"' EXIT
+
+# Preprocess markdown inside container (write to scratch dir and use as input for pandoc)
+PRE_MD="$JOB_TMP/pre_$(basename "$IN")"
+if [[ -f "$MD2_SCRIPTS/preprocess_md.py" ]]; then
+  python3 "$MD2_SCRIPTS/preprocess_md.py" "$IN" "$PRE_MD" || cp -f "$IN" "$PRE_MD"
 else
   cp -f "$IN" "$PRE_MD"
 fi
 
 PANDOC_IN="$PRE_MD"
 if [[ "$LETTER_MODE" == "1" ]]; then
-  LETTER_MD="/tmp/letter_$(basename "$IN")"
-  python3 /scripts/letter_preprocess.py "$PRE_MD" "$LETTER_MD"
+  LETTER_MD="$JOB_TMP/letter_$(basename "$IN")"
+  python3 "$MD2_SCRIPTS/letter_preprocess.py" "$PRE_MD" "$LETTER_MD"
   PANDOC_IN="$LETTER_MD"
   ENABLE_TOC=0
   TOC_DEPTH=""
 fi
 
+MATH_MODE="$(python3 "$MD2_SCRIPTS/math_scan.py" "$PANDOC_IN" 2>/dev/null || echo full)"
+if [[ "$MATH_MODE" == "tex" && -f "$MATHJAX_TEX_JS" ]]; then
+  MATHJAX_URL="$MATHJAX_TEX_JS"
+fi
+
 OPTS=(
   -f "$INPUT_FORMAT"
   -t html5
   --standalone
   --section-divs
-  --resource-path=/work:/styles:/tmp
-  --mathjax=$MATHJAX_URL
+  --resource-path="$(dirname "$IN")":/work:"$MD2_STYLES":/tmp
 )
+if [[ "$MATH_MODE" != "none" ]]; then
+  # Pre-rendered formulas are no Math elements anymore, so pandoc only adds
+  # the MathJax script if some formula could not be pre-rendered.
+  OPTS+=(--mathjax="$MATHJAX_URL")
+  if [[ "$MD2_PRERENDER_MATH" != "1" ]]; then
+    # One shared glyph cache per page instead of repeating paths per formula
+    MATHJAX_CONFIG="$JOB_TMP/mathjax-config.html"
+    echo "<script>window.MathJax = { svg: { fontCache: 'global' } };</script>" > "$MATHJAX_CONFIG"
+    OPTS+=(--include-in-header="$MATHJAX_CONFIG")
+  fi
+fi
 
 # Title metadata (if provided)
 if [[ -n "$HTML_TITLE" ]]; then
@@ -153,208 +203,88 @@ fi
 FILTERS=()
 # Do not use toc_unlist_h1.lua: it removes the whole TOC when levels are nested under H1.
 # We'll flatten the TOC structure post-generation in HTML instead.
-if command -v mermaid >/dev/null 2>&1; then
-  FILTERS+=(--lua-filter=/filters/mermaid.lua)
+# The mermaid filter only touches mermaid code blocks; leaving it out of
+# documents without any lets them use the pandoc server.
+HAS_MERMAID=0
+if grep -Eq '(```|~~~).*mermaid' "$PANDOC_IN"; then
+  HAS_MERMAID=1
+fi
+if [[ "$HAS_MERMAID" == "1" && "$MERMAID_MODE" != "client" ]] && command -v mermaid >/dev/null 2>&1; then
+  FILTERS+=(--lua-filter="$MD2_FILTERS/mermaid.lua")
+fi
+if [[ "$MD2_PRERENDER_MATH" == "1" && "$MATH_MODE" != "none" ]]; then
+  FILTERS+=(--lua-filter="$MD2_FILTERS/math_svg.lua")
+fi
+# MD2_PANDOC_SERVER=1 (worker and batch containers) submits the conversion
+# to a warm pandoc server; pandoc_client.py runs the CLI when it cannot.
+PANDOC=(pandoc)
+if [[ "${MD2_PANDOC_SERVER:-0}" == "1" ]]; then
+  PANDOC=(python3 "$MD2_SCRIPTS/pandoc_client.py")
 fi
-pandoc "${OPTS[@]}" ${FILTERS[@]} "$PANDOC_IN" -o "$OUT"
+"${PANDOC[@]}" "${OPTS[@]}" ${FILTERS[@]} "$PANDOC_IN" -o "$OUT"
 
+# All HTML post-processing happens in one html_postprocess.py run that
+# reads and writes the file once.
+POST_ARGS=()
 # Add strict body classes for CSS styling.
 if [[ "$LETTER_MODE" == "1" ]]; then
-  python3 /scripts/html_body_classes.py "$OUT" letter no-toc
+  POST_ARGS+=(--body-class=letter --body-class=no-toc)
 elif [[ "$ENABLE_TOC" != "1" ]]; then
-  python3 /scripts/html_body_classes.py "$OUT" no-toc
+  POST_ARGS+=(--body-class=no-toc)
 fi
 
+css_path="$CSS_BASENAME"
+if [[ ! -f "$css_path" && -f "$MD2_STYLES/$CSS_BASENAME" ]]; then
+  css_path="$MD2_STYLES/$CSS_BASENAME"
+fi
+if [[ -n "$ASSETS_DIR" ]]; then
+  # Stylesheet, MathJax, images and Mermaid SVGs go once into the shared,
+  # content-hashed asset directory instead of next to (or into) every page
+  POST_ARGS+=(--assets-dir="$ASSETS_DIR" --asset-path="$(dirname "$css_path")")
+  if [[ -n "$ASSETS_URL" ]]; then
+    POST_ARGS+=(--assets-url="$ASSETS_URL")
+  fi
 # When linking CSS, also make MathJax available next to the HTML so the file:// URL works reliably.
-if [[ "$LINK_CSS" == "1" ]]; then
+elif [[ "$LINK_CSS" == "1" ]]; then
   # Ensure the referenced stylesheet is available next to the output HTML
-  css_path="$CSS_BASENAME"
-  if [[ ! -f "$css_path" && -f /styles/"$CSS_BASENAME" ]]; then
-    css_path="/styles/$CSS_BASENAME"
-  fi
   if [[ -f "$css_path" ]]; then
     cp -f "$css_path" "$(dirname "$OUT")/$CSS_HREF_NAME" || true
   fi
   # Provide MathJax locally next to the HTML to avoid cross-origin issues on file://
-  if [[ -f /mathjax/tex-svg-full.js ]]; then
-    cp -f /mathjax/tex-svg-full.js "$(dirname "$OUT")/tex-svg-full.js" || true
+  if [[ "$MATH_MODE" != "none" && -f "$MATHJAX_URL" ]]; then
+    MATHJAX_NAME="$(basename "$MATHJAX_URL")"
+    cp -f "$MATHJAX_URL" "$(dirname "$OUT")/$MATHJAX_NAME" || true
     # Update HTML to reference local MathJax path
-    sed -i 's|src="/mathjax/tex-svg-full.js"|src="tex-svg-full.js"|g' "$OUT" || true
+    POST_ARGS+=(--replace-src "$MATHJAX_URL" "$MATHJAX_NAME")
   fi
-else
+elif [[ -f "$css_path" ]]; then
   # Embed the stylesheet content inline (replace link) when not linking
-  css_path="$CSS_BASENAME"
-  if [[ ! -f "$css_path" && -f /styles/"$CSS_BASENAME" ]]; then
-    css_path="/styles/$CSS_BASENAME"
-  fi
-  if [[ -f "$css_path" ]]; then
-    tmpblock="$(mktemp)" || exit 1
-    {
-      echo "  <style type=\"text/css\">"
-      cat "$css_path"
-      echo "  </style>"
-    } > "$tmpblock"
-    awk -v cssname="$(basename "$CSS_BASENAME")" -v blockfile="$tmpblock" 'BEGIN{inserted=0; block=""; while((getline l < blockfile)>0){block=block l ORS}; close(blockfile)} /<link rel="stylesheet"/ { if($0 ~ cssname) next } /<\/head>/ && !inserted { printf "%s", block; inserted=1 } {print}' "$OUT" > "$OUT.tmp" && mv "$OUT.tmp" "$OUT" || true
-    rm -f "$tmpblock" || true
-  fi
-fi
-echo "md → html: wrote $OUT"
-
-# If TOC is enabled, place it after the first </h1> (intro) and before the first <h2>.
-if [[ "$ENABLE_TOC" == "1" && -f "$OUT" ]]; then
-  # First, flatten the TOC by removing the top-level H1 entry and promoting its children (H2+) to the top level.
-  # This keeps anchors intact and preserves valid HTML structure.
-  python3 - "$OUT" <<'PY' || true
-import io, os, re, sys
-
-path = sys.argv[1]
-try:
-    with io.open(path, 'r', encoding='utf-8') as f:
-        s = f.read()
-except Exception:
-    sys.exit(0)
-
-def find_tag_block(h, tag, start=0):
-    open_re = re.compile(r'<%s(\s[^>]*)?>' % re.escape(tag), re.I)
-    close_re = re.compile(r'</%s>' % re.escape(tag), re.I)
-    m = open_re.search(h, start)
-    if not m:
-        return None
-    pos = m.start()
-    i = m.end()
-    depth = 1
-    tag_any = re.compile(r'<(/?)%s(\s[^>]*)?>' % re.escape(tag), re.I)
-    while depth > 0:
-        m2 = tag_any.search(h, i)
-        if not m2:
-            return None
-        if m2.group(1) == '/':
-            depth -= 1
-        else:
-            depth += 1
-        i = m2.end()
-    return (pos, i)
-
-# Locate the TOC nav
-mnav = re.search(r'<nav\b[^>]*\bid\s*=\s*([\"\"])TOC\1[^>]*>', s, flags=re.I)
-if not mnav:
-    sys.exit(0)
-nav_open_start = mnav.start()
-nav_open_end = mnav.end()
-# Find the closing </nav>
-nav_close = s.lower().find('</nav>', nav_open_end)
-if nav_close == -1:
-    sys.exit(0)
-nav_end = nav_close + len('</nav>')
-
-nav_prefix = s[nav_open_start:nav_open_end]
-nav_content = s[nav_open_end:nav_close]
-nav_suffix = '</nav>'
-
-# In nav_content, find the top-level <ul> block
-ul_block = find_tag_block(nav_content, 'ul', 0)
-if not ul_block:
-    sys.exit(0)
-ul_start, ul_end = ul_block
-ul_html = nav_content[ul_start:ul_end]
-
-# Within ul_html, find the first top-level <li> block
-li_block = find_tag_block(ul_html, 'li', 0)
-if not li_block:
-    sys.exit(0)
-li_start, li_end = li_block
-li_html = ul_html[li_start:li_end]
-
-# Inside li_html, find a nested <ul> block (children of H1)
-nested_ul = find_tag_block(li_html, 'ul', 0)
-if not nested_ul:
-    # No nested UL under the first LI; leave as-is
-    sys.exit(0)
-nul_start, nul_end = nested_ul
-nested_ul_html = li_html[nul_start:nul_end]
-
-# Replace the top-level UL with the nested UL from the first LI
-new_nav_content = nav_content[:ul_start] + nested_ul_html + nav_content[ul_end:]
-s2 = s[:nav_open_start] + nav_prefix + new_nav_content + nav_suffix + s[nav_end:]
-
-with io.open(path, 'w', encoding='utf-8') as f:
-    f.write(s2)
-PY
-
-  tmpfile="$(mktemp)" || exit 1
-  awk '
-    BEGIN{toc=""; in_toc=0}
-    /<nav[^>]*id="TOC"[^>]*>/ {in_toc=1}
-    { if(in_toc) toc = toc $0 ORS; else body[++n]=$0 }
-    /<\/nav>/ && in_toc { in_toc=0; next }
-    END{
-      if (toc=="" || n==0) { for(i=1;i<=n;i++) print body[i]; exit }
-      printed_toc=0
-      seen_h1_close=0
-      for(i=1;i<=n;i++){
-        # After closing H1, before first H2 -> insert TOC once
-        if(!printed_toc && seen_h1_close && body[i] ~ /<h2[^>]*>/){
-          print toc
-          printed_toc=1
-        }
-        print body[i]
-        if(body[i] ~ /<\/h1>/){ seen_h1_close=1 }
-      }
-      if(!printed_toc){
-        # fallback: if we saw </h1> but no <h2>, put TOC after </h1>
-        if(seen_h1_close){
-          for(i=1;i<=n;i++){
-            print body[i]
-            if(body[i] ~ /<\/h1>/ && !printed_toc){ print toc; printed_toc=1 }
-          }
-        } else {
-          # no h1 found: append at end
-          print toc
-        }
-      }
-    }
-  ' "$OUT" > "$tmpfile" && mv "$tmpfile" "$OUT" || rm -f "$tmpfile" || true
+  POST_ARGS+=(--inline-css="$css_path" --css-name="$(basename "$CSS_BASENAME")")
 fi
 
-# If TOC is enabled, add inline backlinks to TOC on all section headings (h2–h6).
-if [[ "$ENABLE_TOC" == "1" && -f "$OUT" ]]; then
-  python3 - "$OUT" <<'PY' || true
-import io, re, sys
-
-path = sys.argv[1]
-try:
-  with io.open(path, 'r', encoding='utf-8') as f:
-    s = f.read()
-except Exception:
-  sys.exit(0)
-
-# Only proceed if a TOC anchor exists
-if re.search(r'<nav\b[^>]*\bid\s*=\s*[\"\']TOC[\"\']', s, flags=re.I) is None:
-  sys.exit(0)
-
-def add_backlink(html):
-  # Append backlink inside closing tag of h2..h6 if not already present
-  def repl(m):
-    tag = m.group('tag')
-    inner = m.group('inner')
-    # Skip if a toc-back link already exists within the header
-    if 'class="toc-back"' in inner or "class='toc-back'" in inner:
-      return m.group(0)
-    link = '<a class="toc-back" href="#TOC" aria-label="Back to table of contents">⇧ TOC</a>'
-    return f"<h{tag}{m.group('attrs')}>{inner}{link}</h{tag}>"
-
-  # Regex matching header start and end with minimal inner capture
-  pattern = re.compile(r"<h(?P<tag>[2-6])(?P<attrs>[^>]*)>(?P<inner>.*?)</h(?P=tag)>", re.I | re.S)
-  return pattern.sub(repl, html)
-
-s2 = add_backlink(s)
-if s2 != s:
-  with io.open(path, 'w', encoding='utf-8') as f:
-    f.write(s2)
-PY
+# If TOC is enabled: flatten it (drop the H1 level), place it after the
+# first </h1> and before the first <h2>, and add backlinks to the TOC on all
+# section headings (h2–h6).
+if [[ "$ENABLE_TOC" == "1" ]]; then
+  POST_ARGS+=(--toc)
 fi
-
 # Add TOC page number placeholders if requested
 if [[ "$ADD_TOC_PLACEHOLDERS" == "true" ]]; then
-  python3 /scripts/html_postprocess.py "$OUT" true
+  POST_ARGS+=(--toc-placeholders)
+fi
+# Client-side Mermaid: the page keeps the diagram sources and loads one
+# shared runtime (from the asset directory, next to the HTML or the CDN)
+if [[ "$MERMAID_MODE" == "client" && "$HAS_MERMAID" == "1" ]]; then
+  if [[ ! -f "$MERMAID_JS" ]]; then
+    POST_ARGS+=(--mermaid-runtime="$MERMAID_CDN")
+  elif [[ -n "$ASSETS_DIR" ]]; then
+    POST_ARGS+=(--mermaid-runtime="$MERMAID_JS")
+  else
+    cp -u "$MERMAID_JS" "$(dirname "$OUT")/mermaid.min.js" || true
+    POST_ARGS+=(--mermaid-runtime=mermaid.min.js)
+  fi
 fi
+if [[ ${#POST_ARGS[@]} -gt 0 ]]; then
+  python3 "$MD2_SCRIPTS/html_postprocess.py" "$OUT" "${POST_ARGS[@]}"
+fi
+echo "md → html: wrote $OUT"
@@ -0,0 +1,102 @@
+// Render many Mermaid diagrams with one browser.
+//
+//   node mermaid_batch.js [--concurrency=N] < jobs.json
+//
+// jobs.json: [{"code": "...", "output": "/cache/mermaid/ab/ab12.svg",
+//              "format": "svg" | "png", "scale": 6, "theme": "default"}, ...]
+// stdout: one line per job, in job order: "ok" or "error <message>" (plain
+// lines, so the Lua filter needs no JSON decoder).
+//
+// Uses mermaid-cli's renderMermaid() on one headless Chromium, rendering up
+// to --concurrency diagrams (default 4) on parallel pages, instead of one
+// mmdc process and browser per diagram. A failing diagram is reported in its
+// result and does not affect the others. Outputs are written atomically, so
+// concurrent conversions can share a render cache.
+//
+// mermaid-cli is found through MD2_MERMAID_CLI or the mmdc command on PATH;
+// Chromium launch options are read from MD2_PUPPETEER_CONFIG (default
+// /usr/local/bin/puppeteer.json, as for mmdc).
+const fs = require('fs');
+const path = require('path');
+const { createRequire } = require('module');
+const { pathToFileURL } = require('url');
+
+const DEFAULT_CONCURRENCY = 4;
+const VIEWPORT = { width: 800, height: 600 };
+
+function findMermaidCli() {
+    if (process.env.MD2_MERMAID_CLI) return process.env.MD2_MERMAID_CLI;
+    // mmdc is a symlink to <package>/src/cli.js
+    for (const dir of (process.env.PATH || '').split(path.delimiter)) {
+        const mmdc = path.join(dir, 'mmdc');
+        if (fs.existsSync(mmdc)) return path.resolve(path.dirname(fs.realpathSync(mmdc)), '..');
+    }
+    return '/usr/local/lib/node_modules/@mermaid-js/mermaid-cli';
+}
+
+async function loadMermaidCli(dir) {
+    const pkg = JSON.parse(fs.readFileSync(path.join(dir, 'package.json'), 'utf8'));
+    let entry = pkg.exports && (pkg.exports['.'] || pkg.exports);
+    if (entry && typeof entry === 'object') entry = entry.import || entry.default;
+    entry = typeof entry === 'string' ? entry : pkg.main || 'src/index.js';
+    const cli = await import(pathToFileURL(path.join(dir, entry)).href);
+    // Use the puppeteer version mermaid-cli was installed with
+    const puppeteer = createRequire(path.join(dir, 'package.json'))('puppeteer');
+    return { renderMermaid: cli.renderMermaid, puppeteer };
+}
+
+function launchOptions() {
+    const config = process.env.MD2_PUPPETEER_CONFIG || '/usr/local/bin/puppeteer.json';
+    try {
+        return { headless: true, ...JSON.parse(fs.readFileSync(config, 'utf8')) };
+    } catch {
+        const args = (process.env.PUPPETEER_ARGS || '--no-sandbox --disable-setuid-sandbox').split(/\s+/);
+        return { headless: true, args: args.filter(Boolean) };
+    }
+}
+
+function writeAtomic(target, data) {
+    fs.mkdirSync(path.dirname(target), { recursive: true });
+    const tmp = `${target}.${process.pid}.tmp`;
+    fs.writeFileSync(tmp, data);
+    fs.renameSync(tmp, target);
+}
+
+(async () => {
+    const concurrencyArg = process.argv.find((a) => a.startsWith('--concurrency='));
+    const concurrency = Math.max(1, parseInt(concurrencyArg ? concurrencyArg.split('=')[1] : DEFAULT_CONCURRENCY, 10) || 1);
+    const jobs = JSON.parse(fs.readFileSync(0, 'utf8') || '[]');
+    const results = new Array(jobs.length);
+    if (jobs.length === 0) return;
+
+    const { renderMermaid, puppeteer } = await loadMermaidCli(findMermaidCli());
+    const browser = await puppeteer.launch(launchOptions());
+    try {
+        let next = 0;
+        const worker = async () => {
+            while (next < jobs.length) {
+                const i = next++;
+                const job = jobs[i];
+                try {
+                    const format = job.format === 'png' ? 'png' : 'svg';
+                    const { data } = await renderMermaid(browser, job.code, format, {
+                        viewport: { ...VIEWPORT, deviceScaleFactor: Number(job.scale) || 1 },
+                        backgroundColor: 'transparent',
+                        mermaidConfig: { theme: job.theme || 'default' }
+                    });
+                    writeAtomic(job.output, data);
+                    results[i] = 'ok';
+                } catch (err) {
+                    results[i] = `error ${String((err && err.message) || err).split('\n')[0]}`;
+                }
+            }
+        };
+        await Promise.all(Array.from({ length: Math.min(concurrency, jobs.length) }, worker));
+    } finally {
+        await browser.close();
+    }
+    process.stdout.write(results.map((r) => `${r}\n`).join(''));
+})().catch((err) => {
+    console.error('Error in mermaid_batch.js:', err);
+    process.exit(1);
+});
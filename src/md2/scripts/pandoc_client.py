@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Run pandoc conversions through a warm ``pandoc server``.
+
+Drop-in replacement for the ``pandoc`` command in md2html.sh and md2docx.sh
+(enabled with MD2_PANDOC_SERVER=1). The first call in a container starts one
+``pandoc server`` on localhost, later calls submit their conversion to it
+over HTTP and so skip pandoc's startup. The server runs until the container
+(worker or batch) goes away.
+
+The server cannot run filters or read files, so conversions with Lua
+filters, --embed-resources, a reference document, DOCX output with images
+or any option not translated below fall back to the pandoc CLI with the
+unchanged arguments, as does every conversion when the server cannot be
+reached or reports an error. Since md2html embeds resources by default,
+only HTML that links its assets (--assets-dir, non-self-contained) and
+DOCX reach the server.
+
+Usage: pandoc_client.py <pandoc arguments>
+"""
+import base64
+import fcntl
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+PANDOC = os.environ.get("MD2_PANDOC", "pandoc")
+# Port and pid of the running server; /tmp is private to each container
+STATE_FILE = Path(os.environ.get("MD2_PANDOC_SERVER_STATE", "/tmp/md2-pandoc-server.json"))
+STARTUP_TIMEOUT = 10.0
+# Per-conversion timeout of the server (its default of 2 seconds is too short)
+REQUEST_TIMEOUT = 120
+
+# Local images are read by the DOCX writer, which the server cannot do
+IMAGE_RE = re.compile(r"!\[|<img\b", re.IGNORECASE)
+
+# Flag options -> server option
+FLAGS = {
+    "-s": "standalone",
+    "--standalone": "standalone",
+    "--section-divs": "section-divs",
+    "--toc": "table-of-contents",
+    "--table-of-contents": "table-of-contents",
+}
+
+
+class ServerError(RuntimeError):
+    """The pandoc server could not be started or rejected a conversion."""
+
+
+@dataclass
+class ServerRequest:
+    """A conversion translated for the server: its parameters and output file."""
+
+    params: Dict = field(default_factory=dict)
+    input_path: str = ""
+    output_path: str = ""
+
+
+def _split(arg: str, args: List[str]) -> Tuple[str, Optional[str]]:
+    """``(option, value)`` for ``--opt=value``, ``--opt value`` or ``-f value``."""
+    if arg.startswith("--") and "=" in arg:
+        name, value = arg.split("=", 1)
+        return name, value
+    if arg in ("-f", "-t", "-o", "--from", "--to", "--output", "--toc-depth"):
+        return arg, args.pop(0) if args else None
+    return arg, None
+
+
+def build_request(argv: List[str]) -> Optional[ServerRequest]:
+    """Translate pandoc CLI arguments, or None if the server cannot run them."""
+    req = ServerRequest()
+    params = req.params
+    inputs: List[str] = []
+    args = list(argv)
+    while args:
+        name, value = _split(args.pop(0), args)
+        if name in FLAGS:
+            params[FLAGS[name]] = True
+        elif name in ("-f", "--from") and value:
+            params["from"] = value
+        elif name in ("-t", "--to") and value:
+            params["to"] = value
+        elif name in ("-o", "--output") and value:
+            req.output_path = value
+        elif name == "--toc-depth" and value and value.isdigit():
+            params["toc-depth"] = int(value)
+        elif name == "--css" and value:
+            params.setdefault("css", []).append(value)
+        elif name == "--mathjax":
+            params["html-math-method"] = {"method": "mathjax"}
+            if value:
+                params["html-math-method"]["url"] = value
+        elif name in ("-M", "--metadata") and value:
+            key, sep, val = value.partition(":")
+            params.setdefault("metadata", {})[key] = val if sep else True
+        elif name == "--include-in-header" and value:
+            header = Path(value).read_text(encoding="utf-8")
+            variables = params.setdefault("variables", {})
+            variables["header-includes"] = variables.get("header-includes", "") + header
+        elif name == "--resource-path":
+            # Only used to fetch resources, which the server does not do
+            continue
+        elif not name.startswith("-") and value is None:
+            inputs.append(name)
+        else:
+            return None
+
+    if len(inputs) != 1 or not req.output_path or "to" not in params:
+        return None
+    req.input_path = inputs[0]
+    params["text"] = Path(req.input_path).read_text(encoding="utf-8")
+    if params["to"] == "docx" and IMAGE_RE.search(params["text"]):
+        return None
+    return req
+
+
+def _alive(pid: int, port: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        with socket.create_connection(("127.0.0.1", port), timeout=1):
+            return True
+    except OSError:
+        return False
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_server() -> Dict:
+    port = _free_port()
+    proc = subprocess.Popen(
+        [PANDOC, "server", "--port", str(port), "--timeout", str(REQUEST_TIMEOUT)],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        # Outlive this script: the next conversion reuses the server
+        start_new_session=True,
+    )
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise ServerError(f"pandoc server exited with status {proc.returncode}")
+        if _alive(proc.pid, port):
+            return {"pid": proc.pid, "port": port}
+        time.sleep(0.05)
+    proc.kill()
+    raise ServerError("pandoc server did not start")
+
+
+def server_port(state_file: Optional[Path] = None) -> int:
+    """Port of the container's pandoc server, started on first use."""
+    state_file = state_file or STATE_FILE
+    with open(f"{state_file}.lock", "w") as lock:
+        # Concurrent jobs in one worker must not start a server each
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            state = json.loads(state_file.read_text(encoding="utf-8"))
+            if _alive(int(state["pid"]), int(state["port"])):
+                return int(state["port"])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        state = _start_server()
+        state_file.write_text(json.dumps(state), encoding="utf-8")
+        return state["port"]
+
+
+def convert(params: Dict, port: int) -> Tuple[bytes, List]:
+    """Submit a conversion; returns the output and pandoc's log messages."""
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{port}/",
+        data=json.dumps(params).encode("utf-8"),
+        headers={"Content-Type": "application/json", "Accept": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT + 5) as resp:
+            body = resp.read()
+    except urllib.error.HTTPError as exc:
+        raise ServerError(f"HTTP {exc.code}: {exc.read()[:200]!r}") from exc
+    result = json.loads(body)
+    if not isinstance(result, dict) or "output" not in result:
+        raise ServerError(str(result.get("error") if isinstance(result, dict) else result))
+    if result.get("base64"):
+        output = base64.b64decode(result["output"])
+    else:
+        output = result["output"].encode("utf-8")
+        # Like the CLI, end text output with a newline
+        if not output.endswith(b"\n"):
+            output += b"\n"
+    return output, result.get("messages") or []
+
+
+def _run_cli(argv: List[str]) -> int:
+    os.execvp(PANDOC, [PANDOC, *argv])
+    return 1  # not reached
+
+
+def main(argv: List[str]) -> int:
+    try:
+        req = build_request(argv)
+    except (OSError, UnicodeDecodeError):
+        req = None  # let the CLI report unreadable inputs
+    if req is None:
+        return _run_cli(argv)
+
+    try:
+        output, messages = convert(req.params, server_port())
+    except (OSError, ValueError, ServerError) as exc:
+        print(f"pandoc_client: {exc}; using the pandoc CLI", file=sys.stderr)
+        return _run_cli(argv)
+
+    for message in messages:
+        if isinstance(message, dict):
+            level = message.get("verbosity", "INFO")
+            text = message.get("message") or json.dumps(message)
+            print(f"[{level}] {text}", file=sys.stderr)
+    Path(req.output_path).write_bytes(output)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
@@ -3,6 +3,101 @@ set -euo pipefail
 
 # Unified PDF generation script that handles HTML->PDF conversion and post-processing
 # Usage: pdf_generator.sh <input_html> <output_pdf> <page_numbers_enabled>
+# With MD2_TOC_JSON=1 the TOC heading -> page map is written to <output>.toc.json;
+# MD2_OPTIMIZE_PDF=basic|max|web optimizes the output (see pdf_processor.py).
+
+# Bundled scripts and the print.js app (see md2html.sh)
+MD2_SCRIPTS="${MD2_SCRIPTS:-/scripts}"
+MD2_APP="${MD2_APP:-/app}"
+
+# Batch mode: pdf_generator.sh --batch <jobs.tsv> <results.json> [--concurrency=N]
+# jobs.tsv holds one "input<TAB>output<TAB>page_numbers" line per document.
+# All documents are printed by one print.js process (one Chromium, a pool of
+# N pages); results.json gets [{"ok": ..., "error": ...}] in job order.
+if [[ "${1:-}" == "--batch" ]]; then
+    JOBS_FILE="$2"
+    RESULTS_FILE="$3"
+    CONCURRENCY="1"
+    if [[ "${4:-}" == --concurrency=* ]]; then
+        CONCURRENCY="${4#--concurrency=}"
+    fi
+
+    JOB_TMP="$(mktemp -d /tmp/pdf_generator.XXXXXX)"
+    trap 'rm -rf "$JOB_TMP"' EXIT
+
+    # Prepare a working copy with TOC placeholders where page numbers are on
+    : > "$JOB_TMP/print.tsv"
+    PLACEHOLDER_HTML=()
+    i=0
+    while IFS=$'\t' read -r in_html out_pdf page_numbers || [[ -n "$in_html" ]]; do
+        [[ -z "$in_html" ]] && continue
+        i=$((i + 1))
+        mkdir -p "$JOB_TMP/$i"
+        working="$in_html"
+        if [[ "$page_numbers" == "true" && -f "$in_html" ]]; then
+            working="$JOB_TMP/$i/temp_pdf_$(basename "$in_html")"
+            cp "$in_html" "$working"
+            PLACEHOLDER_HTML+=("$working")
+        fi
+        printf '%s\t%s\t%s\n' "$working" "$JOB_TMP/$i/temp_$(basename "$out_pdf")" "$page_numbers" >> "$JOB_TMP/print.tsv"
+    done < "$JOBS_FILE"
+    # One interpreter start for all copies; a copy that cannot be processed
+    # is printed without page numbers
+    if [[ ${#PLACEHOLDER_HTML[@]} -gt 0 ]]; then
+        python3 "$MD2_SCRIPTS/html_postprocess.py" "${PLACEHOLDER_HTML[@]}" --toc-placeholders || true
+    fi
+
+    echo "Converting $i HTML file(s) to PDF with $CONCURRENCY page(s)"
+    node "$MD2_APP/print.js" --stdin --concurrency="$CONCURRENCY" \
+        --results="$JOB_TMP/print.json" < "$JOB_TMP/print.tsv" || true
+
+    # Post-process every printed PDF in one Python process
+    python3 - "$MD2_SCRIPTS" "$JOBS_FILE" "$JOB_TMP/print.tsv" "$JOB_TMP/print.json" "$RESULTS_FILE" <<'PY'
+import json, os, shutil, sys
+from pathlib import Path
+
+scripts, jobs_file, print_list, printed_file, results_file = sys.argv[1:6]
+sys.path.insert(0, scripts)
+
+
+def read_tsv(path):
+    return [l.rstrip("\n").split("\t") for l in open(path, encoding="utf-8") if l.strip()]
+
+
+jobs = read_tsv(jobs_file)
+temp_pdfs = [fields[1] for fields in read_tsv(print_list)]
+try:
+    printed = json.loads(Path(printed_file).read_text(encoding="utf-8"))
+except (OSError, ValueError):
+    printed = [{"ok": False, "error": "print.js failed"} for _ in jobs]
+
+results = []
+for (in_html, out_pdf, page_numbers), temp_pdf, pr in zip(jobs, temp_pdfs, printed):
+    if not pr.get("ok"):
+        results.append({"ok": False, "error": pr.get("error") or "print.js failed"})
+        continue
+    try:
+        if page_numbers == "true" or os.environ.get("MD2_OPTIMIZE_PDF"):
+            from pdf_processor import optimize_level, process_pdf, toc_json_path
+
+            process_pdf(
+                Path(temp_pdf),
+                Path(out_pdf),
+                page_numbers == "true",
+                toc_json_path(Path(out_pdf)),
+                optimize_level(),
+            )
+        else:
+            shutil.copy2(temp_pdf, out_pdf)
+        print(f"PDF generation complete: {out_pdf}")
+        results.append({"ok": True, "error": ""})
+    except Exception as exc:
+        results.append({"ok": False, "error": f"{type(exc).__name__}: {exc}"})
+
+Path(results_file).write_text(json.dumps(results), encoding="utf-8")
+PY
+    exit 0
+fi
 
 INPUT_HTML="${1:-/work/input.html}"
 OUTPUT_PDF="${2:-/work/output.pdf}"
@@ -13,35 +108,33 @@ if [[ ! -f "$INPUT_HTML" ]]; then
     exit 1
 fi
 
+# Per-job scratch directory (see md2html.sh)
+JOB_TMP="$(mktemp -d /tmp/pdf_generator.XXXXXX)"
+trap 'rm -rf "$JOB_TMP"' EXIT
+
 # If page numbers are enabled, create a temporary HTML copy with TOC placeholders
 WORKING_HTML="$INPUT_HTML"
 if [[ "$PAGE_NUMBERS" == "true" ]]; then
-    TEMP_HTML="/tmp/temp_pdf_$(basename "$INPUT_HTML")"
+    TEMP_HTML="$JOB_TMP/temp_pdf_$(basename "$INPUT_HTML")"
     echo "Creating temporary HTML with TOC placeholders: $TEMP_HTML"
     cp "$INPUT_HTML" "$TEMP_HTML"
 
     # Add TOC placeholders to the temporary copy
-    python3 /scripts/html_postprocess.py "$TEMP_HTML" true
+    python3 "$MD2_SCRIPTS/html_postprocess.py" "$TEMP_HTML" true
     WORKING_HTML="$TEMP_HTML"
 fi
 
 # Create temporary PDF for processing
-TEMP_PDF="/tmp/temp_$(basename "$OUTPUT_PDF")"
+TEMP_PDF="$JOB_TMP/temp_$(basename "$OUTPUT_PDF")"
 
 echo "Converting HTML to PDF: $WORKING_HTML -> $TEMP_PDF"
 
 # Convert HTML to PDF using print.js
-node /app/print.js "$WORKING_HTML" "$TEMP_PDF" --pageNumbers="$PAGE_NUMBERS"
+node "$MD2_APP/print.js" "$WORKING_HTML" "$TEMP_PDF" --pageNumbers="$PAGE_NUMBERS"
 
 echo "Processing PDF for page numbers: $PAGE_NUMBERS"
 
 # Process PDF for page numbers (if enabled) and move to final location
-python3 /scripts/pdf_processor.py "$TEMP_PDF" "$OUTPUT_PDF" "$PAGE_NUMBERS"
-
-# Clean up temporary files
-rm -f "$TEMP_PDF"
-if [[ "$PAGE_NUMBERS" == "true" && -f "$TEMP_HTML" ]]; then
-    rm -f "$TEMP_HTML"
-fi
+python3 "$MD2_SCRIPTS/pdf_processor.py" "$TEMP_PDF" "$OUTPUT_PDF" "$PAGE_NUMBERS"
 
 echo "PDF generation complete: $OUTPUT_PDF"
@@ -2,15 +2,61 @@
 """
 Container-side PDF processor that handles page number insertion and TOC processing.
 This replaces the host-side pdf_editor.py and pdf_parser.py functionality.
+
+The document is opened once: placeholders (and their rectangles) are found in
+a single scan, the text of the pages after the TOC is extracted and
+normalized once into a searchable index, and the page numbers are drawn over
+the placeholder rectangles from that scan. The result is written with an
+incremental save, which appends the changed TOC pages instead of rewriting
+the whole file.
+
+TOC entries are resolved to the page of their link destination (Chromium
+keeps the TOC's #anchor links); searching the heading text is the fallback.
+With MD2_TOC_JSON=1 the heading -> page map is also written to
+<output>.toc.json.
+
+MD2_OPTIMIZE_PDF=basic|max|web rewrites the output once with garbage
+collection and stream compression (see OPTIMIZE_LEVELS) instead of saving
+incrementally, and reports the size before and after.
 """
 import sys
 import fitz
+import json
 import re
 import os
+import shutil
+import subprocess
+from bisect import bisect_right
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Tuple, List
+from typing import Dict, Tuple, List, Optional
 from collections import defaultdict
 
+# P#0001 ... P#9999, P#10000 ...: html_postprocess.py pads to four digits
+PLACEHOLDER_RE = re.compile(r"P#\d+")
+SECTION_NUMBER_RE = re.compile(r"\d+(?:\.\d+)*")
+
+# doc.save() options per MD2_OPTIMIZE_PDF level. garbage=4 also merges
+# duplicate objects (fonts, images); "web" adds linearization (fast web view).
+OPTIMIZE_LEVELS: Dict[str, Optional[dict]] = {
+    "none": None,
+    "basic": {"garbage": 1, "deflate": True},
+    "max": {
+        "garbage": 4,
+        "deflate": True,
+        "deflate_images": True,
+        "deflate_fonts": True,
+        "use_objstms": 1,
+    },
+    "web": {
+        "garbage": 4,
+        "deflate": True,
+        "deflate_images": True,
+        "deflate_fonts": True,
+        "linear": True,
+    },
+}
+
 
 def _median(values: List[float], default: float) -> float:
     if not values:
@@ -21,182 +67,428 @@ def _median(values: List[float], default: float) -> float:
     return s[mid] if n % 2 == 1 else 0.5 * (s[mid - 1] + s[mid])
 
 
-def _estimate_fontsize(
-    page: fitz.Page, rect: fitz.Rect, fallback: float = 9.0
-) -> float:
-    try:
-        d = page.get_text("dict")
-        sizes = []
-        for b in d.get("blocks", []):
-            for l in b.get("lines", []):
-                for s in l.get("spans", []):
-                    x0, y0, x1, y1 = s.get("bbox", (0, 0, 0, 0))
-                    if abs(y0 - rect.y0) < 2.0:
-                        size = s.get("size")
-                        if isinstance(size, (int, float)):
-                            sizes.append(float(size))
-        val = _median(sizes, fallback)
-        return max(6.5, min(11.0, val))
-    except Exception:
-        return fallback
+def _norm(s: str) -> str:
+    return re.sub(r"\s+", "", s.lower())
 
 
-def find_toc_placeholders(pdf_path: Path) -> List[Tuple[int, fitz.Rect, str]]:
-    """Find TOC placeholders in PDF and return their locations"""
-    placeholders = []
+def _span_sizes(page: fitz.Page) -> List[Tuple[float, float]]:
+    """``(y0, font size)`` of every text span on the page."""
+    sizes = []
     try:
-        doc = fitz.open(pdf_path)
-        for pno in range(len(doc)):
-            words = doc[pno].get_text("words")
-            for w in words:
-                token = w[4] or ""
-                if re.fullmatch(r"P#\d{2,4}", token):
-                    placeholders.append((pno, fitz.Rect(w[0], w[1], w[2], w[3]), token))
-        doc.close()
+        d = page.get_text("dict")
     except Exception:
-        pass
-    return placeholders
+        return sizes
+    for b in d.get("blocks", []):
+        for l in b.get("lines", []):
+            for s in l.get("spans", []):
+                size = s.get("size")
+                if isinstance(size, (int, float)):
+                    sizes.append((s.get("bbox", (0, 0, 0, 0))[1], float(size)))
+    return sizes
 
 
-def replace_text_in_pdf(
-    pdf_path: Path, replacements: Dict[str, str], output_path: Path
-) -> None:
-    """Replace placeholder text in PDF with actual page numbers"""
-    doc = fitz.open(pdf_path)
-    for page_index in range(len(doc)):
-        page = doc[page_index]
-        jobs: List[Tuple[fitz.Rect, str]] = []
-        for placeholder, replacement in replacements.items():
-            for r in page.search_for(placeholder) or []:
-                jobs.append((fitz.Rect(r.x0, r.y0, r.x1, r.y1), replacement))
-        if not jobs:
+def _estimate_fontsize(
+    spans: List[Tuple[float, float]], rect: fitz.Rect, fallback: float = 9.0
+) -> float:
+    sizes = [size for y0, size in spans if abs(y0 - rect.y0) < 2.0]
+    val = _median(sizes, fallback)
+    return max(6.5, min(11.0, val))
+
+
+class PageTextIndex:
+    """Normalized text of the pages from ``start`` on, extracted once.
+
+    The page texts are concatenated so that a lookup is a single ``str.find``
+    from the offset of the first candidate page.
+    """
+
+    def __init__(self, doc: fitz.Document, start: int) -> None:
+        self.start = start
+        self._offsets: List[int] = []
+        parts: List[str] = []
+        pos = 0
+        for pno in range(start, len(doc)):
+            text = _norm(doc[pno].get_text("text") or "")
+            self._offsets.append(pos)
+            parts.append(text)
+            pos += len(text)
+        self._offsets.append(pos)
+        self._text = "".join(parts)
+
+    def find(self, query: str, from_pno: int) -> Optional[int]:
+        """First page number >= ``from_pno`` whose text contains ``query``."""
+        index = from_pno - self.start
+        if not query or index < 0 or index >= len(self._offsets) - 1:
+            return None
+        pos = self._offsets[index]
+        while True:
+            hit = self._text.find(query, pos)
+            if hit == -1:
+                return None
+            i = bisect_right(self._offsets, hit) - 1
+            if hit + len(query) <= self._offsets[i + 1]:
+                return self.start + i
+            # The match straddles a page break
+            pos = hit + 1
+
+
+def find_toc_placeholders(doc: fitz.Document) -> Dict[int, List[tuple]]:
+    """Words of the pages holding TOC placeholders, by page number.
+
+    Each placeholder is one word; its rectangle is where the page number goes.
+    """
+    pages = {}
+    for pno in range(len(doc)):
+        words = doc[pno].get_text("words")
+        if any(PLACEHOLDER_RE.fullmatch(w[4] or "") for w in words):
+            pages[pno] = words
+    return pages
+
+
+@dataclass
+class TocEntry:
+    """One TOC row: where its placeholder is and the page it points to."""
+
+    toc_page: int
+    rect: fitz.Rect
+    placeholder: str
+    number: Optional[str]
+    title: str
+    page: Optional[int] = None  # 1-based
+    anchor: Optional[str] = None
+    source: Optional[str] = None  # "link" or "text"
+
+
+def _toc_entries(pno: int, words: List[tuple]) -> List[TocEntry]:
+    """The TOC rows on one page, with the heading text left of each placeholder."""
+    placeholders = [w for w in words if PLACEHOLDER_RE.fullmatch(w[4] or "")]
+    rows = sorted(
+        ((fitz.Rect(w[:4]), w[4]) for w in placeholders),
+        key=lambda e: (round(e[0].y0, 1), e[0].x0),
+    )
+    entries = []
+    for rect, token in rows:
+        line_words = [t for t in words if abs(t[1] - rect.y0) < 2.0]
+        line_words.sort(key=lambda t: t[0])
+        left_words = []
+        for t in line_words:
+            if t[0] >= rect.x0:
+                break
+            left_words.append(t[4])
+        left_text = " ".join([w for w in left_words if w]).strip()
+        parts = left_text.split()
+        number = None
+        if parts and SECTION_NUMBER_RE.fullmatch(parts[0] or ""):
+            number = parts[0]
+            left_text = " ".join(parts[1:]).strip()
+        entries.append(TocEntry(pno, rect, token, number, left_text))
+    return entries
+
+
+def _internal_links(page: fitz.Page) -> List[Tuple[fitz.Rect, int, Optional[str]]]:
+    """``(rect, target page index, anchor)`` of the page's internal links.
+
+    Chromium writes the TOC's ``#anchor`` hrefs as links to named
+    destinations, which PyMuPDF resolves to their page.
+    """
+    links = []
+    for link in page.get_links():
+        target = link.get("page")
+        if link.get("kind") not in (fitz.LINK_GOTO, fitz.LINK_NAMED):
             continue
+        if isinstance(target, int) and target >= 0:
+            links.append((fitz.Rect(link["from"]), target, link.get("nameddest")))
+    return links
+
+
+def _link_for(
+    rect: fitz.Rect, links: List[Tuple[fitz.Rect, int, Optional[str]]]
+) -> Optional[Tuple[fitz.Rect, int, Optional[str]]]:
+    """The link of the TOC row holding the placeholder at ``rect``.
+
+    The placeholder is the anchor's ::after content, so its link normally
+    covers it; otherwise the link on the same line left of it is taken.
+    """
+    best, best_overlap = None, 0.0
+    for link in links:
+        lrect = link[0]
+        overlap = min(lrect.y1, rect.y1) - max(lrect.y0, rect.y0)
+        if overlap <= 0 or lrect.x0 >= rect.x1:
+            continue
+        if lrect.intersects(rect):
+            overlap += rect.height  # prefer the link around the placeholder
+        if overlap > best_overlap:
+            best, best_overlap = link, overlap
+    return best
 
-        # Paint a light-grey cover to hide placeholder glyphs, matching TOC background (#fafbfc)
-        for rect, _ in jobs:
-            pad_x, pad_y = 0.5, 0.2
-            cover_rect = fitz.Rect(
-                rect.x0 - pad_x, rect.y0 - pad_y, rect.x1 + pad_x, rect.y1 + pad_y
-            )
-            page.draw_rect(
-                cover_rect,
-                fill=(250 / 255, 251 / 255, 252 / 255),
-                color=None,
-                width=0,
-            )
-
-        for rect, replacement in jobs:
-            draw_rect = fitz.Rect(
-                max(0, rect.x0 - 6.0), rect.y0 - 0.8, rect.x1 + 36.0, rect.y1 + 0.8
-            )
-            if os.environ.get("MD2_TOC_DEBUG"):
-                page.draw_rect(draw_rect, color=(0.8, 0.2, 0.2), width=0.3)
 
-            approx = max(6.5, min(10.0, (rect.y1 - rect.y0) * 0.9))
-            fontsize = _estimate_fontsize(page, rect, approx)
+def draw_page_numbers(
+    page: fitz.Page, jobs: List[Tuple[fitz.Rect, str]]
+) -> None:
+    """Cover each placeholder rectangle and draw its page number over it."""
+    # Paint a light-grey cover to hide placeholder glyphs, matching TOC background (#fafbfc)
+    for rect, _ in jobs:
+        pad_x, pad_y = 0.5, 0.2
+        cover_rect = fitz.Rect(
+            rect.x0 - pad_x, rect.y0 - pad_y, rect.x1 + pad_x, rect.y1 + pad_y
+        )
+        page.draw_rect(
+            cover_rect,
+            fill=(250 / 255, 251 / 255, 252 / 255),
+            color=None,
+            width=0,
+        )
 
-            overflow = page.insert_textbox(
-                draw_rect,
+    spans = _span_sizes(page)
+    for rect, replacement in jobs:
+        draw_rect = fitz.Rect(
+            max(0, rect.x0 - 6.0), rect.y0 - 0.8, rect.x1 + 36.0, rect.y1 + 0.8
+        )
+        if os.environ.get("MD2_TOC_DEBUG"):
+            page.draw_rect(draw_rect, color=(0.8, 0.2, 0.2), width=0.3)
+
+        approx = max(6.5, min(10.0, (rect.y1 - rect.y0) * 0.9))
+        fontsize = _estimate_fontsize(spans, rect, approx)
+
+        overflow = page.insert_textbox(
+            draw_rect,
+            replacement,
+            fontsize=fontsize,
+            color=(0, 0, 0),
+            fontname="helv",
+            align=fitz.TEXT_ALIGN_RIGHT,
+        )
+        # insert_textbox returns the unused height, negative if nothing fitted
+        if overflow < 0:
+            try:
+                width = fitz.get_text_length(
+                    replacement, fontname="helv", fontsize=fontsize
+                )
+            except Exception:
+                width = 0.0
+            x = max(0.0, rect.x1 - 1.5 - width)
+            y = rect.y1 - 0.6
+            page.insert_text(
+                (x, y),
                 replacement,
                 fontsize=fontsize,
                 color=(0, 0, 0),
                 fontname="helv",
-                align=fitz.TEXT_ALIGN_RIGHT,
             )
-            if overflow:
-                try:
-                    width = fitz.get_text_length(
-                        replacement, fontname="helv", fontsize=fontsize
-                    )
-                except Exception:
-                    width = 0.0
-                x = max(0.0, rect.x1 - 1.5 - width)
-                y = rect.y1 - 0.6
-                page.insert_text(
-                    (x, y),
-                    replacement,
-                    fontsize=fontsize,
-                    color=(0, 0, 0),
-                    fontname="helv",
-                )
 
-    doc.save(str(output_path))
+
+def resolve_page_numbers(
+    doc: fitz.Document, toc_pages: Dict[int, List[tuple]]
+) -> List[TocEntry]:
+    """Resolve the page of every TOC entry.
+
+    The page comes from the destination of the entry's link, read in one pass
+    over the TOC pages' links. Entries without a usable link fall back to
+    searching their heading text in the pages after the previous entry.
+    """
+    entries: List[TocEntry] = []
+    for pno in sorted(toc_pages):
+        links = _internal_links(doc[pno])
+        for entry in _toc_entries(pno, toc_pages[pno]):
+            link = _link_for(entry.rect, links)
+            if link is not None:
+                entry.page, entry.anchor, entry.source = link[1] + 1, link[2], "link"
+            entries.append(entry)
+
+    start_pno = max(max(toc_pages) + 1, 1)
+    index: Optional[PageTextIndex] = None  # built only if an entry needs it
+    current_pno = start_pno
+    for entry in entries:
+        if entry.page is not None:
+            current_pno = max(current_pno, entry.page - 1)
+            continue
+        query = entry.title[:80].strip()
+        if not query:
+            continue
+        if index is None:
+            index = PageTextIndex(doc, start_pno)
+        found = index.find(_norm(query), current_pno)
+        if found is None:
+            entry.page = current_pno + 1
+        else:
+            current_pno = found
+            entry.page = found + 1
+        entry.source = "text"
+    return entries
+
+
+def write_toc_json(entries: List[TocEntry], path: Path) -> None:
+    """Write the heading -> page map for downstream indexing."""
+    data = [
+        {
+            "number": e.number,
+            "title": e.title,
+            "anchor": e.anchor,
+            "page": e.page,
+            "source": e.source,
+        }
+        for e in entries
+        if e.page is not None
+    ]
+    Path(path).write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def toc_json_path(output_path: Path) -> Optional[Path]:
+    """``<output>.toc.json`` when MD2_TOC_JSON is set, else None."""
+    if os.environ.get("MD2_TOC_JSON", "").lower() in ("1", "true", "yes"):
+        return Path(output_path).with_suffix(".toc.json")
+    return None
+
+
+def _save(doc: fitz.Document, path: Path) -> None:
+    if doc.can_save_incrementally():
+        doc.saveIncr()
+        return
+    # e.g. a repaired file: write a full copy next to it and swap it in
+    tmp = path.with_name(path.name + ".tmp")
+    doc.save(str(tmp))
     doc.close()
+    os.replace(tmp, path)
 
 
-def apply_toc_page_numbers(pdf_path: Path, output_path: Path) -> None:
-    """Apply TOC page numbers to PDF"""
-    placeholder_infos = find_toc_placeholders(pdf_path)
+def optimize_level(level: Optional[str] = None) -> Optional[str]:
+    """``level`` or $MD2_OPTIMIZE_PDF; None when no optimization is wanted."""
+    level = (level or os.environ.get("MD2_OPTIMIZE_PDF") or "none").lower()
+    if level not in OPTIMIZE_LEVELS:
+        raise ValueError(
+            f"optimize level must be one of {', '.join(OPTIMIZE_LEVELS)}, got {level!r}"
+        )
+    return None if level == "none" else level
 
-    if not placeholder_infos:
-        # No placeholders found, just copy the file
-        if pdf_path != output_path:
-            import shutil
 
-            shutil.copy2(pdf_path, output_path)
-        return
+def _size(n: int) -> str:
+    if n < 1024:
+        return f"{n} B"
+    if n < 1024 * 1024:
+        return f"{n / 1024:.1f} KB"
+    return f"{n / (1024 * 1024):.1f} MB"
 
-    doc = fitz.open(pdf_path)
 
-    by_page: Dict[int, List[Tuple[fitz.Rect, str]]] = defaultdict(list)
-    for pno, rect, token in placeholder_infos:
-        by_page[pno].append((rect, token))
-    toc_pages = sorted(by_page.keys())
-    max_toc_page = max(toc_pages) if toc_pages else -1
-
-    entries: List[Tuple[str, str]] = []
-    for pno in toc_pages:
-        page = doc[pno]
-        words = page.get_text("words")
-        rows = sorted(by_page[pno], key=lambda e: (round(e[0].y0, 1), e[0].x0))
-        for rect, token in rows:
-            line_words = [t for t in words if abs(t[1] - rect.y0) < 2.0]
-            line_words.sort(key=lambda t: t[0])
-            left_words = []
-            for t in line_words:
-                if t[0] >= rect.x0:
-                    break
-                left_words.append(t[4])
-            left_text = " ".join([w for w in left_words if w]).strip()
-            parts = left_text.split()
-            if parts and re.fullmatch(r"\d+(?:\.\d+)*", parts[0] or ""):
-                search_text = " ".join(parts[1:]).strip()
-            else:
-                search_text = left_text
-            search_text = search_text[:80].strip()
-            if search_text:
-                entries.append((token, search_text))
-
-    replacements: Dict[str, str] = {}
-    start_pno = max(max_toc_page + 1, 1)
-    current_pno = start_pno
-    total_pages = len(doc)
-
-    def norm(s: str) -> str:
-        return re.sub(r"\s+", "", s.lower())
-
-    for token, query in entries:
-        qn = norm(query)
-        found_page = None
-        pno = max(current_pno, start_pno)
-        while pno < total_pages:
-            txt = doc[pno].get_text("text") or ""
-            if qn and norm(txt).find(qn) != -1:
-                found_page = pno + 1
-                break
-            pno += 1
-        if found_page is None:
-            found_page = (
-                max(current_pno, start_pno) + 1
-                if current_pno >= start_pno
-                else start_pno + 1
-            )
+def _linearize(path: Path) -> bool:
+    """Linearize ``path`` in place with qpdf; False if qpdf is unavailable."""
+    qpdf = shutil.which("qpdf")
+    if not qpdf:
+        return False
+    # qpdf exits with 3 when it succeeded with warnings
+    r = subprocess.run([qpdf, "--linearize", "--replace-input", str(path)])
+    return r.returncode in (0, 3)
+
+
+def save_optimized(
+    doc: fitz.Document, output_path: Path, level: str, size_before: int
+) -> None:
+    """Write ``doc`` to ``output_path`` with the options of ``level``.
+
+    Prints the size before and after. Linearization ("web") uses MuPDF where
+    it still supports it and qpdf otherwise; without either the file is
+    written optimized but not linearized.
+    """
+    options = dict(OPTIMIZE_LEVELS[level])
+    linear = options.pop("linear", False)
+    output_path = Path(output_path)
+    # Written next to the output first: the input may be the same file
+    tmp = output_path.with_name(output_path.name + ".tmp")
+    linearized = False
+    try:
+        if linear:
+            try:
+                doc.save(str(tmp), linear=True, **options)
+                linearized = True
+            except Exception:
+                # MuPDF >= 1.26 dropped linearization (FzErrorArgument)
+                doc.save(str(tmp), **options)
+                linearized = _linearize(tmp)
         else:
-            current_pno = max(current_pno, pno)
-        replacements[token] = str(found_page)
+            doc.save(str(tmp), **options)
+        doc.close()
+        os.replace(tmp, output_path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
 
-    doc.close()
-    replace_text_in_pdf(pdf_path, replacements, output_path)
+    if linear and not linearized:
+        print(
+            "Warning: cannot linearize PDF (install qpdf); written without fast web view",
+            file=sys.stderr,
+        )
+    size_after = output_path.stat().st_size
+    change = (size_after - size_before) * 100.0 / size_before if size_before else 0.0
+    print(
+        f"PDF optimized ({level}): {_size(size_before)} -> {_size(size_after)} "
+        f"({change:+.0f}%)"
+    )
+
+
+def optimize_pdf(pdf_path: Path, output_path: Path, level: str) -> None:
+    """Rewrite ``pdf_path`` to ``output_path`` at optimization ``level``."""
+    size_before = Path(pdf_path).stat().st_size
+    doc = fitz.open(pdf_path)
+    try:
+        save_optimized(doc, output_path, level, size_before)
+    finally:
+        if not doc.is_closed:
+            doc.close()
+
+
+def apply_toc_page_numbers(
+    pdf_path: Path,
+    output_path: Path,
+    toc_json: Optional[Path] = None,
+    optimize: Optional[str] = None,
+) -> None:
+    """Apply TOC page numbers to PDF, optionally writing the map to ``toc_json``
+
+    Without ``optimize`` the changes are appended with an incremental save;
+    with it the whole file is rewritten once at that level.
+    """
+    size_before = Path(pdf_path).stat().st_size
+    if optimize:
+        doc = fitz.open(pdf_path)
+    else:
+        if Path(pdf_path) != Path(output_path):
+            # The output starts as a copy so the changes can be appended to it
+            shutil.copy2(pdf_path, output_path)
+        doc = fitz.open(output_path)
+    try:
+        toc_pages = find_toc_placeholders(doc)
+        entries = resolve_page_numbers(doc, toc_pages) if toc_pages else []
+        if toc_json is not None:
+            write_toc_json(entries, toc_json)
+        jobs: Dict[int, List[Tuple[fitz.Rect, str]]] = defaultdict(list)
+        for entry in entries:
+            if entry.page is not None:
+                jobs[entry.toc_page].append((entry.rect, str(entry.page)))
+        for pno, page_jobs in jobs.items():
+            draw_page_numbers(doc[pno], page_jobs)
+        if optimize:
+            save_optimized(doc, Path(output_path), optimize, size_before)
+        elif jobs:
+            _save(doc, Path(output_path))
+    finally:
+        if not doc.is_closed:
+            doc.close()
+
+
+def process_pdf(
+    pdf_path: Path,
+    output_path: Path,
+    page_numbers: bool = True,
+    toc_json: Optional[Path] = None,
+    optimize: Optional[str] = None,
+) -> None:
+    """Post-process a printed PDF: TOC page numbers, then optimization."""
+    if page_numbers:
+        apply_toc_page_numbers(pdf_path, output_path, toc_json, optimize)
+    elif optimize:
+        optimize_pdf(pdf_path, output_path, optimize)
+    elif pdf_path != output_path:
+        # Just copy the file if page numbers are disabled
+        shutil.copy2(pdf_path, output_path)
 
 
 def main():
@@ -216,14 +508,13 @@ def main():
         print(f"Error: Input PDF {input_pdf} does not exist", file=sys.stderr)
         sys.exit(1)
 
-    if enable_page_numbers:
-        apply_toc_page_numbers(input_pdf, output_pdf)
-    else:
-        # Just copy the file if page numbers are disabled
-        if input_pdf != output_pdf:
-            import shutil
-
-            shutil.copy2(input_pdf, output_pdf)
+    process_pdf(
+        input_pdf,
+        output_pdf,
+        enable_page_numbers,
+        toc_json_path(output_pdf),
+        optimize_level(),
+    )
 
     print(f"PDF processed: {input_pdf} -> {output_pdf}")
 
@@ -1,53 +1,141 @@
+// Render HTML files to PDF with one Chromium.
+//
+//   node print.js <input.html> <output.pdf> [--pageNumbers=false]
+//   node print.js <in1> <out1> <in2> <out2> ... [--concurrency=N] [--results=FILE]
+//   node print.js --stdin [--concurrency=N] [--results=FILE] < jobs
+//
+// The stdin job list is a JSON array of {"input", "output", "pageNumbers"}
+// objects or one "input<TAB>output[<TAB>pageNumbers]" line per document.
+// Documents are printed on a pool of --concurrency pages (default 1) in one
+// browser, each in its own browser context; a failing document does not stop
+// the others. --results writes [{"input", "output", "ok", "error"}] in job
+// order. The exit status is 1 if any document failed.
+//
+// Pages are printed as soon as they signal readiness (see READY_SCRIPT);
+// --waitFor=networkidle0 (or any other puppeteer waitUntil value) restores
+// the old network-idle wait, which also serves as the fallback when no
+// signal arrives within --readyTimeout milliseconds (default 30000).
 const fs = require('fs');
 const path = require('path');
-const argv = require('minimist')(process.argv.slice(2));
+const argv = require('minimist')(process.argv.slice(2), { boolean: ['stdin'] });
 
-(async () => {
-    try {
-        const puppeteer = (await import('puppeteer')).default || (await import('puppeteer'));
-        const input = argv._[0] || '/work/input.html';
-        const output = argv._[1] || '/work/output.pdf';
-        const waitFor = argv.waitFor || 'networkidle0';
-        const paperFormat = argv.format || 'A4';
-        const margin = argv.margin || '10mm';
-        const scale = Number(argv.scale || 1.0);
-        const pageNumbers = argv.pageNumbers !== 'false';
-
-        const browser = await puppeteer.launch({
-            args: ['--no-sandbox', '--disable-setuid-sandbox'],
-            defaultViewport: { width: 1200, height: 800 }
+const LAUNCH_OPTIONS = {
+    args: ['--no-sandbox', '--disable-setuid-sandbox'],
+    defaultViewport: { width: 1200, height: 800 }
+};
+
+// Injected before any page script runs. window.__md2Ready resolves once the
+// page has loaded, MathJax has finished its initial typesetting, web fonts
+// are ready and an optional page-provided promise (window.md2Ready) settled.
+const READY_SCRIPT = () => {
+    window.__md2Ready = new Promise((resolve) => {
+        const settle = async () => {
+            const quiet = (p) => Promise.resolve(p).catch(() => { });
+            const mathjax = window.MathJax;
+            if (mathjax && mathjax.startup && mathjax.startup.promise) {
+                await quiet(mathjax.startup.promise);
+            }
+            if (window.md2Ready && typeof window.md2Ready.then === 'function') {
+                await quiet(window.md2Ready);
+            }
+            // Typesetting can pull in fonts, so check them last
+            if (document.fonts && document.fonts.ready) await quiet(document.fonts.ready);
+            resolve(true);
+        };
+        if (document.readyState === 'complete') settle();
+        else window.addEventListener('load', settle, { once: true });
+    });
+};
+
+// The pre-readiness behaviour: fonts, then re-run typesetting
+async function legacyWait(page) {
+    try { await page.evaluate(() => document.fonts && document.fonts.ready); } catch { }
+
+    await page.evaluate(() => {
+        return new Promise((resolve) => {
+            try {
+                if (window.MathJax && MathJax.typesetPromise) {
+                    MathJax.typesetPromise().then(() => resolve(true)).catch(() => resolve(true));
+                } else if (window.katex) {
+                    const done = () => resolve(true);
+                    if (document.readyState === 'complete') done();
+                    else window.addEventListener('load', done, { once: true });
+                } else {
+                    resolve(true);
+                }
+            } catch (e) {
+                resolve(true);
+            }
         });
+    });
+}
+
+async function waitUntilReady(page, url, options) {
+    if (options.waitFor !== 'ready') {
+        await page.goto(url, { waitUntil: options.waitFor, timeout: 180000 });
+        await legacyWait(page);
+        return;
+    }
+    await page.goto(url, { waitUntil: 'load', timeout: 180000 });
+    const ready = await page.evaluate((ms) => Promise.race([
+        window.__md2Ready ? window.__md2Ready : Promise.resolve(false),
+        new Promise((resolve) => setTimeout(() => resolve(false), ms))
+    ]), options.readyTimeout).catch(() => false);
+    if (!ready) {
+        console.error(`print.js: no readiness signal from ${url}, waiting for network idle`);
+        await page.waitForNetworkIdle({ idleTime: 500, timeout: 180000 });
+        await legacyWait(page);
+    }
+}
+
+function parseJobList(text) {
+    const trimmed = text.trim();
+    if (!trimmed) return [];
+    if (trimmed.startsWith('[')) {
+        return JSON.parse(trimmed).map((job) => ({
+            input: job.input,
+            output: job.output,
+            pageNumbers: job.pageNumbers === undefined ? undefined : String(job.pageNumbers) !== 'false'
+        }));
+    }
+    return trimmed.split('\n').filter((line) => line.trim()).map((line) => {
+        const [input, output, pageNumbers] = line.replace(/\r$/, '').split('\t');
+        return { input, output, pageNumbers: pageNumbers === undefined ? undefined : pageNumbers !== 'false' };
+    });
+}
 
-        const page = await browser.newPage();
+function collectJobs() {
+    if (argv.stdin) return parseJobList(fs.readFileSync(0, 'utf8'));
+    const positional = argv._.map(String);
+    if (positional.length <= 2) {
+        return [{ input: positional[0] || '/work/input.html', output: positional[1] || '/work/output.pdf' }];
+    }
+    if (positional.length % 2) throw new Error('Expected input/output pairs');
+    const jobs = [];
+    for (let i = 0; i < positional.length; i += 2) {
+        jobs.push({ input: positional[i], output: positional[i + 1] });
+    }
+    return jobs;
+}
+
+async function render(browser, job, options) {
+    const pageNumbers = job.pageNumbers === undefined ? options.pageNumbers : job.pageNumbers;
+    // A fresh context per document: no cookies, storage or cache leak between them
+    const context = browser.createBrowserContext
+        ? await browser.createBrowserContext()
+        : await browser.createIncognitoBrowserContext();
+    try {
+        const page = await context.newPage();
+        await page.evaluateOnNewDocument(READY_SCRIPT);
 
         let url;
-        if (fs.existsSync(input)) {
-            url = 'file://' + path.resolve(input);
+        if (fs.existsSync(job.input)) {
+            url = 'file://' + path.resolve(job.input);
         } else {
-            url = input;
+            url = job.input;
         }
 
-        await page.goto(url, { waitUntil: waitFor, timeout: 180000 });
-
-        try { await page.evaluate(() => document.fonts && document.fonts.ready); } catch { }
-
-        await page.evaluate(() => {
-            return new Promise((resolve) => {
-                try {
-                    if (window.MathJax && MathJax.typesetPromise) {
-                        MathJax.typesetPromise().then(() => resolve(true)).catch(() => resolve(true));
-                    } else if (window.katex) {
-                        const done = () => resolve(true);
-                        if (document.readyState === 'complete') done();
-                        else window.addEventListener('load', done, { once: true });
-                    } else {
-                        resolve(true);
-                    }
-                } catch (e) {
-                    resolve(true);
-                }
-            });
-        });
+        await waitUntilReady(page, url, options);
 
         // Add CSS to hide page numbers on title and TOC pages if page numbers are enabled
         if (pageNumbers) {
@@ -64,20 +152,83 @@ const argv = require('minimist')(process.argv.slice(2));
         }
 
         await page.pdf({
-            path: output,
-            format: paperFormat,
-            margin: { top: margin, bottom: margin, left: margin, right: margin },
+            path: job.output,
+            format: options.paperFormat,
+            margin: { top: options.margin, bottom: options.margin, left: options.margin, right: options.margin },
             printBackground: true,
-            scale,
+            scale: options.scale,
             displayHeaderFooter: pageNumbers,
             headerTemplate: pageNumbers ? '<div style="font-size: 9px; margin: 0 auto; width: 100%; text-align: center; color: #666;"></div>' : '',
             footerTemplate: pageNumbers ? '<div style="font-size: 9px; margin: 0 auto; width: 100%; text-align: center; color: #666;"><span class="pageNumber"></span></div>' : ''
         });
+    } finally {
+        await context.close().catch(() => { });
+    }
+}
 
-        await browser.close();
-        console.log('html → pdf: wrote', output);
+(async () => {
+    let jobs;
+    try {
+        jobs = collectJobs();
     } catch (err) {
-        console.error('Error in print.js:', err);
-        process.exit(1);
+        console.error('Error in print.js:', err.message);
+        process.exit(2);
+    }
+
+    const options = {
+        waitFor: argv.waitFor || 'ready',
+        readyTimeout: Number(argv.readyTimeout || 30000),
+        paperFormat: argv.format || 'A4',
+        margin: argv.margin || '10mm',
+        scale: Number(argv.scale || 1.0),
+        pageNumbers: String(argv.pageNumbers) !== 'false'
+    };
+    const concurrency = Math.max(1, Number(argv.concurrency || 1));
+
+    const puppeteer = (await import('puppeteer')).default || (await import('puppeteer'));
+
+    // Shared browser; relaunched for the remaining documents if it crashes
+    let browserPromise = null;
+    const connected = (b) => (typeof b.connected === 'boolean' ? b.connected : b.isConnected());
+    async function getBrowser() {
+        const current = browserPromise;
+        if (current) {
+            const browser = await current.catch(() => null);
+            if (browser && connected(browser)) return browser;
+            if (browserPromise !== current) return browserPromise;
+        }
+        browserPromise = puppeteer.launch(LAUNCH_OPTIONS);
+        return browserPromise;
+    }
+
+    const results = new Array(jobs.length);
+    let next = 0;
+    async function lane() {
+        while (next < jobs.length) {
+            const i = next++;
+            const job = jobs[i];
+            try {
+                await render(await getBrowser(), job, options);
+                console.log('html → pdf: wrote', job.output);
+                results[i] = { input: job.input, output: job.output, ok: true, error: '' };
+            } catch (err) {
+                console.error(`Error in print.js (${job.input}):`, err);
+                const error = String((err && err.message) || err).split('\n')[0];
+                results[i] = { input: job.input, output: job.output, ok: false, error };
+            }
+        }
+    }
+    await Promise.all(Array.from({ length: Math.min(concurrency, jobs.length) }, lane));
+
+    if (browserPromise) {
+        const browser = await browserPromise.catch(() => null);
+        if (browser) await browser.close().catch(() => { });
+    }
+    if (argv.results) {
+        fs.writeFileSync(String(argv.results), JSON.stringify(results));
     }
-})();
+    process.exit(results.every((r) => r.ok) ? 0 : 1);
+})().catch((err) => {
+    console.error('Error in print.js:', err);
+    process.exit(1);
+});
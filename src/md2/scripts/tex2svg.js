@@ -0,0 +1,51 @@
+// Render TeX formulas to standalone SVG files with MathJax in node.
+//
+//   node tex2svg.js <cache_dir> < jobs.json
+//
+// jobs.json: [{"key": "<sha1>", "tex": "...", "display": true}, ...]
+// Each SVG is written to <cache_dir>/<key[0:2]>/<key>.svg (atomically, so
+// concurrent conversions can share the cache). Formulas with TeX errors are
+// reported on stderr and not cached. MathJax is loaded from MD2_MATHJAX_DIR
+// (default /mathjax/es5, the es5 directory of the mathjax package).
+const fs = require('fs');
+const path = require('path');
+
+const MATHJAX_DIR = process.env.MD2_MATHJAX_DIR || '/mathjax/es5';
+
+(async () => {
+    const cacheDir = process.argv[2];
+    if (!cacheDir) {
+        console.error('Usage: tex2svg.js <cache_dir> < jobs.json');
+        process.exit(2);
+    }
+    const jobs = JSON.parse(fs.readFileSync(0, 'utf8') || '[]');
+
+    const MathJax = await require(path.join(MATHJAX_DIR, 'node-main.js')).init({
+        loader: { paths: { mathjax: MATHJAX_DIR }, load: ['adaptors/liteDOM', 'input/tex-full', 'output/svg'] },
+        tex: { formatError: (jax, err) => { throw err; } },
+        // Every SVG must stand alone: glyph paths are defined inside each one
+        svg: { fontCache: 'local' }
+    });
+    const adaptor = MathJax.startup.adaptor;
+
+    let failed = 0;
+    for (const job of jobs) {
+        try {
+            const node = MathJax.tex2svg(job.tex, { display: Boolean(job.display) });
+            const svg = adaptor.innerHTML(node);
+            const dir = path.join(cacheDir, job.key.slice(0, 2));
+            fs.mkdirSync(dir, { recursive: true });
+            const target = path.join(dir, `${job.key}.svg`);
+            const tmp = `${target}.${process.pid}.tmp`;
+            fs.writeFileSync(tmp, svg);
+            fs.renameSync(tmp, target);
+        } catch (err) {
+            failed++;
+            console.error(`tex2svg: cannot render ${JSON.stringify(job.tex)}: ${err.message || err}`);
+        }
+    }
+    console.error(`tex2svg: rendered ${jobs.length - failed} of ${jobs.length} formula(s)`);
+})().catch((err) => {
+    console.error('Error in tex2svg.js:', err);
+    process.exit(1);
+});
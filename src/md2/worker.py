@@ -0,0 +1,247 @@
+"""
+Long-lived worker containers.
+
+Instead of paying ``run --rm`` (container creation, namespace setup, bind
+mounts) for every document, a worker container is started once with the
+mounts a job needs and jobs are dispatched into it via ``exec``.
+
+Enable with ``MD2_WORKER=1``. Workers are keyed by their mount set and
+whether they get the extra privileges of ``rt.get_security_args``, so
+unprivileged jobs never run in a privileged container. Workers are recycled
+after ``MD2_WORKER_MAX_JOBS`` jobs (default 50), after a failed job when the
+container is no longer healthy, after any failed job that ran Chromium, and
+when an idle worker is found dead before it is reused. All workers are
+removed when the interpreter exits.
+
+With ``MD2_PANDOC_SERVER=1`` as well, each worker (and each batch container)
+also keeps one ``pandoc server`` running and HTML/DOCX conversions are
+submitted to it (see ``scripts/pandoc_client.py``).
+"""
+import atexit
+import os
+import subprocess
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from . import runtime as rt
+
+DEFAULT_MAX_JOBS = 50
+# Workers are keyed by their mount set; keep only a few of them alive.
+MAX_IDLE_WORKERS = 4
+
+
+def worker_enabled() -> bool:
+    return os.environ.get("MD2_WORKER", "").lower() in ("1", "true", "yes")
+
+
+def pandoc_server_enabled() -> bool:
+    return os.environ.get("MD2_PANDOC_SERVER", "").lower() in ("1", "true", "yes")
+
+
+def with_pandoc_server(env: Dict[str, str]) -> Dict[str, str]:
+    """``env`` for a container running several jobs, asking for the pandoc server."""
+    if not pandoc_server_enabled():
+        return env
+    return {**env, "MD2_PANDOC_SERVER": "1"}
+
+
+def _max_jobs() -> int:
+    try:
+        return max(1, int(os.environ.get("MD2_WORKER_MAX_JOBS", DEFAULT_MAX_JOBS)))
+    except ValueError:
+        return DEFAULT_MAX_JOBS
+
+
+class Worker:
+    """A named, detached container that executes jobs via ``exec``."""
+
+    def __init__(
+        self,
+        runtime: str,
+        mounts: Sequence[rt.Mount],
+        security: bool = True,
+        max_jobs: Optional[int] = None,
+    ):
+        self.runtime = runtime
+        self.mounts = list(mounts)
+        self.security = security
+        self.max_jobs = max_jobs or _max_jobs()
+        self.name: Optional[str] = None
+        self.jobs_run = 0
+        self.active = 0
+        self.retired = False
+        # Set once start() returned (or failed); jobs for the same key wait on it
+        self.ready = threading.Event()
+
+    def start(self) -> None:
+        self.name = f"md2-worker-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        cmd = [self.runtime, "run", "-d", "--rm", "--name", self.name]
+        cmd += rt.get_user_args(self.runtime)
+        if self.security:
+            cmd += rt.get_security_args(self.runtime)
+        cmd += rt.format_mounts(self.mounts)
+        cmd += [rt.image_name(), "sleep", "infinity"]
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+
+    def healthy(self) -> bool:
+        if not self.name:
+            return False
+        r = subprocess.run(
+            [self.runtime, "exec", self.name, "true"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        return r.returncode == 0
+
+    def stop(self) -> None:
+        if not self.name:
+            return
+        subprocess.run(
+            [self.runtime, "rm", "-f", self.name],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        self.name = None
+
+    def exec_command(
+        self, env: Dict[str, str], inner: List[str], workdir: Optional[str] = None
+    ) -> List[str]:
+        cmd = [self.runtime, "exec"]
+        cmd += rt.format_env(env)
+        if workdir:
+            cmd += ["-w", workdir]
+        cmd.append(str(self.name))
+        return cmd + inner
+
+
+_lock = threading.Lock()
+_workers: "OrderedDict[Tuple, Worker]" = OrderedDict()
+
+
+def _key(runtime: str, mounts: Sequence[rt.Mount], security: bool = True) -> Tuple:
+    return (runtime, security) + tuple((str(h), c, ro) for h, c, ro in mounts)
+
+
+def _acquire(runtime: str, mounts: Sequence[rt.Mount], security: bool = True) -> Worker:
+    # Only the bookkeeping happens under _lock; containers are started and
+    # removed outside it, so one slow start does not hold up other workers.
+    key = _key(runtime, mounts, security)
+    while True:
+        with _lock:
+            worker = _workers.get(key)
+            reused = worker is not None and not worker.retired
+            if not reused:
+                worker = Worker(runtime, mounts, security)
+                _workers[key] = worker
+            idle = worker.active == 0
+            _workers.move_to_end(key)
+            worker.active += 1
+            worker.jobs_run += 1
+            if worker.jobs_run >= worker.max_jobs:
+                # Later jobs get a fresh container; this one is removed on release.
+                worker.retired = True
+                del _workers[key]
+            evicted = _evict_idle()
+        for old in evicted:
+            old.stop()
+        if not reused:
+            try:
+                worker.start()
+            except BaseException:
+                _give_back(worker, recycle=True)
+                raise
+            finally:
+                worker.ready.set()
+            return worker
+        worker.ready.wait()
+        if worker.name is None:
+            # Its start failed: try again with a new worker
+            _give_back(worker, recycle=True)
+            continue
+        # An idle worker may have died since its last job (OOM kill, runtime
+        # restart): check before handing it out rather than failing a job
+        if not idle or worker.healthy():
+            return worker
+        _give_back(worker, recycle=True)
+
+
+def _evict_idle() -> List[Worker]:
+    """Drop idle workers beyond MAX_IDLE_WORKERS (under _lock); the caller stops them."""
+    evicted: List[Worker] = []
+    while len(_workers) > MAX_IDLE_WORKERS:
+        for key, worker in _workers.items():
+            if worker.active == 0:
+                del _workers[key]
+                evicted.append(worker)
+                break
+        else:
+            break
+    return evicted
+
+
+def _release(worker: Worker, failed: bool, chromium: bool) -> None:
+    # A crashed Chromium can leave stray processes and /dev/shm segments
+    # behind, so PDF failures always recycle; other failures only if the
+    # container itself went away.
+    _give_back(worker, recycle=failed and (chromium or not worker.healthy()))
+
+
+def _give_back(worker: Worker, recycle: bool) -> None:
+    with _lock:
+        worker.active -= 1
+        if recycle and not worker.retired:
+            worker.retired = True
+            _workers.pop(_key(worker.runtime, worker.mounts, worker.security), None)
+        stop = worker.retired and worker.active == 0
+    if stop:
+        worker.stop()
+
+
+def run_job(
+    runtime: str,
+    mounts: Sequence[rt.Mount],
+    env: Dict[str, str],
+    inner: List[str],
+    workdir: Optional[str] = None,
+    chromium: bool = False,
+    capture: bool = False,
+    security: bool = True,
+) -> Optional[str]:
+    """Run ``inner`` in a warm worker with ``mounts``; raises CalledProcessError.
+
+    With ``capture`` the combined stdout/stderr is returned instead of streamed.
+    ``security`` selects a worker started with ``rt.get_security_args``.
+    """
+    worker = _acquire(runtime, mounts, security)
+    failed = True
+    try:
+        cmd = worker.exec_command(with_pandoc_server(env), inner, workdir)
+        if capture:
+            r = subprocess.run(
+                cmd,
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+            )
+            output = r.stdout
+        else:
+            subprocess.run(cmd, check=True)
+            output = None
+        failed = False
+        return output
+    finally:
+        _release(worker, failed, chromium)
+
+
+def shutdown() -> None:
+    with _lock:
+        workers = list(_workers.values())
+        _workers.clear()
+    for worker in workers:
+        worker.stop()
+
+
+atexit.register(shutdown)
@@ -0,0 +1,18 @@
+import pytest
+import md2.runtime as rt
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(monkeypatch, tmp_path_factory):
+    # Keep probe results and caches out of the user's ~/.cache and between tests
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path_factory.mktemp("cache")))
+    rt.clear_probe_cache()
+    yield
+    rt.clear_probe_cache()
+
+
+@pytest.fixture
+def fake_runtime(monkeypatch):
+    """Docker as the runtime, with its image taken to exist."""
+    monkeypatch.setattr(rt, "ensure_image", lambda runtime, root: None)
+    monkeypatch.setattr(rt, "get_container_runtime", lambda: "docker")
@@ -0,0 +1,181 @@
+import asyncio
+import contextlib
+
+import pytest
+import md2.aio as aio
+import md2.conversion as conv
+
+
+class FakeProcess:
+    def __init__(self, cmd, fail, hang):
+        self.cmd = cmd
+        self.returncode = None
+        self.killed = False
+        self._fail = fail
+        self._hang = hang
+
+    async def communicate(self):
+        if self._hang:
+            await asyncio.sleep(3600)
+        await asyncio.sleep(0)
+        self.returncode = 1 if self._fail else 0
+        return (b"error: boom\n" if self._fail else b"ok\n"), None
+
+    async def wait(self):
+        self.returncode = self.returncode if self.returncode is not None else -9
+        return self.returncode
+
+    def kill(self):
+        self.killed = True
+
+
+class ExecRecorder:
+    """Stands in for asyncio.create_subprocess_exec."""
+
+    def __init__(self, fail_on=None, hang_on=None):
+        self.procs = []
+        self.fail_on = fail_on
+        self.hang_on = hang_on
+        self.running = 0
+        self.max_running = 0
+
+    async def __call__(self, *cmd, **kwargs):
+        joined = " ".join(cmd)
+        proc = FakeProcess(
+            list(cmd),
+            fail=bool(self.fail_on and self.fail_on in joined),
+            hang=bool(self.hang_on and self.hang_on in joined),
+        )
+        self.procs.append(proc)
+        if cmd[1] == "run":
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            communicate = proc.communicate
+
+            async def tracked():
+                try:
+                    return await communicate()
+                finally:
+                    self.running -= 1
+
+            proc.communicate = tracked
+        return proc
+
+    def runs(self):
+        return [p for p in self.procs if p.cmd[1] == "run"]
+
+    def removals(self):
+        return [p for p in self.procs if p.cmd[1:3] == ["rm", "-f"]]
+
+
+def _files(tmp_path, names, suffix=".md"):
+    files = []
+    for name in names:
+        f = tmp_path / f"{name}{suffix}"
+        f.write_text(f"# {name}" if suffix == ".md" else "<html><body></body></html>")
+        files.append(f)
+    return files
+
+
+def test_md2html_async_matches_sync_commands(monkeypatch, tmp_path, fake_runtime):
+    files = _files(tmp_path, ["a", "b"])
+    rec = ExecRecorder()
+    monkeypatch.setattr(aio.asyncio, "create_subprocess_exec", rec)
+
+    out = asyncio.run(aio.md2html(files, jobs=2))
+
+    assert [p.name for p in out] == ["a.html", "b.html"]
+    runs = rec.runs()
+    assert len(runs) == 2
+    assert all("--name" in p.cmd for p in runs)
+    assert all("/scripts/md2html.sh" in p.cmd for p in runs)
+    assert f"{tmp_path}:/work" in runs[0].cmd
+
+
+def test_semaphore_bounds_concurrency(monkeypatch, tmp_path, fake_runtime):
+    files = _files(tmp_path, ["a", "b", "c", "d"])
+    rec = ExecRecorder()
+    monkeypatch.setattr(aio.asyncio, "create_subprocess_exec", rec)
+
+    async def main():
+        return await aio.md2docx(files, semaphore=asyncio.Semaphore(2))
+
+    out = asyncio.run(main())
+
+    assert len(out) == 4
+    assert rec.max_running == 2
+
+
+def test_md2pdf_chains_each_document(monkeypatch, tmp_path, fake_runtime):
+    files = _files(tmp_path, ["a", "b"])
+    rec = ExecRecorder(fail_on="/work/b.html /work/b.pdf")
+    monkeypatch.setattr(aio.asyncio, "create_subprocess_exec", rec)
+
+    with pytest.raises(conv.ConversionError) as exc:
+        asyncio.run(aio.md2pdf(files, jobs=2))
+
+    assert list(exc.value.failures) == [files[1]]
+    assert "boom" in exc.value.failures[files[1]]
+    assert [p.name for p in exc.value.outputs] == ["a.pdf"]
+
+
+def test_as_completed_streams_results(monkeypatch, tmp_path, fake_runtime):
+    files = _files(tmp_path, ["a", "b"], suffix=".html")
+    rec = ExecRecorder(fail_on="/work/a.html")
+    monkeypatch.setattr(aio.asyncio, "create_subprocess_exec", rec)
+
+    async def main():
+        return [r async for r in aio.as_completed(aio.html2pdf, files, jobs=2)]
+
+    results = asyncio.run(main())
+
+    by_source = {r.source.name: r for r in results}
+    assert not by_source["a.html"].ok
+    assert by_source["b.html"].ok
+    assert by_source["b.html"].output.name == "b.pdf"
+
+
+def test_as_completed_rejects_unknown_conversion():
+    with pytest.raises(ValueError):
+        aio.as_completed("md2txt", [])
+
+
+def test_cancellation_removes_container(monkeypatch, tmp_path, fake_runtime):
+    files = _files(tmp_path, ["a"], suffix=".html")
+    rec = ExecRecorder(hang_on="/scripts/pdf_generator.sh")
+    monkeypatch.setattr(aio.asyncio, "create_subprocess_exec", rec)
+
+    async def main():
+        task = asyncio.create_task(aio.html2pdf(files))
+        while not rec.runs():
+            await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+
+    run = rec.runs()[0]
+    assert run.killed
+    name = run.cmd[run.cmd.index("--name") + 1]
+    assert [p.cmd[-1] for p in rec.removals()] == [name]
+
+
+def test_closing_as_completed_cleans_up(monkeypatch, tmp_path, fake_runtime):
+    files = _files(tmp_path, ["a", "b", "c"])
+    for f in files[1:]:
+        f.write_text(f"# {f.stem}\n\n# Two\n")  # shifted into a temporary file
+    rec = ExecRecorder(hang_on="/work/tmp_")
+    monkeypatch.setattr(aio.asyncio, "create_subprocess_exec", rec)
+
+    async def main():
+        stream = aio.as_completed(aio.md2html, files, jobs=1)
+        async with contextlib.aclosing(stream) as results:
+            async for result in results:
+                return result
+
+    first = asyncio.run(main())
+
+    assert first.source == files[0] and first.ok
+    assert len(rec.runs()) == 2 and rec.runs()[1].killed
+    assert not [p for p in tmp_path.iterdir() if p.name.startswith("tmp_")]
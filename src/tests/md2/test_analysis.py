@@ -0,0 +1,97 @@
+from md2 import analysis
+from md2 import conversion as conv
+
+
+DOC = """# Guide
+
+Intro with $x^2$ and ![logo](img/logo.png) and ![web](https://example.com/a.png).
+
+```bash
+# not a heading
+cat ![nope](missing.png)
+```
+
+~~~{.mermaid}
+graph TD; A-->B
+~~~
+
+Second
+======
+
+<img src="img/logo.png" alt="again" /> `![code](span.png)`
+"""
+
+
+def test_single_scan_ignores_code(tmp_path):
+    (tmp_path / "img").mkdir()
+    (tmp_path / "img" / "logo.png").write_bytes(b"PNG")
+    f = tmp_path / "guide.md"
+    f.write_text(DOC, encoding="utf-8")
+
+    a = analysis.analyze_markdown(f)
+
+    assert a.h1_titles == ["Guide", "Second"]
+    assert a.local_images == {tmp_path / "img" / "logo.png"}
+    assert a.remote_images == ["https://example.com/a.png"]
+    assert a.title() == "guide"  # two H1s
+    assert a.title("Override") == "Override"
+
+
+def test_code_only_document(tmp_path):
+    f = tmp_path / "notes.md"
+    f.write_text("# Notes\n\n````\n```\n# inner\n```\n$HOME\n````\n", encoding="utf-8")
+
+    a = analysis.analyze_markdown(f)
+
+    assert a.h1_titles == ["Notes"]
+    assert a.title() == "Notes"
+    assert conv.count_h1_headers(f) == 1
+    assert conv.determine_document_title(tmp_path / "missing.md") == "missing"
+
+
+def test_stray_backticks_do_not_hide_headings(tmp_path):
+    f = tmp_path / "ticks.md"
+    f.write_text("Type a ` to start code.\n\n# Title\n\nAnother ` here.\n", encoding="utf-8")
+
+    a = analysis.analyze_markdown(f)
+
+    assert a.h1_titles == ["Title"]
+    assert a.title() == "Title"
+
+
+def test_md2html_reads_each_input_once(monkeypatch, tmp_path):
+    f = tmp_path / "a.md"
+    f.write_text("# One\n\n# Two\n", encoding="utf-8")
+    reads = []
+    real = analysis.analyze_markdown
+
+    def counting(path):
+        reads.append(path)
+        return real(path)
+
+    monkeypatch.setattr(conv, "analyze_markdown", counting)
+
+    (job,) = conv._plan_md2html("docker", [f], ["--toc"])
+
+    assert reads == [f.resolve()]
+    shifted = next(p for p in tmp_path.iterdir() if p.name.startswith("tmp_"))
+    assert shifted.read_text(encoding="utf-8").startswith("# a\n\n## One")
+    assert "--doc-title=a" in job.inner
+
+
+def test_md2docx_shifts_headings_outside_code(tmp_path):
+    single = tmp_path / "single.md"
+    single.write_text("# Only\n\n```bash\n# comment\n```\n", encoding="utf-8")
+    double = tmp_path / "double.md"
+    double.write_text("# One\n\n```bash\n# comment\n```\n\n# Two\n", encoding="utf-8")
+
+    (single_job,) = conv._plan_md2docx([single], ["--toc"], runtime="docker")
+    assert single_job.cleanup == [] and single_job.inner[2] == "/work/single.md"
+    assert single_job.inner[4] == "Only"
+
+    (double_job,) = conv._plan_md2docx([double], ["--toc"], runtime="docker")
+    (shifted,) = double_job.cleanup
+    assert double_job.inner[2] == f"/work/{shifted.name}"
+    assert shifted.read_text(encoding="utf-8") == (
+        "# double\n\n## One\n\n```bash\n# comment\n```\n\n## Two\n"
+    )
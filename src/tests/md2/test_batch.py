@@ -0,0 +1,167 @@
+from pathlib import Path
+import importlib.util
+import json
+import sys
+
+import pytest
+import md2.conversion as conv
+
+
+def _load_batch_runner():
+    path = Path(__file__).resolve().parents[2] / "md2" / "scripts" / "batch_runner.py"
+    spec = importlib.util.spec_from_file_location("batch_runner", str(path))
+    mod = importlib.util.module_from_spec(spec)  # type: ignore[arg-type]
+    assert spec and spec.loader
+    spec.loader.exec_module(mod)  # type: ignore[assignment]
+    return mod
+
+
+class BatchRecorder:
+    """Pretends to be the container: reads the job list, writes results."""
+
+    def __init__(self, fail_names=(), drop=0):
+        self.cmds = []
+        self.jobs = []
+        self.fail_names = fail_names
+        self.drop = drop  # results missing at the end
+
+    def __call__(self, cmd, check=False, **k):
+        self.cmds.append(cmd)
+        work = Path(next(a.split(":")[0] for a in cmd if a.endswith(":/work")))
+        results_arg = next(a for a in cmd if a.endswith("/results.json"))
+        batch_dir = (work / results_arg[len("/work/") :]).parent
+        tsv = Path(batch_dir) / "jobs.tsv"
+        if tsv.exists():
+            # pdf_generator.sh --batch: input<TAB>output<TAB>page_numbers
+            lines = tsv.read_text().splitlines()
+            jobs = [{"argv": line.split("\t")} for line in lines]
+        else:
+            jobs = json.loads((Path(batch_dir) / "jobs.json").read_text())
+        self.jobs.extend(jobs)
+        results = []
+        for job in jobs:
+            failed = any(name in " ".join(job["argv"]) for name in self.fail_names)
+            results.append({"ok": not failed, "error": "boom" if failed else ""})
+        results = results[: len(results) - self.drop]
+        (Path(batch_dir) / "results.json").write_text(json.dumps(results))
+
+        class R:
+            returncode = 0
+
+        return R()
+
+
+def _make_tree(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b" / "c").mkdir(parents=True)
+    files = [tmp_path / "a" / "one.md", tmp_path / "b" / "c" / "two.md"]
+    for f in files:
+        f.write_text(f"# {f.stem}")
+    return files
+
+
+def test_md2html_batch_uses_one_container(monkeypatch, tmp_path, fake_runtime):
+    files = _make_tree(tmp_path)
+    rec = BatchRecorder()
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+
+    out = conv.md2html(files, batch=True)
+
+    assert [p.name for p in out] == ["one.html", "two.html"]
+    assert len(rec.cmds) == 1
+    assert f"{tmp_path}:/work" in rec.cmds[0]
+    assert "/scripts/batch_runner.py" in rec.cmds[0]
+    assert rec.jobs[0]["cwd"] == "/work/a"
+    assert rec.jobs[0]["argv"][2:4] == ["/work/a/one.md", "/work/a/one.html"]
+    assert rec.jobs[1]["argv"][2] == "/work/b/c/two.md"
+
+
+
+def test_batch_container_requests_pandoc_server(monkeypatch, tmp_path, fake_runtime):
+    files = _make_tree(tmp_path)
+    rec = BatchRecorder()
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+
+    conv.md2html(files, batch=True)
+    assert "MD2_PANDOC_SERVER=1" not in rec.cmds[0]
+
+    monkeypatch.setenv("MD2_PANDOC_SERVER", "1")
+    conv.md2html(files, batch=True)
+    assert "MD2_PANDOC_SERVER=1" in rec.cmds[1]
+
+def test_batch_reports_per_file_failures(monkeypatch, tmp_path, fake_runtime):
+    files = _make_tree(tmp_path)
+    rec = BatchRecorder(fail_names=("two.md",))
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+
+    with pytest.raises(conv.ConversionError) as exc:
+        conv.md2docx(files, batch=True)
+
+    assert list(exc.value.failures) == [files[1]]
+    assert exc.value.failures[files[1]] == "boom"
+    assert [p.name for p in exc.value.outputs] == ["one.docx"]
+
+
+def test_batch_missing_results_are_failures(monkeypatch, tmp_path, fake_runtime):
+    files = _make_tree(tmp_path)
+    rec = BatchRecorder(drop=1)
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+
+    with pytest.raises(conv.ConversionError) as exc:
+        conv.md2html(files, batch=True)
+
+    assert exc.value.failures == {files[1]: "no result from the batch"}
+    assert [p.name for p in exc.value.outputs] == ["one.html"]
+    # The job list was passed under /work, not through a mount of its own
+    cmd = rec.cmds[0]
+    targets = [cmd[i + 1].split(":")[1] for i, a in enumerate(cmd) if a == "-v"]
+    assert targets == ["/work", "/styles", "/filters", "/scripts", "/cache/mermaid"]
+    assert not any(p.name.startswith(".md2-batch-") for p in tmp_path.iterdir())
+
+
+def test_html2pdf_batch(monkeypatch, tmp_path, fake_runtime):
+    files = []
+    for name in ("x", "y"):
+        f = tmp_path / f"{name}.html"
+        f.write_text("<html><body></body></html>")
+        files.append(f)
+    rec = BatchRecorder()
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+
+    out = conv.html2pdf(files, batch=True, page_numbers=False)
+
+    assert [p.name for p in out] == ["x.pdf", "y.pdf"]
+    assert len(rec.cmds) == 1
+    assert "/scripts/pdf_generator.sh" in rec.cmds[0]
+    assert "--batch" in rec.cmds[0]
+    assert rec.jobs[1]["argv"] == ["/work/y.html", "/work/y.pdf", "false"]
+
+
+def test_html2pdf_batch_reports_print_failures(monkeypatch, tmp_path, fake_runtime):
+    files = []
+    for name in ("x", "y"):
+        f = tmp_path / f"{name}.html"
+        f.write_text("<html><body></body></html>")
+        files.append(f)
+    rec = BatchRecorder(fail_names=("x.html",))
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+
+    with pytest.raises(conv.ConversionError) as exc:
+        conv.html2pdf(files, batch=True, jobs=2)
+
+    assert "--concurrency=2" in rec.cmds[0]
+    assert list(exc.value.failures) == [files[0]]
+    assert [p.name for p in exc.value.outputs] == ["y.pdf"]
+
+
+def test_batch_runner_collects_results():
+    mod = _load_batch_runner()
+    results = mod.run_batch(
+        [
+            {"argv": [sys.executable, "-c", "pass"]},
+            {"argv": [sys.executable, "-c", "import sys; sys.exit('bad input')"]},
+        ]
+    )
+    assert results[0]["ok"] is True
+    assert results[1]["ok"] is False
+    assert "bad input" in results[1]["error"]
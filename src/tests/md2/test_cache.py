@@ -0,0 +1,78 @@
+import os
+
+import md2.cache as cache
+import md2.conversion as conv
+import md2.runtime as rt
+
+
+def _entry(c, name, size, mtime):
+    path = c.path / name[:2] / name
+    path.parent.mkdir(exist_ok=True)
+    path.write_bytes(b"x" * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_journal_is_folded_into_counters():
+    c = cache.mermaid_cache()
+    a = _entry(c, "aa01.svg", 10, 1000)
+    (c.path / cache.JOURNAL).write_text("miss aa01.svg\nhit aa01.svg\nhit aa01.svg\nmiss bb02.png\n")
+
+    stats = c.stats()
+
+    assert (stats.hits, stats.misses, stats.entries, stats.size) == (2, 2, 1, 10)
+    assert stats.hit_rate == 0.5
+    assert a.stat().st_mtime > 1000  # hit marks the entry as recently used
+    assert not (c.path / cache.JOURNAL).exists()
+
+    # Counters persist, the journal is only counted once
+    (c.path / cache.JOURNAL).write_text("hit aa01.svg\n")
+    assert cache.mermaid_cache().stats().hits == 3
+    assert cache.mermaid_cache().stats().hits == 3
+
+
+def test_least_recently_used_entries_are_evicted():
+    c = cache.RenderCache("mermaid", max_bytes=250)
+    old = _entry(c, "aa01.svg", 100, 1000)
+    used = _entry(c, "bb02.svg", 100, 2000)
+    new = _entry(c, "cc03.svg", 100, 3000)
+    stale_tmp = _entry(c, "dd04.tmp123.svg", 100, 1000)
+    (c.path / cache.JOURNAL).write_text("hit bb02.svg\n")
+
+    stats = c.sync()
+
+    assert not old.exists() and not stale_tmp.exists()
+    assert used.exists() and new.exists()
+    assert (stats.entries, stats.size, stats.evictions) == (2, 200, 1)
+
+    c.max_bytes = 150
+    c.sync()
+    assert used.exists() and not new.exists()
+
+
+def test_max_size_from_environment(monkeypatch):
+    monkeypatch.setenv("MD2_CACHE_MAX_MB", "0.5")
+    assert cache.mermaid_cache().max_bytes == 512 * 1024
+
+
+def test_conversions_mount_mermaid_cache(monkeypatch, tmp_path, fake_runtime):
+    f = tmp_path / "a.md"
+    f.write_text("# A\n\n```mermaid\ngraph TD; A-->B\n```\n")
+    cmds = []
+
+    def run(cmd, check=False, **k):
+        cmds.append(cmd)
+
+        class R:
+            returncode = 0
+
+        return R()
+
+    monkeypatch.setattr(conv.subprocess, "run", run)
+
+    conv.md2html([f])
+    conv.md2docx([f])
+
+    for cmd in cmds:
+        assert f"{rt.cache_dir('mermaid')}:/cache/mermaid" in cmd
+        assert "MD2_MERMAID_CACHE=/cache/mermaid" in cmd
@@ -284,3 +284,217 @@ def test_html2pdf_no_page_numbers(monkeypatch, tmp_path):
 
     # Final result should be the expected PDF name
     assert result[0].name == "test.pdf"
+
+
+def test_html2pdf_toc_json_sets_environment(monkeypatch, tmp_path):
+    f = tmp_path / "test.html"
+    f.write_text("<html><body><h1>Test</h1></body></html>")
+    rec = Recorder()
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+    monkeypatch.setattr(rt, "ensure_image", lambda runtime, root: None)
+    monkeypatch.setattr(rt, "get_container_runtime", lambda: "docker")
+
+    conv.html2pdf([f], toc_json=True)
+    assert "MD2_TOC_JSON=1" in rec.cmds[0]
+
+    rec.cmds.clear()
+    conv.html2pdf([f])
+    assert not any("MD2_TOC_JSON" in str(a) for a in rec.cmds[0])
+
+
+def test_md2html_prerender_math_mounts_cache(monkeypatch, tmp_path):
+    f = tmp_path / "m.md"
+    f.write_text("# M\n\n$x^2$\n")
+    rec = Recorder()
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+    monkeypatch.setattr(rt, "ensure_image", lambda runtime, root: None)
+    monkeypatch.setattr(rt, "get_container_runtime", lambda: "docker")
+
+    conv.md2html([f], prerender_math=True)
+
+    cmd = rec.cmds[0]
+    assert f"{rt.cache_dir('math')}:/cache/math" in cmd
+    assert "MD2_PRERENDER_MATH=1" in cmd
+    assert "MD2_MATH_CACHE=/cache/math" in cmd
+
+
+def test_main_md2pdf_parses_prerender_math(monkeypatch, tmp_path):
+    f = tmp_path / "m.md"
+    f.write_text("# M")
+    calls = []
+    monkeypatch.setattr(cli, "md2pdf", lambda *args, **kwargs: calls.append(kwargs))
+
+    cli.main_md2pdf(["--prerender-math", str(f)])
+
+    assert calls[0]["prerender_math"] is True
+
+
+def test_html2pdf_optimize_pdf_sets_environment(monkeypatch, tmp_path):
+    f = tmp_path / "test.html"
+    f.write_text("<html><body><h1>Test</h1></body></html>")
+    rec = Recorder()
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+    monkeypatch.setattr(rt, "ensure_image", lambda runtime, root: None)
+    monkeypatch.setattr(rt, "get_container_runtime", lambda: "docker")
+
+    conv.html2pdf([f], optimize_pdf="web")
+    assert "MD2_OPTIMIZE_PDF=web" in rec.cmds[0]
+
+    with pytest.raises(ValueError):
+        conv.html2pdf([f], optimize_pdf="tiny")
+
+
+def test_main_html2pdf_parses_optimize_pdf(monkeypatch, tmp_path, capsys):
+    f = tmp_path / "a.html"
+    f.write_text("<html></html>")
+    calls = []
+    monkeypatch.setattr(cli, "html2pdf", lambda *args, **kwargs: calls.append(kwargs))
+
+    cli.main_html2pdf([str(f)])
+    cli.main_html2pdf(["--optimize-pdf", str(f)])
+    cli.main_html2pdf(["--optimize-pdf=basic", "--toc-json", str(f)])
+
+    assert [c["optimize_pdf"] for c in calls] == [None, "max", "basic"]
+    assert calls[2]["toc_json"] is True
+    with pytest.raises(SystemExit):
+        cli.main_html2pdf(["--optimize-pdf=tiny", str(f)])
+    assert "--optimize-pdf expects" in capsys.readouterr().err
+
+
+def test_md2html_assets_dir_mounts_shared_directory(monkeypatch, tmp_path):
+    f = tmp_path / "docs" / "a.md"
+    f.parent.mkdir()
+    f.write_text("# A")
+    rec = Recorder()
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+    monkeypatch.setattr(rt, "ensure_image", lambda runtime, root: None)
+    monkeypatch.setattr(rt, "get_container_runtime", lambda: "docker")
+
+    conv.md2html([f], assets_dir=tmp_path / "_assets", self_contained=True)
+
+    cmd = rec.cmds[0]
+    assert (tmp_path / "_assets").is_dir()
+    assert f"{tmp_path / '_assets'}:/assets" in cmd
+    assert "--assets-dir=/assets" in cmd
+    assert "--assets-url=../_assets" in cmd
+    assert "INTERNAL_RESOURCES=0" in cmd
+
+
+def test_main_md2html_parses_assets_dir(monkeypatch, tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    f = tmp_path / "a" / "x.md"
+    g = tmp_path / "b" / "y.md"
+    f.write_text("# X")
+    g.write_text("# Y")
+    calls = []
+    monkeypatch.setattr(cli, "md2html", lambda *args, **kwargs: calls.append(kwargs))
+
+    cli.main_md2html(["--assets-dir", str(f), str(g)])
+    cli.main_md2html(["--assets-dir=out/_a", str(f)])
+
+    assert calls[0]["assets_dir"] == str(tmp_path / "_assets")
+    assert calls[1]["assets_dir"] == "out/_a"
+
+
+def test_md2html_client_mermaid_requires_linked_html(monkeypatch, tmp_path):
+    f = tmp_path / "a.md"
+    f.write_text("# A")
+    rec = Recorder()
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+    monkeypatch.setattr(rt, "ensure_image", lambda runtime, root: None)
+    monkeypatch.setattr(rt, "get_container_runtime", lambda: "docker")
+
+    conv.md2html([f], mermaid="client", self_contained=False)
+    conv.md2html([f], mermaid="client", self_contained=True)
+    conv.md2html([f], mermaid="client", assets_dir=tmp_path / "_assets")
+
+    assert ["--mermaid=client" in cmd for cmd in rec.cmds] == [True, False, True]
+    with pytest.raises(ValueError, match="mermaid"):
+        conv.md2html([f], mermaid="browser")
+
+
+def test_main_md2html_parses_mermaid_mode(monkeypatch, tmp_path, capsys):
+    f = tmp_path / "x.md"
+    f.write_text("# X")
+    calls = []
+    monkeypatch.setattr(cli, "md2html", lambda *args, **kwargs: calls.append(kwargs))
+
+    cli.main_md2html([str(f)])
+    cli.main_md2html(["--mermaid=client", str(f)])
+
+    assert [(c["mermaid"], c["self_contained"]) for c in calls] == [("server", True), ("client", False)]
+    with pytest.raises(SystemExit):
+        cli.main_md2html(["--mermaid=browser", str(f)])
+    assert "Invalid --mermaid mode" in capsys.readouterr().err
+
+
+def test_image_mounts_cover_nested_directories_once(tmp_path):
+    images = {
+        tmp_path / "assets" / "a.png",
+        tmp_path / "assets" / "icons" / "b.png",
+        tmp_path / "other" / "c.png",
+    }
+
+    mounts = conv.image_mounts(images)
+
+    assert [(h, ro) for h, _, ro in mounts] == [(tmp_path / "assets", True), (tmp_path / "other", True)]
+    assert all(c.startswith("/images/") for _, c, _ in mounts)
+    assert conv.image_mounts(images) == mounts  # stable container paths
+
+
+def test_mount_images_rewrites_references_without_copying(monkeypatch, tmp_path):
+    assets = tmp_path / "assets" / "img"
+    assets.mkdir(parents=True)
+    (assets / "logo.png").write_bytes(b"PNG")
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    f = docs / "a.md"
+    f.write_text(f'# A\n\n![logo](../assets/img/logo.png)\n\n<img src="{assets / "logo.png"}" />\n')
+
+    (html_job,) = conv._plan_md2html("docker", [f], ["--toc"], mount_images=True)
+    (docx_job,) = conv._plan_md2docx([f], ["--toc"], runtime="docker", mount_images=True)
+
+    for job in (html_job, docx_job):
+        (mount,) = [m for m in job.mounts if m[1].startswith("/images/")]
+        assert mount[0] == assets and mount[2] is True
+        (temp,) = job.cleanup
+        text = temp.read_text(encoding="utf-8")
+        assert f"![logo]({mount[1]}/logo.png)" in text
+        assert f'<img src="{mount[1]}/logo.png" />' in text
+        assert job.inner[2] == f"/work/{temp.name}"
+        job.remove_temp_files()
+    assert sorted(p.name for p in docs.iterdir()) == ["a.md"]
+
+    (native_job,) = conv._plan_md2html(conv.native.NATIVE, [f], ["--toc"], mount_images=True)
+    assert native_job.cleanup == [] and native_job.inner[2] == "/work/a.md"
+
+
+def test_image_rewrites_skip_fenced_code(tmp_path):
+    (tmp_path / "img").mkdir()
+    content = (
+        "![a](img/a.png)\n\n```markdown\n![a](img/a.png) <img src=\"img/a.png\">\n```\n\n"
+        '<img src="img/a.png">\n'
+    )
+
+    out = conv.rewrite_image_paths(content, tmp_path, [(tmp_path / "img", "/images/0", True)])
+
+    assert out == (
+        "![a](/images/0/a.png)\n\n```markdown\n![a](img/a.png) <img src=\"img/a.png\">\n```\n\n"
+        '<img src="/images/0/a.png">\n'
+    )
+
+
+def test_main_parses_mount_images(monkeypatch, tmp_path):
+    f = tmp_path / "x.md"
+    f.write_text("# X")
+    calls = []
+    for name in ("md2html", "md2pdf", "md2docx"):
+        monkeypatch.setattr(cli, name, lambda *args, **kwargs: calls.append(kwargs))
+
+    cli.main_md2html(["--mount-images", str(f)])
+    cli.main_md2pdf(["--mount-images", "--offline", str(f)])
+    cli.main_md2docx(["--offline", str(f)])
+
+    assert [c["mount_images"] for c in calls] == [True, True, False]
+    assert [c["offline"] for c in calls] == [False, True, True]
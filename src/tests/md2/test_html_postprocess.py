@@ -0,0 +1,211 @@
+from pathlib import Path
+import importlib.util
+import time
+
+
+def _load_postprocess():
+    path = Path(__file__).resolve().parents[2] / "md2" / "scripts" / "html_postprocess.py"
+    spec = importlib.util.spec_from_file_location("html_postprocess", str(path))
+    mod = importlib.util.module_from_spec(spec)  # type: ignore[arg-type]
+    assert spec and spec.loader
+    spec.loader.exec_module(mod)  # type: ignore[assignment]
+    return mod
+
+
+# Shaped like pandoc's html5 output with --standalone --toc --section-divs
+PANDOC_HTML = """<!DOCTYPE html>
+<html>
+<head>
+  <title>doc</title>
+  <link rel="stylesheet" href="default.css" />
+  <script src="/mathjax/tex-svg-full.js" type="text/javascript"></script>
+</head>
+<body>
+<nav id="TOC" role="doc-toc">
+<ul>
+<li><a href="#title" id="toc-title">Title</a>
+<ul>
+<li><a href="#intro" id="toc-intro">Intro</a></li>
+<li><a href="#usage" id="toc-usage">Usage</a></li>
+</ul></li>
+</ul>
+</nav>
+<section id="title" class="level1">
+<h1>Title</h1>
+<p>Lead paragraph.</p>
+<section id="intro" class="level2">
+<h2>Intro</h2>
+<p>Text.</p>
+</section>
+<section id="usage" class="level2">
+<h2>Usage</h2>
+</section>
+</section>
+</body>
+</html>
+"""
+
+
+def test_toc_is_flattened_moved_and_linked_back():
+    mod = _load_postprocess()
+    out = mod.postprocess(PANDOC_HTML, mod.PostprocessOptions(toc=True))
+
+    toc = out[out.index('<nav id="TOC"') : out.index("</nav>")]
+    # The H1 entry is gone, its children are the top level
+    assert "toc-title" not in toc
+    assert toc.count("<ul>") == 1
+    # After the H1 and its lead paragraph, before the first H2
+    assert out.index("</h1>") < out.index('<nav id="TOC"') < out.index("<h2>Intro")
+    assert out.index("Lead paragraph") < out.index('<nav id="TOC"')
+    assert out.count('class="toc-back"') == 2
+    assert "<h1>Title</h1>" in out
+
+
+def test_backlinks_are_not_added_twice():
+    mod = _load_postprocess()
+    options = mod.PostprocessOptions(toc=True)
+    once = mod.postprocess(PANDOC_HTML, options)
+    assert mod.add_toc_backlinks(once) == once
+
+
+def test_inline_css_replaces_link():
+    mod = _load_postprocess()
+    options = mod.PostprocessOptions(inline_css="body { color: red; }", css_name="default.css")
+    out = mod.postprocess(PANDOC_HTML, options)
+    assert '<link rel="stylesheet"' not in out
+    assert '  <style type="text/css">\nbody { color: red; }\n  </style>\n</head>' in out
+
+
+def test_body_classes_src_rewrite_and_placeholders():
+    mod = _load_postprocess()
+    options = mod.PostprocessOptions(
+        body_classes=["no-toc"],
+        replace_src={"/mathjax/tex-svg-full.js": "tex-svg-full.js"},
+        toc_placeholders=True,
+    )
+    out = mod.postprocess(PANDOC_HTML, options)
+    assert '<body class="no-toc toc-page-numbers">' in out
+    assert 'src="tex-svg-full.js"' in out
+    assert 'id="toc-intro" data-toc-placeholder="P#0002"' in out
+    assert 'id="toc-usage" data-toc-placeholder="P#0003"' in out
+
+
+def test_without_toc_nothing_moves():
+    mod = _load_postprocess()
+    html = "<html><body><h1>T</h1><h2>A</h2></body></html>"
+    assert mod.postprocess(html, mod.PostprocessOptions(toc=True)) == html
+
+
+def test_file_written_once_only_when_changed(tmp_path):
+    mod = _load_postprocess()
+    f = tmp_path / "doc.html"
+    f.write_text(PANDOC_HTML, encoding="utf-8")
+    assert mod.main([str(f), "--toc", "--body-class=x"]) == 0
+    text = f.read_text(encoding="utf-8")
+    assert '<body class="x">' in text and "toc-back" in text
+    assert not mod.postprocess_file(f, mod.PostprocessOptions())
+
+
+def test_legacy_placeholder_cli(tmp_path):
+    mod = _load_postprocess()
+    f = tmp_path / "doc.html"
+    f.write_text(PANDOC_HTML, encoding="utf-8")
+    assert mod.main([str(f), "false"]) == 0
+    assert f.read_text(encoding="utf-8") == PANDOC_HTML
+    assert mod.main([str(f), "true"]) == 0
+    assert "P#0001" in f.read_text(encoding="utf-8")
+
+
+def test_large_document_scales_linearly():
+    mod = _load_postprocess()
+    section = '<section id="s{0}" class="level2">\n<h2>Section {0}</h2>\n<p>{1}</p>\n</section>\n'
+    filler = "word " * 40
+
+    def run(n):
+        body = "".join(section.format(i, filler) for i in range(n))
+        html = PANDOC_HTML.replace("</section>\n</body>", body + "</section>\n</body>")
+        start = time.perf_counter()
+        out = mod.postprocess(html, mod.PostprocessOptions(toc=True, toc_placeholders=True))
+        assert out.count('class="toc-back"') == n + 2
+        return len(html), time.perf_counter() - start
+
+    size, elapsed = run(16000)  # a few MB
+    assert size > 3_000_000
+    small_size, small_elapsed = run(1600)
+    # Generous bound: quadratic behaviour would be ~100x slower
+    assert elapsed < max(0.5, small_elapsed * 30)
+
+
+def test_shared_assets_are_written_once_and_linked_relatively(tmp_path):
+    mod = _load_postprocess()
+    styles = tmp_path / "styles"
+    styles.mkdir()
+    (styles / "default.css").write_text("body {}", encoding="utf-8")
+    mathjax = tmp_path / "mathjax.js"
+    mathjax.write_text("/* mathjax */", encoding="utf-8")
+    assets = tmp_path / "site" / "_assets"
+
+    page = (
+        '<html><head><link rel="stylesheet" href="default.css" />\n'
+        f'<script src="{mathjax}"></script></head><body>\n'
+        '<img src="img/logo.png" alt="" /><img src="https://example.com/x.png" />\n'
+        '<svg id="m" class="flowchart mermaid-svg" style="width:80%;"><g><svg></svg></g></svg>\n'
+        "</body></html>\n"
+    )
+    pages = []
+    for sub in ("a", "b/c"):
+        d = tmp_path / "site" / sub
+        (d / "img").mkdir(parents=True)
+        (d / "img" / "logo.png").write_bytes(b"PNG")
+        f = d / "index.html"
+        f.write_text(page, encoding="utf-8")
+        pages.append(f)
+
+    assert mod.main([str(p) for p in pages] + [f"--assets-dir={assets}", f"--asset-path={styles}"]) == 0
+
+    files = sorted(p.name for p in assets.iterdir())
+    assert len(files) == 4  # css, js, png, svg: one copy each
+    css = next(n for n in files if n.startswith("default."))
+    svg = next(n for n in files if n.startswith("mermaid."))
+    assert (assets / svg).read_text(encoding="utf-8").startswith('<svg xmlns="http://www.w3.org/2000/svg"')
+
+    a = pages[0].read_text(encoding="utf-8")
+    assert f'href="../_assets/{css}"' in a
+    assert 'src="https://example.com/x.png"' in a
+    assert f'<img class="mermaid-svg" src="../_assets/{svg}" style="width:80%;"' in a
+    assert "<svg" not in a
+    c = pages[1].read_text(encoding="utf-8")
+    assert f'href="../../_assets/{css}"' in c
+
+
+def test_lazy_mermaid_keeps_sources_and_loads_runtime_once(tmp_path):
+    mod = _load_postprocess()
+    page = (
+        "<html><body>\n"
+        '<pre class="mermaid"><code>graph TD\n  A --&gt; B</code></pre>\n'
+        '<pre class="python"><code>print(1)</code></pre>\n'
+        '<pre class="mermaid"><code>pie\n  "x" : 1</code></pre>\n'
+        "</body></html>\n"
+    )
+
+    html = mod.postprocess(page, mod.PostprocessOptions(mermaid_runtime="mermaid.min.js"))
+
+    assert '<pre class="mermaid">graph TD\n  A --&gt; B</pre>' in html
+    assert '<pre class="python"><code>print(1)</code></pre>' in html
+    assert html.count("script.src = ") == 1
+    assert '"mermaid.min.js"' in html
+    assert html.index("script.src = ") < html.index("</body>")
+    # Pages without diagrams load nothing
+    assert mod.lazy_mermaid(PANDOC_HTML, "mermaid.min.js") == PANDOC_HTML
+
+    runtime = tmp_path / "mermaid.min.js"
+    runtime.write_text("/* mermaid */", encoding="utf-8")
+    shared = mod.postprocess(
+        page,
+        mod.PostprocessOptions(
+            mermaid_runtime=str(runtime), assets_dir=tmp_path / "_assets", assets_url="../_assets"
+        ),
+    )
+    (name,) = [p.name for p in (tmp_path / "_assets").iterdir()]
+    assert name.startswith("mermaid.min.") and name.endswith(".js")
+    assert f'"../_assets/{name}"' in shared
@@ -0,0 +1,194 @@
+import asyncio
+import os
+import subprocess
+from pathlib import Path
+
+import pytest
+
+import md2.aio as aio
+import md2.cli as cli
+import md2.conversion as conv
+import md2.manifest as manifest
+import md2.runtime as rt
+
+
+class Converter:
+    """Stands in for the container: writes each job's output."""
+
+    def __init__(self):
+        self.outputs = []
+        self.fail = set()
+
+    def __call__(self, runtime, mounts, env, inner, **kwargs):
+        work = next(h for h, c, _ in mounts if c == "/work")
+        out = work / inner[3][len("/work/") :]
+        if out.name in self.fail:
+            raise subprocess.CalledProcessError(1, inner)
+        out.write_text(f"converted {inner[2]}")
+        self.outputs.append(out.name)
+
+
+@pytest.fixture
+def converter(monkeypatch, fake_runtime):
+    fake = Converter()
+    monkeypatch.setattr(conv, "_run_container", fake)
+    return fake
+
+
+@pytest.fixture
+def docs(tmp_path):
+    (tmp_path / "img").mkdir()
+    (tmp_path / "img" / "logo.png").write_bytes(b"PNG1")
+    (tmp_path / "a.md").write_text("# A\n\n![logo](img/logo.png)\n")
+    (tmp_path / "b.md").write_text("# B\n")
+    return [tmp_path / "a.md", tmp_path / "b.md"]
+
+
+def test_unchanged_outputs_are_skipped(converter, docs, monkeypatch):
+    first = conv.md2html(docs)
+    assert converter.outputs == ["a.html", "b.html"]
+    assert first.summary() == "2 rebuilt, 0 up to date"
+
+    # Nothing changed: no runtime, no conversion
+    monkeypatch.setattr(conv, "prepare_runtime", lambda *a: pytest.fail("nothing to convert"))
+    again = conv.md2html(docs)
+    assert again == first and again.skipped == first
+    assert converter.outputs == ["a.html", "b.html"]
+
+
+def test_changed_dependencies_are_rebuilt(converter, docs, tmp_path):
+    conv.md2html(docs)
+    converter.outputs.clear()
+
+    image = tmp_path / "img" / "logo.png"
+    image.write_bytes(b"PNG2")
+    result = conv.md2html(docs)
+    assert converter.outputs == ["a.html"]
+    assert result.rebuilt == [tmp_path / "a.html"] and result.skipped == [tmp_path / "b.html"]
+
+    # A touched but unmodified file is hashed, not converted
+    stat = docs[1].stat()
+    os.utime(docs[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert conv.md2html(docs).skipped == [tmp_path / "a.html", tmp_path / "b.html"]
+
+    (tmp_path / "b.html").unlink()
+    assert conv.md2html(docs).rebuilt == [tmp_path / "b.html"]
+
+    # Different options, and --force
+    assert len(conv.md2html(docs, title="Other").rebuilt) == 2
+    assert len(conv.md2html(docs, title="Other", force=True).rebuilt) == 2
+    assert converter.outputs == ["a.html", "b.html"] + ["a.html", "b.html"] * 2
+
+
+def test_failed_input_does_not_lose_other_manifests(converter, docs, tmp_path):
+    docs.append(tmp_path / "c.md")
+    docs[2].write_text("# C\n")
+    converter.fail = {"b.html"}
+
+    with pytest.raises(conv.ConversionError) as exc:
+        conv.md2html(docs)
+    assert exc.value.outputs == [tmp_path / "a.html", tmp_path / "c.html"]
+
+    converter.fail = set()
+    converter.outputs.clear()
+    result = conv.md2html(docs)
+    assert converter.outputs == ["b.html"]
+    assert result.skipped == [tmp_path / "a.html", tmp_path / "c.html"]
+
+
+def test_docx_reference_doc_and_pdf_options(converter, docs, tmp_path):
+    ref = tmp_path / "ref.docx"
+    ref.write_bytes(b"v1")
+    conv.md2docx(docs, reference_doc=ref)
+    assert conv.md2docx(docs, reference_doc=ref).rebuilt == []
+    ref.write_bytes(b"v2")
+    assert len(conv.md2docx(docs, reference_doc=ref).rebuilt) == 2
+
+    conv.md2pdf(docs[:1])
+    converter.outputs.clear()
+    # Only a PDF option changed: the HTML is reused
+    result = conv.md2pdf(docs[:1], page_numbers=False)
+    assert converter.outputs == ["a.pdf"]
+    assert result == [tmp_path / "a.pdf"]
+
+
+def test_cli_force_and_summary(converter, docs, capsys):
+    cli.main_md2html([str(d) for d in docs])
+    assert "md2html: 2 rebuilt, 0 up to date" in capsys.readouterr().err
+    cli.main_md2html([str(d) for d in docs])
+    assert "md2html: 0 rebuilt, 2 up to date" in capsys.readouterr().err
+    cli.main_md2html(["--force", str(docs[0])])
+    assert "md2html: 1 rebuilt, 0 up to date" in capsys.readouterr().err
+
+
+def _fake_exec(monkeypatch, converter):
+    class Process:
+        returncode = 0
+
+        def __init__(self, cmd):
+            work = next(a.split(":")[0] for a in cmd if a.endswith(":/work"))
+            script = next(i for i, a in enumerate(cmd) if a.endswith(".sh"))
+            out = Path(work) / cmd[script + 2][len("/work/") :]
+            out.write_text("converted")
+            converter.outputs.append(out.name)
+
+        async def communicate(self):
+            return b"", None
+
+    async def exec_(*cmd, **kwargs):
+        return Process(cmd)
+
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", exec_)
+
+
+def test_async_api_shares_manifests(converter, docs, tmp_path, monkeypatch):
+    _fake_exec(monkeypatch, converter)
+    conv.md2html(docs)
+    docs[1].write_text("# B changed\n")
+
+    result = asyncio.run(aio.md2html(docs))
+
+    assert result == [tmp_path / "a.html", tmp_path / "b.html"]
+    assert result.skipped == [tmp_path / "a.html"] and result.rebuilt == [tmp_path / "b.html"]
+    assert converter.outputs == ["a.html", "b.html", "b.html"]
+    # The async run recorded its manifest: the blocking API skips both
+    assert conv.md2html(docs).rebuilt == []
+
+
+def test_async_md2pdf_reuses_and_records_html(converter, docs, tmp_path, monkeypatch):
+    _fake_exec(monkeypatch, converter)
+    conv.md2html(docs[:1])
+
+    result = asyncio.run(aio.md2pdf(docs))
+
+    assert result == [tmp_path / "a.pdf", tmp_path / "b.pdf"]
+    assert sorted(converter.outputs) == ["a.html", "a.pdf", "b.html", "b.pdf"]
+    assert conv.md2html(docs).rebuilt == []
+
+
+def test_corrupt_manifest_means_rebuild(converter, docs, tmp_path):
+    conv.md2html(docs)
+    for path in rt.cache_dir("manifests").rglob("*.json"):
+        manifest = rt.load_json(path)
+        manifest["dependencies"] = {str(docs[0]): [1, 2]}
+        rt.save_json(path, manifest)
+    converter.outputs.clear()
+
+    assert len(conv.md2html(docs).rebuilt) == 2
+    assert conv.md2html(docs).rebuilt == []
+
+
+def test_stale_inputs_are_read_once(converter, docs, monkeypatch):
+    reads = []
+    real = manifest.analyze_markdown
+
+    def counting(path):
+        reads.append(Path(path).name)
+        return real(path)
+
+    monkeypatch.setattr(manifest, "analyze_markdown", counting)
+    monkeypatch.setattr(conv, "analyze_markdown", counting)
+
+    conv.md2html(docs)
+    conv.md2docx(docs)
+    assert reads == ["a.md", "b.md"] * 2
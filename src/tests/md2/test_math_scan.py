@@ -0,0 +1,42 @@
+from pathlib import Path
+import importlib.util
+
+
+def _load_math_scan():
+    path = Path(__file__).resolve().parents[2] / "md2" / "scripts" / "math_scan.py"
+    spec = importlib.util.spec_from_file_location("math_scan", str(path))
+    mod = importlib.util.module_from_spec(spec)  # type: ignore[arg-type]
+    assert spec and spec.loader
+    spec.loader.exec_module(mod)  # type: ignore[assignment]
+    return mod
+
+
+def test_plain_text_needs_no_mathjax():
+    mod = _load_math_scan()
+    assert mod.math_level("# Title\n\nJust text.\n") == "none"
+
+
+def test_math_in_code_is_ignored():
+    mod = _load_math_scan()
+    src = "Run `echo $HOME`.\n\n```sh\nexport A=$B\n```\n\n~~~\n\\(x\\)\n~~~\n"
+    assert mod.math_level(src) == "none"
+
+
+def test_basic_math_uses_small_bundle():
+    mod = _load_math_scan()
+    assert mod.math_level("Euler: $e^{i\\pi} + 1 = 0$\n") == "tex"
+    assert mod.math_level("$$\\begin{aligned} a &= b \\end{aligned}$$") == "tex"
+
+
+def test_autoloaded_macros_use_full_bundle():
+    mod = _load_math_scan()
+    assert mod.math_level("$\\color{red}{x}$") == "full"
+    assert mod.math_level("$\\ce{H2O}$") == "full"
+    assert mod.math_level("$\\cancel{x}$ and $\\xrightarrow{f}$") == "full"
+    assert mod.math_level("$\\colorful$") == "tex"
+
+
+def test_unmatched_backtick_does_not_hide_math():
+    mod = _load_math_scan()
+    src = "Type a ` to start code.\n\nEnergy: $E = mc^2$\n\nAnother ` appears here.\n"
+    assert mod.math_level(src) == "tex"
@@ -0,0 +1,73 @@
+from pathlib import Path
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+SCRIPT = Path(__file__).resolve().parents[2] / "md2" / "scripts" / "mermaid_batch.js"
+
+# Stands in for mermaid-cli: renderMermaid() echoes its arguments, fails on
+# diagrams containing "bad"; the puppeteer stub logs every browser launch.
+FAKE_INDEX = """
+export async function renderMermaid(browser, code, format, opts) {
+    if (code.includes('bad')) throw new Error('Parse error on line 1\\ndetails');
+    const svg = `<svg data-format="${format}" data-scale="${opts.viewport.deviceScaleFactor}" ` +
+        `data-theme="${opts.mermaidConfig.theme}">${code}</svg>`;
+    return { data: new TextEncoder().encode(svg) };
+}
+"""
+FAKE_PUPPETEER = """
+const fs = require('fs');
+module.exports = {
+    launch: async (options) => {
+        fs.appendFileSync(process.env.FAKE_LAUNCH_LOG, JSON.stringify(options) + '\\n');
+        return { close: async () => {} };
+    }
+};
+"""
+
+
+@pytest.fixture
+def fake_cli(tmp_path):
+    cli = tmp_path / "mermaid-cli"
+    (cli / "src").mkdir(parents=True)
+    (cli / "node_modules" / "puppeteer").mkdir(parents=True)
+    (cli / "package.json").write_text(
+        json.dumps({"type": "module", "exports": {".": "./src/index.js"}})
+    )
+    (cli / "src" / "index.js").write_text(FAKE_INDEX)
+    (cli / "node_modules" / "puppeteer" / "package.json").write_text('{"main": "index.js"}')
+    (cli / "node_modules" / "puppeteer" / "index.js").write_text(FAKE_PUPPETEER)
+    return cli
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+def test_diagrams_render_in_one_browser(tmp_path, fake_cli):
+    config = tmp_path / "puppeteer.json"
+    config.write_text('{"args": ["--no-sandbox"]}')
+    log = tmp_path / "launches.log"
+    jobs = [
+        {"code": f"graph TD; A{i}-->B", "output": str(tmp_path / "c" / f"d{i}.svg"),
+         "format": "svg", "scale": "6", "theme": "dark"}
+        for i in range(5)
+    ]
+    jobs.insert(2, {"code": "bad", "output": str(tmp_path / "bad.png"), "format": "png",
+                    "scale": "5.5", "theme": "default"})
+    env = dict(os.environ, MD2_MERMAID_CLI=str(fake_cli), MD2_PUPPETEER_CONFIG=str(config),
+               FAKE_LAUNCH_LOG=str(log))
+
+    r = subprocess.run(
+        ["node", str(SCRIPT), "--concurrency=3"],
+        input=json.dumps(jobs), capture_output=True, text=True, env=env, check=True,
+    )
+
+    lines = r.stdout.splitlines()
+    assert lines[2] == "error Parse error on line 1"
+    assert [l for i, l in enumerate(lines) if i != 2] == ["ok"] * 5
+    assert log.read_text().splitlines() == ['{"headless":true,"args":["--no-sandbox"]}']
+    svg = (tmp_path / "c" / "d4.svg").read_text()
+    assert svg == '<svg data-format="svg" data-scale="6" data-theme="dark">graph TD; A4-->B</svg>'
+    assert not (tmp_path / "bad.png").exists()
+    assert not list((tmp_path / "c").glob("*.tmp"))
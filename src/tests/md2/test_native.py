@@ -0,0 +1,139 @@
+from pathlib import Path
+
+import pytest
+import md2.conversion as conv
+import md2.native as native
+import md2.runtime as rt
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, cmd, check=False, **k):
+        self.calls.append((cmd, k))
+
+        class R:
+            returncode = 0
+            stdout = ""
+
+        return R()
+
+
+@pytest.fixture
+def fake_tools(monkeypatch, tmp_path):
+    tools = native.Tools(
+        pandoc="/usr/bin/pandoc",
+        pandoc_version=(3, 8),
+        bash="/bin/bash",
+        python="/usr/bin/python3",
+        node="/usr/bin/node",
+        mermaid_bin=None,
+        app_dir=tmp_path / "app",
+        mathjax_js="/opt/mathjax/tex-svg-full.js",
+    )
+    monkeypatch.setattr(native, "discover", lambda: tools)
+    monkeypatch.setattr(native, "check_pdf_tools", lambda tools: None)
+
+    def no_container(*a, **k):
+        raise AssertionError("container backend used")
+
+    monkeypatch.setattr(rt, "ensure_image", no_container)
+    monkeypatch.setattr(rt, "get_container_runtime", no_container)
+    return tools
+
+
+def test_resolve_backend(monkeypatch):
+    monkeypatch.delenv("MD2_BACKEND", raising=False)
+    assert native.resolve_backend() == "container"
+    monkeypatch.setenv("MD2_BACKEND", "native")
+    assert native.resolve_backend() == "native"
+    assert native.resolve_backend("container") == "container"
+    with pytest.raises(ValueError):
+        native.resolve_backend("vm")
+
+
+def test_to_host_translates_paths_and_options():
+    mounts = [("/home/u/docs", "/work", False), ("/home/u/css", "/custom-styles", True)]
+    assert native.to_host("/work/a.md", mounts) == "/home/u/docs/a.md"
+    assert native.to_host("/custom-styles/x.css", mounts) == "/home/u/css/x.css"
+    assert native.to_host("--reference-doc=/work/ref.docx", mounts) == (
+        "--reference-doc=/home/u/docs/ref.docx"
+    )
+    assert native.to_host("/workspace/a.md", mounts) == "/workspace/a.md"
+    assert native.to_host("--html-title=Notes", mounts) == "--html-title=Notes"
+
+
+def test_md2html_runs_scripts_on_host(monkeypatch, tmp_path, fake_tools):
+    src = tmp_path / "a.md"
+    src.write_text("# A")
+    rec = Recorder()
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+
+    out = conv.md2html([src], backend="native", batch=True)
+
+    assert out == [tmp_path / "a.html"]
+    (cmd, kwargs), = rec.calls
+    assert cmd[:4] == [
+        "bash",
+        str(rt.PROJECT_ROOT / "scripts" / "md2html.sh"),
+        str(src),
+        str(tmp_path / "a.html"),
+    ]
+    assert cmd[4] == str(rt.PROJECT_ROOT / "styles" / "default.toc.css")
+    assert kwargs["cwd"] == str(tmp_path)
+    env = kwargs["env"]
+    assert env["MD2_SCRIPTS"] == str(rt.PROJECT_ROOT / "scripts")
+    assert env["MD2_MATHJAX_JS"] == "/opt/mathjax/tex-svg-full.js"
+    assert env["INTERNAL_RESOURCES"] == "1"
+
+
+def test_md2pdf_uses_env_backend(monkeypatch, tmp_path, fake_tools):
+    monkeypatch.setenv("MD2_BACKEND", "native")
+    src = tmp_path / "a.md"
+    src.write_text("# A")
+    rec = Recorder()
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+
+    out = conv.md2pdf([src])
+
+    assert out == [tmp_path / "a.pdf"]
+    pdf_cmd, pdf_kwargs = rec.calls[-1]
+    assert pdf_cmd[1] == str(rt.PROJECT_ROOT / "scripts" / "pdf_generator.sh")
+    assert pdf_kwargs["env"]["MD2_APP"] == str(fake_tools.app_dir)
+
+
+def test_discover_checks_pandoc_version(monkeypatch):
+    monkeypatch.setattr(rt, "_cached_which", lambda name: f"/usr/bin/{name}")
+    monkeypatch.setattr(native, "_pandoc_version", lambda pandoc: (2, 9, 2))
+
+    with pytest.raises(RuntimeError, match="pandoc >= 2.19"):
+        native.discover()
+
+
+def test_html2pdf_batch_prints_on_host(monkeypatch, tmp_path, fake_tools):
+    files = []
+    for name in ("x", "y"):
+        f = tmp_path / f"{name}.html"
+        f.write_text("<html><body></body></html>")
+        files.append(f)
+    seen = {}
+
+    def run(cmd, check=False, **k):
+        tsv = Path(cmd[3])
+        seen["cmd"] = cmd
+        seen["lines"] = tsv.read_text().splitlines()
+        Path(cmd[4]).write_text('[{"ok": true}, {"ok": true}]')
+
+        class R:
+            returncode = 0
+
+        return R()
+
+    monkeypatch.setattr(conv.subprocess, "run", run)
+
+    out = conv.html2pdf(files, batch=True, backend="native")
+
+    assert [p.name for p in out] == ["x.pdf", "y.pdf"]
+    assert seen["cmd"][1] == str(rt.PROJECT_ROOT / "scripts" / "pdf_generator.sh")
+    assert seen["lines"][1] == f"{tmp_path}/y.html\t{tmp_path}/y.pdf\ttrue"
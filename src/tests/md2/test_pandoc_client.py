@@ -0,0 +1,137 @@
+from pathlib import Path
+import importlib.util
+import json
+import os
+import signal
+import sys
+
+
+def _load_client():
+    path = Path(__file__).resolve().parents[2] / "md2" / "scripts" / "pandoc_client.py"
+    spec = importlib.util.spec_from_file_location("pandoc_client", str(path))
+    mod = importlib.util.module_from_spec(spec)  # type: ignore[arg-type]
+    assert spec and spec.loader
+    spec.loader.exec_module(mod)  # type: ignore[assignment]
+    return mod
+
+
+# Stands in for `pandoc server --port N`: answers every conversion with the
+# parameters it received, like pandoc's JSON response.
+FAKE_PANDOC = """#!{python}
+import json, sys
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+class Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        params = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        body = json.dumps({{"output": json.dumps(params), "base64": False,
+                            "messages": [{{"verbosity": "WARNING", "message": "careful"}}]}})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+assert sys.argv[1] == "server"
+HTTPServer(("127.0.0.1", int(sys.argv[3])), Handler).serve_forever()
+"""
+
+
+def _html_args(tmp_path, *extra):
+    src = tmp_path / "in.md"
+    src.write_text("# Title\n\n$x$\n", encoding="utf-8")
+    header = tmp_path / "header.html"
+    header.write_text("<script>cfg</script>\n", encoding="utf-8")
+    return [
+        "-f", "markdown+smart",
+        "-t", "html5",
+        "--standalone",
+        "--section-divs",
+        f"--resource-path={tmp_path}:/work",
+        "--mathjax=/mathjax/tex-svg.js",
+        f"--include-in-header={header}",
+        "--metadata=pagetitle:My Doc",
+        "--css=default.css",
+        "--toc",
+        "--toc-depth=2",
+        *extra,
+        str(src),
+        "-o", str(tmp_path / "out.html"),
+    ]
+
+
+def test_html_arguments_are_translated(tmp_path):
+    mod = _load_client()
+
+    req = mod.build_request(_html_args(tmp_path))
+
+    assert req.output_path == str(tmp_path / "out.html")
+    assert req.params == {
+        "from": "markdown+smart",
+        "to": "html5",
+        "standalone": True,
+        "section-divs": True,
+        "html-math-method": {"method": "mathjax", "url": "/mathjax/tex-svg.js"},
+        "variables": {"header-includes": "<script>cfg</script>\n"},
+        "metadata": {"pagetitle": "My Doc"},
+        "css": ["default.css"],
+        "table-of-contents": True,
+        "toc-depth": 2,
+        "text": "# Title\n\n$x$\n",
+    }
+
+
+def test_unsupported_conversions_use_the_cli(tmp_path):
+    mod = _load_client()
+    assert mod.build_request(_html_args(tmp_path, "--lua-filter=/filters/mermaid.lua")) is None
+    assert mod.build_request(_html_args(tmp_path, "--embed-resources")) is None
+
+    src = tmp_path / "doc.md"
+    out = str(tmp_path / "doc.docx")
+    src.write_text("# Doc\n", encoding="utf-8")
+    assert mod.build_request(["-t", "docx", str(src), "-o", out]).params["to"] == "docx"
+    assert mod.build_request(["-t", "docx", "--reference-doc=/ref/r.docx", str(src), "-o", out]) is None
+    src.write_text("# Doc\n\n![logo](logo.png)\n", encoding="utf-8")
+    assert mod.build_request(["-t", "docx", str(src), "-o", out]) is None
+
+
+def test_server_is_started_once_and_reused(monkeypatch, tmp_path, capsys):
+    mod = _load_client()
+    fake = tmp_path / "pandoc"
+    fake.write_text(FAKE_PANDOC.format(python=sys.executable), encoding="utf-8")
+    fake.chmod(0o755)
+    monkeypatch.setattr(mod, "PANDOC", str(fake))
+    monkeypatch.setattr(mod, "STATE_FILE", tmp_path / "server.json")
+
+    try:
+        assert mod.main(_html_args(tmp_path)) == 0
+        state = json.loads((tmp_path / "server.json").read_text(encoding="utf-8"))
+        assert mod.main(_html_args(tmp_path)) == 0
+        assert json.loads((tmp_path / "server.json").read_text(encoding="utf-8")) == state
+    finally:
+        state = json.loads((tmp_path / "server.json").read_text(encoding="utf-8"))
+        os.kill(state["pid"], signal.SIGTERM)
+
+    out = (tmp_path / "out.html").read_text(encoding="utf-8")
+    assert json.loads(out)["metadata"] == {"pagetitle": "My Doc"}
+    assert "[WARNING] careful" in capsys.readouterr().err
+
+
+def test_server_failure_falls_back_to_cli(monkeypatch, tmp_path, capsys):
+    mod = _load_client()
+    calls = []
+    monkeypatch.setattr(mod.os, "execvp", lambda prog, argv: calls.append(argv))
+
+    def no_server(state_file=None):
+        raise mod.ServerError("pandoc server did not start")
+
+    monkeypatch.setattr(mod, "server_port", no_server)
+    args = _html_args(tmp_path)
+    mod.main(args)
+    mod.main(["--lua-filter=/filters/x.lua"] + args)
+
+    assert calls == [["pandoc", *args], ["pandoc", "--lua-filter=/filters/x.lua", *args]]
+    assert "using the pandoc CLI" in capsys.readouterr().err
+
@@ -0,0 +1,123 @@
+import subprocess
+import threading
+import time
+
+import pytest
+import md2.cli as cli
+import md2.conversion as conv
+import md2.runtime as rt
+
+
+class SlowRecorder:
+    """Finishes jobs in reverse order and fails selected inputs."""
+
+    def __init__(self, fail_names=()):
+        self.cmds = []
+        self.fail_names = fail_names
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, cmd, check=False, **k):
+        with self.lock:
+            self.cmds.append(cmd)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        name = next(a for a in cmd if a.startswith("/work/") and a.endswith(".md"))
+        time.sleep(0.05 if name.endswith("a.md") else 0.01)
+        with self.lock:
+            self.active -= 1
+        output = f"converted {name}\n"
+        if any(name.endswith(n) for n in self.fail_names):
+            raise subprocess.CalledProcessError(1, cmd, output=output + "pandoc: boom\n")
+
+        class R:
+            stdout = output
+            returncode = 0
+
+        return R()
+
+
+@pytest.fixture
+def files(tmp_path, fake_runtime):
+    result = []
+    for name in ("a", "b", "c"):
+        f = tmp_path / f"{name}.md"
+        f.write_text(f"# {name}")
+        result.append(f)
+    return result
+
+
+def test_parallel_results_and_logs_keep_input_order(monkeypatch, files, capsys):
+    rec = SlowRecorder()
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+
+    out = conv.md2html(files, jobs=3)
+
+    assert [p.name for p in out] == ["a.html", "b.html", "c.html"]
+    assert rec.max_active > 1
+    logs = capsys.readouterr().out.splitlines()
+    assert [l.rsplit("/", 1)[1] for l in logs] == ["a.md", "b.md", "c.md"]
+
+
+def test_parallel_failures_are_collected(monkeypatch, files):
+    rec = SlowRecorder(fail_names=("a.md", "c.md"))
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+
+    with pytest.raises(conv.ConversionError) as exc:
+        conv.md2docx(files, jobs=2)
+
+    assert list(exc.value.failures) == [files[0], files[2]]
+    assert exc.value.failures[files[0]] == "converted /work/a.md | pandoc: boom"
+    assert [p.name for p in exc.value.outputs] == ["b.docx"]
+
+
+def test_sequential_failures_are_collected(monkeypatch, files):
+    rec = SlowRecorder(fail_names=("b.md",))
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+
+    with pytest.raises(conv.ConversionError) as exc:
+        conv.md2docx(files)
+
+    assert len(rec.cmds) == 3  # c.md is still converted
+    assert list(exc.value.failures) == [files[1]]
+    assert [p.name for p in exc.value.outputs] == ["a.docx", "c.docx"]
+
+
+def test_resolve_jobs():
+    assert conv.resolve_jobs(None) == 1
+    assert conv.resolve_jobs(4) == 4
+    assert conv.resolve_jobs("2") == 2
+    with pytest.raises(ValueError):
+        conv.resolve_jobs(0)
+    with pytest.raises(ValueError):
+        conv.resolve_jobs("many")
+
+
+def test_auto_jobs_is_capped_by_memory(monkeypatch):
+    monkeypatch.setattr(rt.os, "sched_getaffinity", lambda pid: set(range(32)), raising=False)
+    monkeypatch.setattr(rt, "available_memory", lambda: 4 * rt.JOB_MEMORY_BYTES + 1)
+    assert conv.resolve_jobs("auto") == 4
+    monkeypatch.setattr(rt, "available_memory", lambda: 0)
+    assert conv.resolve_jobs("auto") == 1
+    monkeypatch.setattr(rt, "available_memory", lambda: None)
+    assert conv.resolve_jobs("auto") == 32
+
+
+def test_main_md2pdf_parses_jobs(monkeypatch, tmp_path):
+    f = tmp_path / "doc.md"
+    f.write_text("# Doc")
+    calls = []
+    monkeypatch.setattr(cli, "md2pdf", lambda *args, **kwargs: calls.append(kwargs))
+
+    cli.main_md2pdf(["--jobs", "auto", str(f)])
+    cli.main_md2pdf(["-j", "3", str(f)])
+    cli.main_md2pdf(["--jobs=2", str(f)])
+
+    assert [c["jobs"] for c in calls] == ["auto", 3, 2]
+
+
+def test_main_html2pdf_rejects_bad_jobs(monkeypatch, tmp_path):
+    monkeypatch.setattr(cli, "html2pdf", lambda *args, **kwargs: None)
+    with pytest.raises(SystemExit):
+        cli.main_html2pdf(["--jobs=0", str(tmp_path / "x.html")])
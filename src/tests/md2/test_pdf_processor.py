@@ -0,0 +1,213 @@
+from pathlib import Path
+import importlib.util
+import json
+
+import pytest
+
+fitz = pytest.importorskip("fitz")
+
+
+def _load_pdf_processor():
+    path = Path(__file__).resolve().parents[2] / "md2" / "scripts" / "pdf_processor.py"
+    spec = importlib.util.spec_from_file_location("pdf_processor", str(path))
+    mod = importlib.util.module_from_spec(spec)  # type: ignore[arg-type]
+    assert spec and spec.loader
+    spec.loader.exec_module(mod)  # type: ignore[assignment]
+    return mod
+
+
+TOC = [
+    ("1 Introduction", "P#0001"),
+    ("2 Methods", "P#1000"),
+    ("2.1 Long Results Section", "P#10000"),
+]
+
+
+def _make_pdf(path: Path) -> None:
+    doc = fitz.open()
+    toc = doc.new_page()
+    for i, (title, token) in enumerate(TOC):
+        y = 100 + 20 * i
+        toc.insert_text((72, y), title, fontsize=10)
+        toc.insert_text((400, y), token, fontsize=10)
+    # Introduction on page 2, Methods on page 3, results heading on page 5
+    for body in ("Introduction\nSome text", "Methods\nMore text", "filler", "Long Results\nSection"):
+        doc.new_page().insert_text((72, 100), body, fontsize=12)
+    doc.save(str(path))
+    doc.close()
+
+
+def _toc_numbers(path: Path):
+    doc = fitz.open(str(path))
+    words = doc[0].get_text("words")
+    doc.close()
+    numbers = {}
+    for i, _ in enumerate(TOC):
+        y = 100 + 20 * i
+        numbers[i] = [w[4] for w in words if w[0] > 350 and abs(w[3] - y) < 6 and w[4].isdigit()]
+    return numbers
+
+
+def test_toc_page_numbers_resolved(tmp_path):
+    mod = _load_pdf_processor()
+    src = tmp_path / "in.pdf"
+    out = tmp_path / "out.pdf"
+    _make_pdf(src)
+    before = src.read_bytes()
+
+    mod.apply_toc_page_numbers(src, out)
+
+    assert src.read_bytes() == before
+    # Incremental save: the original bytes are kept and the changes appended
+    assert out.read_bytes().startswith(before)
+    assert _toc_numbers(out) == {0: ["2"], 1: ["3"], 2: ["5"]}
+
+
+def test_toc_page_numbers_in_place(tmp_path):
+    mod = _load_pdf_processor()
+    pdf = tmp_path / "doc.pdf"
+    _make_pdf(pdf)
+    mod.apply_toc_page_numbers(pdf, pdf)
+    assert _toc_numbers(pdf) == {0: ["2"], 1: ["3"], 2: ["5"]}
+
+
+def test_without_placeholders_copies(tmp_path):
+    mod = _load_pdf_processor()
+    src = tmp_path / "in.pdf"
+    out = tmp_path / "out.pdf"
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 100), "No TOC here")
+    doc.save(str(src))
+    doc.close()
+    mod.apply_toc_page_numbers(src, out)
+    assert out.read_bytes() == src.read_bytes()
+
+
+def test_toc_pages_from_link_destinations(tmp_path):
+    mod = _load_pdf_processor()
+    src = tmp_path / "in.pdf"
+    out = tmp_path / "out.pdf"
+    doc = fitz.open()
+    doc.new_page()
+    # Every chapter has an "Overview": text search alone would send all three
+    # entries to the first one
+    for body in ("A\nOverview", "B\nOverview", "filler", "C\nOverview", "Appendix"):
+        doc.new_page().insert_text((72, 100), body, fontsize=12)
+    rows = [("1.1 Overview", "P#0001", 1), ("2.1 Overview", "P#0002", 2),
+            ("3.1 Overview", "P#0003", 4), ("Appendix", "P#0004", None)]
+    toc = doc[0]
+    for i, (title, token, _) in enumerate(rows):
+        toc.insert_text((72, 100 + 20 * i), title, fontsize=10)
+        toc.insert_text((400, 100 + 20 * i), token, fontsize=10)
+    targets = {}
+    for i, (_, _, target) in enumerate(rows):
+        if target is not None:
+            rect = fitz.Rect(70, 90 + 20 * i, 450, 103 + 20 * i)
+            toc.insert_link({"kind": fitz.LINK_GOTO, "from": rect, "page": target})
+            targets[f"sec-{i}"] = target
+    base = tmp_path / "base.pdf"
+    doc.save(str(base))
+    doc.close()
+
+    # Turn the links into links to named destinations, as Chromium writes
+    # them for #anchor hrefs
+    doc = fitz.open(str(base))
+    links = doc[0].get_links()
+    dests = []
+    for link, (name, target) in zip(links, targets.items()):
+        doc.xref_set_key(link["xref"], "A", "null")
+        doc.xref_set_key(link["xref"], "Dest", f"({name})")
+        dests.append(f"({name}) [{doc[target].xref} 0 R /XYZ 0 800 0]")
+    names = doc.get_new_xref()
+    doc.update_object(names, f"<< /Names [{' '.join(dests)}] >>")
+    doc.xref_set_key(doc.pdf_catalog(), "Names", f"<< /Dests {names} 0 R >>")
+    doc.save(str(src))
+    doc.close()
+
+    sidecar = tmp_path / "out.toc.json"
+    mod.apply_toc_page_numbers(src, out, sidecar)
+
+    doc = fitz.open(str(out))
+    words = doc[0].get_text("words")
+    doc.close()
+    numbers = [
+        [w[4] for w in words if w[0] > 350 and abs(w[3] - (100 + 20 * i)) < 6 and w[4].isdigit()]
+        for i in range(len(rows))
+    ]
+    assert numbers == [["2"], ["3"], ["5"], ["6"]]
+
+    data = json.loads(sidecar.read_text(encoding="utf-8"))
+    assert data[0] == {
+        "number": "1.1", "title": "Overview", "anchor": "sec-0", "page": 2, "source": "link"
+    }
+    assert [e["page"] for e in data] == [2, 3, 5, 6]
+    assert data[3]["source"] == "text" and data[3]["anchor"] is None
+
+
+def test_toc_json_path_follows_environment(monkeypatch):
+    mod = _load_pdf_processor()
+    monkeypatch.delenv("MD2_TOC_JSON", raising=False)
+    assert mod.toc_json_path(Path("/work/doc.pdf")) is None
+    monkeypatch.setenv("MD2_TOC_JSON", "1")
+    assert mod.toc_json_path(Path("/work/doc.pdf")) == Path("/work/doc.toc.json")
+
+
+def test_optimize_shrinks_and_keeps_page_numbers(tmp_path, capsys):
+    mod = _load_pdf_processor()
+    src = tmp_path / "in.pdf"
+    out = tmp_path / "out.pdf"
+    _make_pdf(src)
+    # Bloat the input the way an unoptimized save does: uncompressed
+    # streams and an unused object
+    doc = fitz.open(str(src))
+    doc.update_object(doc.get_new_xref(), "<< /Unused true >>")
+    for i in range(50):
+        doc[1].insert_text((72, 150 + 10 * i), "repeated body text " * 8, fontsize=6)
+    bloated = tmp_path / "bloated.pdf"
+    doc.save(str(bloated), expand=255)
+    doc.close()
+
+    mod.process_pdf(bloated, out, True, None, "max")
+
+    assert out.stat().st_size < bloated.stat().st_size
+    assert _toc_numbers(out) == {0: ["2"], 1: ["3"], 2: ["5"]}
+    assert "PDF optimized (max):" in capsys.readouterr().out
+
+
+def test_optimize_without_page_numbers(tmp_path):
+    mod = _load_pdf_processor()
+    src = tmp_path / "in.pdf"
+    out = tmp_path / "out.pdf"
+    _make_pdf(src)
+    for level in ("basic", "web"):
+        mod.process_pdf(src, out, False, None, level)
+        doc = fitz.open(str(out))
+        # Placeholders untouched, document intact
+        assert "P#0001" in doc[0].get_text()
+        assert len(doc) == 5
+        doc.close()
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_optimize_level_validation(monkeypatch):
+    mod = _load_pdf_processor()
+    monkeypatch.delenv("MD2_OPTIMIZE_PDF", raising=False)
+    assert mod.optimize_level() is None
+    assert mod.optimize_level("none") is None
+    monkeypatch.setenv("MD2_OPTIMIZE_PDF", "web")
+    assert mod.optimize_level() == "web"
+    with pytest.raises(ValueError):
+        mod.optimize_level("tiny")
+
+
+def test_text_index_ignores_matches_across_pages():
+    mod = _load_pdf_processor()
+    doc = fitz.open()
+    for body in ("toc", "alpha be", "ta gamma", "beta"):
+        doc.new_page().insert_text((72, 100), body)
+    index = mod.PageTextIndex(doc, 1)
+    assert index.find("beta", 1) == 3
+    assert index.find("gamma", 1) == 2
+    assert index.find("gamma", 3) is None
+    assert index.find("delta", 1) is None
+    doc.close()
@@ -0,0 +1,179 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import socket
+import threading
+import time
+
+import pytest
+
+from md2 import conversion as conv
+from md2 import remote
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """Answers like an image host; records requests and client ports."""
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+    requests: list = []
+    ports: set = set()
+
+    def _reply(self, status, content_type="image/png", location=None, body=b"", etag=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if location:
+            self.send_header("Location", location)
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _handle(self):
+        StandIn.requests.append((self.command, self.path))
+        StandIn.ports.add(self.client_address[1])
+        if self.path.startswith("/img/"):
+            self._reply(200)
+        elif self.path.startswith("/etag/"):
+            if self.headers.get("If-None-Match") == '"v1"':
+                self._reply(304, etag='"v1"')
+            else:
+                self._reply(200, body=b"PNG" + self.path.encode(), etag='"v1"')
+        elif self.path == "/page":
+            self._reply(200, "text/html")
+        elif self.path == "/moved":
+            self._reply(302, location="/img/target.png")
+        elif self.path == "/get-only.png":
+            if self.command == "HEAD":
+                self._reply(405)
+            else:
+                self._reply(206, body=b"P")
+        else:
+            self._reply(404, "text/plain")
+
+    do_HEAD = _handle
+    do_GET = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    StandIn.requests = []
+    StandIn.ports = set()
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _closed_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_checks_are_concurrent_cached_and_reuse_connections(server, tmp_path):
+    urls = [f"{server}/img/{i}.png" for i in range(20)]
+    urls += [f"{server}/page", f"{server}/missing.png", f"{server}/moved", f"{server}/get-only.png"]
+    validator = remote.RemoteImageValidator(cache_file=tmp_path / "checks.json")
+
+    results = validator.check(urls)
+
+    assert all(results[u].ok for u in urls[:20])
+    assert results[f"{server}/page"].message == "Not an image (content-type: text/html)"
+    assert results[f"{server}/missing.png"].message == "HTTP 404"
+    assert results[f"{server}/moved"].ok
+    assert results[f"{server}/get-only.png"].ok
+    # At most two keep-alive connections to the host
+    assert len(StandIn.ports) <= remote.PER_HOST
+
+    seen = len(StandIn.requests)
+    again = remote.RemoteImageValidator(cache_file=tmp_path / "checks.json").check(urls)
+    assert len(StandIn.requests) == seen  # everything came from the cache
+    assert {u: c.ok for u, c in again.items()} == {u: c.ok for u, c in results.items()}
+
+    remote.RemoteImageValidator(cache_file=tmp_path / "checks.json", ttl=0).check(urls[:1])
+    assert len(StandIn.requests) == seen + 1
+    validator.close()
+
+
+def test_down_host_costs_one_attempt(tmp_path, capsys):
+    base = f"http://127.0.0.1:{_closed_port()}"
+    urls = [f"{base}/img/{i}.png" for i in range(30)]
+    validator = remote.RemoteImageValidator(cache_file=tmp_path / "checks.json", timeout=2)
+
+    start = time.monotonic()
+    failed = remote.warn_unreachable_images(urls, "doc.md", validator)
+
+    assert time.monotonic() - start < 5
+    assert len(failed) == 30
+    assert all(c.message.startswith("URL error:") for c in failed)
+    assert "Found 30 inaccessible remote image(s) in doc.md" in capsys.readouterr().err
+
+
+def test_md2html_validates_on_the_host(server, tmp_path, monkeypatch, capsys):
+    f = tmp_path / "a.md"
+    f.write_text(f"# A\n\n![ok]({server}/img/a.png)\n\n![gone]({server}/gone.png)\n")
+    monkeypatch.setattr(conv.subprocess, "run", lambda *a, **k: pytest.fail("no container expected"))
+
+    (job,) = conv._plan_md2html("docker", [f], ["--toc"], self_contained=False)
+
+    err = capsys.readouterr().err
+    assert f"{server}/gone.png: HTTP 404" in err
+    assert "a.png" not in err
+    assert StandIn.requests[0][0] == "HEAD"  # linked, not downloaded
+    assert job.source == f.resolve() and job.cleanup == []
+
+
+def test_cache_fetches_once_and_revalidates(server, tmp_path):
+    urls = [f"{server}/etag/a.png", f"{server}/etag/b.png", f"{server}/page"]
+    cache = remote.RemoteCache(tmp_path / "remote")
+
+    results = cache.fetch(urls)
+
+    a = results[urls[0]].path
+    assert a.read_bytes() == b"PNG/etag/a.png"
+    assert a.parent.parent == cache.files and a.suffix == ".png"
+    assert results[urls[2]].message == "Not an image (content-type: text/html)"
+    seen = len(StandIn.requests)
+    assert remote.RemoteCache(tmp_path / "remote").fetch(urls[:2])[urls[1]].ok
+    assert len(StandIn.requests) == seen  # fresh copies, no requests
+
+    expired = remote.RemoteCache(tmp_path / "remote", ttl=0).fetch(urls[:1])
+    assert expired[urls[0]].path == a
+    assert StandIn.requests[seen:] == [("GET", "/etag/a.png")]  # answered with 304
+    cache.close()
+
+
+def test_offline_uses_cached_copies_only(server, tmp_path, capsys):
+    cached, missing = f"{server}/etag/a.png", f"{server}/etag/b.png"
+    remote.RemoteCache(tmp_path / "remote").fetch([cached])
+    seen = len(StandIn.requests)
+
+    offline = remote.RemoteCache(tmp_path / "remote", ttl=0, offline=True)
+    files = remote.cache_remote_images([cached, missing], "doc.md", offline)
+
+    assert list(files) == [cached]
+    assert len(StandIn.requests) == seen
+    assert f"{missing}: Not cached (offline mode)" in capsys.readouterr().err
+
+
+def test_embedded_images_are_read_from_the_cache(server, tmp_path, monkeypatch):
+    f = tmp_path / "a.md"
+    url = f"{server}/etag/a.png"
+    f.write_text(f"# A\n\n![ok]({url})\n\n<img src=\"{url}\" />\n")
+
+    (job,) = conv._plan_md2html("docker", [f], ["--toc"])
+    (docx,) = conv._plan_md2docx([f], ["--toc"], "pandoc", None, None, runtime="docker")
+
+    files = remote.RemoteCache().files
+    assert (files, conv.REMOTE_MOUNT, True) in job.mounts
+    (temp,) = job.cleanup
+    content = temp.read_text()
+    assert url not in content
+    assert content.count(f"{conv.REMOTE_MOUNT}/") == 2
+    assert (files, conv.REMOTE_MOUNT, True) in docx.mounts
+    assert len(StandIn.requests) == 1  # one download for both conversions
@@ -22,3 +22,93 @@ def test_get_container_runtime_prefers_podman(monkeypatch):
 
     monkeypatch.setattr("shutil.which", which)
     assert rt.get_container_runtime() == "podman"
+
+
+class Recorder:
+    def __init__(self, returncode=0):
+        self.cmds = []
+        self.returncode = returncode
+
+    def __call__(self, cmd, check=False, **k):
+        self.cmds.append(cmd)
+
+        class R:
+            pass
+
+        r = R()
+        r.returncode = self.returncode
+        return r
+
+
+def _context(tmp_path, print_js="console.log(1)"):
+    (tmp_path / "scripts").mkdir(exist_ok=True)
+    (tmp_path / "scripts" / "print.js").write_text(print_js)
+    (tmp_path / "Dockerfile").write_text(
+        "FROM node\nCOPY scripts/print.js /app/print.js\n"
+    )
+    return tmp_path
+
+
+def test_image_tag_changes_with_copied_build_inputs(tmp_path):
+    ctx = _context(tmp_path)
+    first = rt.image_name(ctx)
+    assert first.startswith("md2:") and first != rt.IMAGE_NAME
+
+    rt.clear_probe_cache()
+    _context(tmp_path, print_js="console.log(2)")
+    assert rt.image_name(ctx) != first
+
+
+def test_image_tag_ignores_mounted_files(tmp_path):
+    ctx = _context(tmp_path)
+    first = rt.image_name(ctx)
+    rt.clear_probe_cache()
+    (tmp_path / "scripts" / "md2html.sh").write_text("echo mounted, not copied")
+    assert rt.image_name(ctx) == first
+
+
+def test_ensure_image_builds_missing_tag_once(monkeypatch, tmp_path):
+    ctx = _context(tmp_path)
+    rec = Recorder(returncode=1)  # image inspect fails -> build
+    monkeypatch.setattr(rt.subprocess, "run", rec)
+
+    rt.ensure_image("docker", ctx)
+    assert rec.cmds[0][:3] == ["docker", "image", "inspect"]
+    assert rec.cmds[1][:2] == ["docker", "build"]
+    assert rt.image_name(ctx) in rec.cmds[1]
+    assert rt.IMAGE_NAME in rec.cmds[1]
+
+    rt.ensure_image("docker", ctx)
+    assert len(rec.cmds) == 2  # known good: no further subprocess
+
+
+def test_ensure_image_probe_is_cached_on_disk(monkeypatch, tmp_path):
+    ctx = _context(tmp_path)
+    rec = Recorder()
+    monkeypatch.setattr(rt.subprocess, "run", rec)
+
+    rt.ensure_image("docker", ctx)
+    assert len(rec.cmds) == 1
+
+    rt.clear_probe_cache()  # simulate a new process
+    rt.ensure_image("docker", ctx)
+    assert len(rec.cmds) == 1
+
+
+def test_probe_is_dropped_when_the_image_went_away(monkeypatch, tmp_path):
+    ctx = _context(tmp_path)
+    rec = Recorder()
+    monkeypatch.setattr(rt.subprocess, "run", rec)
+    rt.ensure_image("docker", ctx)
+
+    # A failing job is not a reason to inspect the image
+    rt.check_image_after_failure("docker", 1, ctx)
+    assert len(rec.cmds) == 1
+
+    # The runtime could not start the container and the image is gone
+    rec.returncode = 1
+    rt.check_image_after_failure("docker", rt.RUNTIME_ERROR, ctx)
+    assert rec.cmds[1][:3] == ["docker", "image", "inspect"]
+    rt.clear_probe_cache()  # the on-disk probe is gone as well
+    rt.ensure_image("docker", ctx)
+    assert rec.cmds[3][:2] == ["docker", "build"]
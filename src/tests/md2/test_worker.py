@@ -0,0 +1,175 @@
+import subprocess
+import threading
+
+import pytest
+import md2.conversion as conv
+import md2.worker as worker
+
+
+class Recorder:
+    def __init__(self, fail_on=None):
+        self.cmds = []
+        self.fail_on = fail_on
+
+    def __call__(self, cmd, check=False, **k):
+        self.cmds.append(cmd)
+        returncode = 1 if self.fail_on and self.fail_on in cmd else 0
+        if check and returncode:
+            raise subprocess.CalledProcessError(returncode, cmd)
+
+        class R:
+            pass
+
+        r = R()
+        r.returncode = returncode
+        return r
+
+
+@pytest.fixture
+def worker_env(monkeypatch, fake_runtime):
+    monkeypatch.setenv("MD2_WORKER", "1")
+    yield
+    worker._workers.clear()
+
+
+def _started(cmds):
+    return [c for c in cmds if c[1:3] == ["run", "-d"]]
+
+
+def _execs(cmds):
+    return [c for c in cmds if c[1] == "exec" and c[-1] != "true"]
+
+
+def test_jobs_are_dispatched_into_one_container(monkeypatch, tmp_path, worker_env):
+    files = []
+    for name in ("a", "b", "c"):
+        f = tmp_path / f"{name}.md"
+        f.write_text(f"# {name}")
+        files.append(f)
+    rec = Recorder()
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+
+    out = conv.md2html(files)
+
+    assert [p.name for p in out] == ["a.html", "b.html", "c.html"]
+    started = _started(rec.cmds)
+    assert len(started) == 1
+    assert "sleep" in started[0]
+    assert f"{tmp_path}:/work" in started[0]
+    execs = _execs(rec.cmds)
+    assert len(execs) == 3
+    assert all("/scripts/md2html.sh" in c for c in execs)
+    assert "INTERNAL_RESOURCES=1" in execs[0]
+
+
+def test_worker_is_recycled_after_max_jobs(monkeypatch, tmp_path, worker_env):
+    monkeypatch.setenv("MD2_WORKER_MAX_JOBS", "2")
+    files = []
+    for name in ("a", "b", "c"):
+        f = tmp_path / f"{name}.md"
+        f.write_text(f"# {name}")
+        files.append(f)
+    rec = Recorder()
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+
+    conv.md2html(files)
+
+    assert len(_started(rec.cmds)) == 2
+    removed = [c for c in rec.cmds if c[1:3] == ["rm", "-f"]]
+    assert len(removed) == 1
+
+
+def test_failed_pdf_job_recycles_worker(monkeypatch, tmp_path, worker_env):
+    f = tmp_path / "a.html"
+    f.write_text("<html><body></body></html>")
+    rec = Recorder(fail_on="/scripts/pdf_generator.sh")
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+
+    with pytest.raises(conv.ConversionError):
+        conv.html2pdf([f])
+
+    assert [c for c in rec.cmds if c[1:3] == ["rm", "-f"]]
+    assert worker._workers == {}
+
+
+def test_pandoc_server_is_requested_in_worker(monkeypatch, tmp_path, worker_env):
+    f = tmp_path / "a.md"
+    f.write_text("# a")
+    rec = Recorder()
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+
+    conv.md2html([f])
+    monkeypatch.setenv("MD2_PANDOC_SERVER", "1")
+    conv.md2html([f])
+
+    execs = _execs(rec.cmds)
+    assert "MD2_PANDOC_SERVER=1" not in execs[0]
+    assert "MD2_PANDOC_SERVER=1" in execs[1]
+
+
+def test_unprivileged_jobs_get_their_own_worker(monkeypatch, tmp_path, worker_env):
+    md = tmp_path / "a.md"
+    md.write_text("# a")
+    html = tmp_path / "b.html"
+    html.write_text("<html><body></body></html>")
+    rec = Recorder()
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+
+    conv.md2html([md])
+    conv.html2pdf([html])
+
+    privileged, plain = _started(rec.cmds)
+    assert "--cap-add=SYS_ADMIN" in privileged
+    assert "--cap-add=SYS_ADMIN" not in plain
+    assert not any(a.startswith("--security-opt") for a in plain)
+
+
+def test_dead_idle_worker_is_replaced_before_a_job(monkeypatch, tmp_path, worker_env):
+    files = []
+    for name in ("a", "b"):
+        f = tmp_path / f"{name}.md"
+        f.write_text(f"# {name}")
+        files.append(f)
+    rec = Recorder()
+    monkeypatch.setattr(conv.subprocess, "run", rec)
+    conv.md2html(files[:1])
+
+    # The idle worker went away: its health check fails
+    rec.fail_on = "true"
+    conv.md2html(files[1:])
+
+    assert len(_started(rec.cmds)) == 2
+    assert len(_execs(rec.cmds)) == 2
+    assert [c for c in rec.cmds if c[1:3] == ["rm", "-f"]]
+
+
+def test_slow_start_does_not_block_other_workers(monkeypatch, worker_env):
+    monkeypatch.setattr(worker.subprocess, "run", Recorder())
+    release = threading.Event()
+    real_start = worker.Worker.start
+
+    def start(self):
+        if self.mounts[0][0] == "/slow":
+            assert release.wait(5)
+        real_start(self)
+
+    monkeypatch.setattr(worker.Worker, "start", start)
+    acquired = []
+    slow = [("/slow", "/work", False)]
+    threads = [
+        threading.Thread(target=lambda: acquired.append(worker._acquire("docker", slow)))
+        for _ in range(2)
+    ]
+    for t in threads:
+        t.start()
+    while not worker._workers:
+        pass
+
+    # Another mount set gets its worker while the first one is still starting
+    fast = worker._acquire("docker", [("/fast", "/work", False)])
+    assert fast.name and not acquired
+
+    release.set()
+    for t in threads:
+        t.join()
+    assert acquired[0] is acquired[1] and acquired[0].name